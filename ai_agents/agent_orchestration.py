@@ -1,74 +1,434 @@
+import asyncio
+import dataclasses
+import sys
+from typing import AsyncIterable, AsyncIterator, Iterable, Union
 from data_classes import *
 from .ticket_analysis_agent import TicketAnalysisAgent
 from .response_generation_agent import ResponseAgent
+from .process_pool import analyze_chunk, analyze_one, create_analysis_pool
+from .customer_history import CustomerHistory, escalate_priority
+from .large_tickets import LargeTicketLimits
+from .near_duplicates import ClusterMatch, NearDuplicateIndex
+from .resolution_cache import ResolutionCache
+from .ticket_store import TicketStore
+from .triage import TriagedTicket
+from .metrics import metrics
 
 
+_LOOK_UP = object()  # _process_ticket looks the near duplicate cluster up itself
+
 
 class TicketProcessor:
-    def __init__(self):
-        self.analysis_agent = TicketAnalysisAgent()
-        self.response_agent = ResponseAgent()
-        self.context = {}  
+    def __init__(self, workers: int = 0, chunk_size: Optional[int] = None, response_templates: Optional[dict[str, str]] = None,
+                 resolution_cache: Optional[ResolutionCache] = None, rules_path: Optional[str] = None,
+                 rules_reload_interval: Optional[float] = None, vectorized_sentiment: bool = False,
+                 large_tickets: Optional[LargeTicketLimits] = None, near_duplicates: Optional[NearDuplicateIndex] = None,
+                 store: Optional[TicketStore] = None, customer_history: Optional[CustomerHistory] = None):
+        # rules_path is a JSON / YAML rules file (see rules.py), with rules_reload_interval it is reloaded whenever it changes.
+        # vectorized_sentiment scores the sentiment of process_batch batches with NumPy (needs numpy, see vector_sentiment.py)
+        # large_tickets analyses tickets over its threshold in bounded memory (see large_tickets.py)
+        self.analysis_agent = TicketAnalysisAgent(rules_path=rules_path, vectorized_sentiment=vectorized_sentiment,
+                                                  large_tickets=large_tickets)
+        self.rules_reload_interval = rules_reload_interval
+        if rules_path and rules_reload_interval:
+            self.analysis_agent.watch_rules(rules_reload_interval)
+        # templates given here are parsed and checked straight away, a bad placeholder raises ValueError at startup
+        self.response_agent = ResponseAgent(response_templates)
+        self.context = {}  # shared defaults for every ticket, each ticket gets its own copy in ticket_context
+
+        # Executor mode: with workers > 0 the CPU heavy ticket analysis runs in a pool of that many processes instead of on
+        # the event loop. process_batch splits the batch into chunks of chunk_size tickets (worked out from the batch size
+        # when not given). Response rendering stays in this process.
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._pool = None
+
+        # optional cache for duplicate tickets, the same content from a customer with the same role skips the analysis
+        self.resolution_cache = resolution_cache
+
+        # optional index of recent tickets: near duplicates get the same resolution.cluster_id and can reuse the analysis
+        # of an earlier one (see near_duplicates.py)
+        self.near_duplicates = near_duplicates
+
+        # optional persistent store, every resolution is written to it in the background for later queries (see ticket_store.py)
+        self.store = store
+
+        # optional per customer history: repeat (and unhappy) customers get a higher priority and a lower confidence,
+        # resolution.escalation says by how much (see customer_history.py)
+        self.customer_history = customer_history
+
+    def warm_up(self):
+        # load the sentiment lexicon before the first ticket arrives, e.g. when a worker starts
+        self.analysis_agent.warm_up()
+        if self.workers:
+            self._analysis_pool()
+
+    def close(self):
+        # stop the analysis worker processes, if there are any, and the rules file watcher
+        self.analysis_agent.stop_watching_rules()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _analysis_pool(self):
+        if self._pool is None:
+            self._pool = create_analysis_pool(self.workers, self.analysis_agent.lexicon_path, self.analysis_agent.rules_path,
+                                              self.rules_reload_interval, self.analysis_agent.vectorized_sentiment,
+                                              self.analysis_agent.large_tickets)
+        return self._pool
+
+    async def _analyze_ticket(self, ticket_content: str, customer_info: dict) -> TicketAnalysis:
+        if not self.workers:
+            return await self.analysis_agent.analyze_ticket(ticket_content=ticket_content, customer_info=customer_info)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._analysis_pool(), analyze_one, ticket_content, customer_info)
+
+    async def _cached_analysis(self, ticket_content: str, customer_info: dict) -> TicketAnalysis:
+        key, analysis = self._from_cache(ticket_content, customer_info)
+        if analysis is None:
+            analysis = await self._analyze_ticket(ticket_content, customer_info)
+            if key is not None:
+                self.resolution_cache.put(key, analysis)
+        return analysis
+
+    def _from_cache(self, ticket_content: str, customer_info: dict) -> tuple:
+        # (cache key, cached analysis), the key is None when the ticket can not be cached and the analysis when it is not there
+        key = self._cache_key(ticket_content, customer_info)
+        if key is None:
+            return None, None
+        analysis = self.resolution_cache.get(key)
+        if analysis is not None:
+            metrics.incr("resolution_cache_hits")
+        return key, analysis
+
+    async def _cached_batch(self, tickets: List[tuple]) -> List[TicketAnalysis]:
+        if self.resolution_cache is None:
+            return await self._analyze_batch(tickets)
+        keys = [self._cache_key(ticket_content, customer_info) for ticket_content, customer_info in tickets]
+        analyses = [self.resolution_cache.get(key) if key is not None else None for key in keys]
+        metrics.incr("resolution_cache_hits", sum(analysis is not None for analysis in analyses))
+
+        # only the tickets that were not in the cache are analysed
+        missing = [i for i, analysis in enumerate(analyses) if analysis is None]
+        if missing:
+            for i, analysis in zip(missing, await self._analyze_batch([tickets[i] for i in missing])):
+                analyses[i] = analysis
+                if keys[i] is not None and not isinstance(analysis, Exception):
+                    self.resolution_cache.put(keys[i], analysis)
+        return analyses
+
+    def _cache_key(self, ticket_content: str, customer_info: dict) -> Optional[str]:
+        # None when there is no cache or the ticket can not be cached (it then goes through the normal analysis and its errors)
+        if self.resolution_cache is None or not isinstance(ticket_content, str) or not isinstance(customer_info, dict):
+            return None
+        try:
+            return self.resolution_cache.key(ticket_content, customer_info, self._analysis_namespace(ticket_content))
+        except Exception:
+            return None
+
+    def _analysis_namespace(self, ticket_content: str) -> str:
+        # the rules are part of the key, so analyses made with older rules are not used after a reload,
+        # and so are the limits for large tickets, their analysis depends on them
+        namespace = self.analysis_agent.rules.fingerprint
+        if self.analysis_agent.is_large(ticket_content):
+            namespace += ":" + self.analysis_agent.large_tickets.tag
+        return namespace
+
+    def _near_duplicate(self, ticket_content: str, customer_info: dict) -> Optional[ClusterMatch]:
+        # the ticket's cluster, None when there is no index or the ticket can not be indexed
+        if self.near_duplicates is None or not isinstance(ticket_content, str):
+            return None
+        try:
+            match = self.near_duplicates.assign(ticket_content, customer_info, self._analysis_namespace(ticket_content))
+        except Exception:
+            return None
+        if match is not None and match.similarity:
+            metrics.incr("near_duplicates")
+            if match.analysis is not None:
+                metrics.incr("near_duplicate_reuses")
+        return match
+
+    def _escalate(self, customer_info: dict, analysis: TicketAnalysis) -> tuple:
+        # (analysis, escalation): records the ticket in the customer's history, an escalated customer gets a copy of the
+        # analysis with the higher priority (the cached and near duplicate analyses stay as they were). escalation is
+        # None without a history or for a customer that can not be told apart.
+        if self.customer_history is None:
+            return analysis, None
+        snapshot = self.customer_history.record(customer_info, analysis.sentiment)
+        if snapshot is None:
+            return analysis, None
+        priority = escalate_priority(analysis.priority, snapshot.escalation)
+        if priority is not analysis.priority:
+            metrics.incr("customer_escalations")
+            analysis = dataclasses.replace(analysis, priority=priority)
+        return analysis, snapshot.escalation
+
+    def _resolve(self, ticket: dict[str, any], analysis: TicketAnalysis, response_templates: dict[str, str],
+                 match: Optional[ClusterMatch]) -> TicketResolution:
+        # everything after the analysis, the same for process_ticket, process_batch and the second stage of a triaged ticket
+        analysis, escalation = self._escalate(ticket.get("customer_info", {}), analysis)
+
+        # Generate a response based on analysis and context by calling the responseAgent class
+        response = self.response_agent.build_response(
+            ticket_analysis=analysis,
+            response_templates=response_templates,
+            context=self.ticket_context(ticket),
+            escalation=escalation or 0.0
+        )
+
+        # return resolved analysed ticket
+        return TicketResolution(
+            ticket_id=ticket.get("id", "Unknown"),
+            analysis=analysis,
+            response=response,
+            cluster_id=match.cluster_id if match is not None else None,
+            escalation=escalation
+        )
+
+    async def _analyze_batch(self, tickets: List[tuple]) -> List[TicketAnalysis]:
+        if not self.workers:
+            return await self.analysis_agent.analyze_batch(tickets)
+        # shard the batch so every worker gets a few chunks, which keeps them all busy without sending one ticket at a time
+        chunk_size = self.chunk_size or max(1, min(256, -(-len(tickets) // (self.workers * 4))))
+        loop = asyncio.get_running_loop()
+        pool = self._analysis_pool()
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(pool, analyze_chunk, tickets[start:start + chunk_size])
+            for start in range(0, len(tickets), chunk_size)
+        ))
+        return [analysis for chunk in chunks for analysis in chunk]
+
+    def ticket_context(self, ticket: dict[str, any]) -> dict[str, any]:
+        # Context for one ticket: the shared defaults plus basic ticket data like customer name and subject. Also add default values.
+        # It is a new dict per ticket so concurrent tickets on the same processor never see each other's customer name.
+        context = dict(self.context)
+        context["subject"] = ticket.get("subject", "Unidentified")
+        context["name"] = ticket.get("customer_info", {}).get("name", "Customer_Name")
+        return context
+
+    async def process_ticket(self, ticket: dict[str, any], response_templates: dict[str, str], raise_errors: bool = False) -> TicketResolution:
+        # with raise_errors the exception is raised instead of being turned into the default error resolution, the
+        # work queue (work_queue.py) uses that to retry the ticket and dead-letter it when it keeps failing
+        metrics.incr("tickets_processed")
+        with metrics.stage("process_ticket"):
+            resolution = await self._process_ticket(ticket, response_templates, raise_errors)
+        if self.store is not None:
+            await self._store([ticket], [resolution], raise_errors)
+        return resolution
 
-    async def process_ticket(self, ticket: dict[str, any], response_templates: dict[str, str]) -> TicketResolution:
+    async def _process_ticket(self, ticket: dict[str, any], response_templates: dict[str, str], raise_errors: bool = False,
+                              match: Union[ClusterMatch, None, object] = _LOOK_UP) -> TicketResolution:
+        # match is the ticket's near duplicate cluster when process_batch already looked it up
         
         try:
-            # Update context with basic ticket data like customer name and subject from ticket. Also add default values
-            self.context["subject"] = ticket.get("subject", "Unidentified")
-            customer_name = ticket.get("customer_info", {}).get("name", "Customer_Name")
-            self.context["name"] = customer_name
+            ticket_content = ticket.get("content", ticket.get("subject"))
+            customer_info = ticket.get("customer_info", {})
+            if match is _LOOK_UP:
+                match = self._near_duplicate(ticket_content, customer_info)
             
             # Analyze the ticket content and call the ticketanalysis class first. Also add default values just in case
-            analysis = await self.analysis_agent.analyze_ticket(
-                ticket_content=ticket.get("content", ticket.get("subject")),
-                customer_info=ticket.get("customer_info", {})
-            )
-            
-            # Generate a response based on analysis and context by calling the responseAgent class 
-            response = await self.response_agent.generate_response(
-                ticket_analysis=analysis,
-                response_templates=response_templates,
-                context=self.context
-            )
-            
-            # return resolved analysed ticket
-            return TicketResolution(
-                ticket_id=ticket.get("id", "Unknown"),
-                analysis=analysis,
-                response=response
-            )
+            if match is not None and match.analysis is not None:
+                analysis = match.analysis  # a near duplicate was analysed a moment ago
+            else:
+                analysis = await self._cached_analysis(
+                    ticket_content=ticket_content,
+                    customer_info=customer_info
+                )
+                if match is not None:
+                    self.near_duplicates.remember(match, analysis)
+            return self._resolve(ticket, analysis, response_templates, match)
         
         except Exception as e:
-            # Error handling here and return a resolution with an error message
-            #dummy response text
-            error_response = ResponseSuggestion(
-                response_text="An error occurred while processing the ticket.",
-                confidence_score=0.0,
-                requires_approval=True,
-                suggested_actions=["Review error logs", "Contact system administrator"]
-            )
-
-            # default analysis incase of error to keep the system running and still displaying a solution with response type
-            default_analysis = TicketAnalysis(
-                category=TicketCategory.TECHNICAL,
-                priority=Priority.LOW,
-                key_points=[],
-                required_expertise=["Error Handling"],
-                sentiment=0.0,
-                urgency_indicators=[],
-                business_impact="Low",
-                suggested_response_type="general_response"
-            )
-
-            # default ticket resolution return type 
-            return TicketResolution(
-                ticket_id=ticket.get("id", "Unknown"),
-                analysis=default_analysis,
-                response=error_response
-            )
+            if raise_errors:
+                raise
+            return self._error_resolution(ticket)
 
+    async def process_batch(self, tickets: List[dict[str, any]], response_templates: dict[str, str]) -> List[TicketResolution]:
+        # Analyse a whole batch of tickets with one call to the analysis agent (or spread over the worker processes) so the
+        # rule tables and the sentiment analyzer are shared by every ticket. Resolutions come back in the same order as the tickets.
+        pairs = [(ticket.get("content", ticket.get("subject")), ticket.get("customer_info", {})) for ticket in tickets]
+        # near duplicates of tickets that were analysed a moment ago (earlier batches) are not analysed again
+        matches = [self._near_duplicate(ticket_content, customer_info) for ticket_content, customer_info in pairs]
+        missing = [i for i, match in enumerate(matches) if match is None or match.analysis is None]
+        try:
+            analyses = [match.analysis if match is not None else None for match in matches]
+            for i, analysis in zip(missing, await self._cached_batch([pairs[i] for i in missing])):
+                analyses[i] = analysis
+                if matches[i] is not None and not isinstance(analysis, Exception):
+                    self.near_duplicates.remember(matches[i], analysis)
+        except Exception as e:
+            # a bad ticket somewhere in the batch, so go one by one and only give the bad tickets the default resolution
+            resolutions = []
+            for ticket, match in zip(tickets, matches):
+                metrics.incr("tickets_processed")
+                with metrics.stage("process_ticket"):
+                    resolutions.append(await self._process_ticket(ticket, response_templates, match=match))
+            if self.store is not None:
+                await self._store(tickets, resolutions)
+            return resolutions
 
+        metrics.incr("tickets_processed", len(tickets))
 
+        resolutions = []
+        for ticket, analysis, match in zip(tickets, analyses, matches):
+            if isinstance(analysis, Exception):  # a worker process could not analyse this ticket
+                resolutions.append(self._error_resolution(ticket))
+                continue
+            try:
+                resolutions.append(self._resolve(ticket, analysis, response_templates, match))
+            except Exception as e:
+                resolutions.append(self._error_resolution(ticket))
+        if self.store is not None:
+            await self._store(tickets, resolutions)
+        return resolutions
 
+    async def triage_ticket(self, ticket: dict[str, any], response_templates: dict[str, str]) -> TriagedTicket:
+        # Triage only mode: category, priority and team now, the sentiment, key points and response only when the
+        # TriagedTicket's analysis / response / resolution is read (see triage.py). Always runs in this process, the
+        # triage is too cheap to send to a worker.
+        return self.triage(ticket, response_templates)
 
-        
+    async def triage_batch(self, tickets: List[dict[str, any]], response_templates: dict[str, str]) -> List[TriagedTicket]:
+        return [self.triage(ticket, response_templates) for ticket in tickets]
+
+    async def process_triaged(self, triaged: TriagedTicket, ticket: dict[str, any], response_templates: dict[str, str]) -> TicketResolution:
+        # The resolution of a ticket that was triaged first, the same as process_ticket's. In this process the analysis goes
+        # on from the triage's keyword scan, with worker processes the ticket is analysed in a worker like any other.
+        if self.workers and not triaged.resolved:
+            return await self.process_ticket(ticket, response_templates)
+        return triaged.resolution
+
+    def triage(self, ticket: dict[str, any], response_templates: dict[str, str]) -> TriagedTicket:
+        # triage_ticket for callers that are not coroutines, e.g. PriorityScheduler.submit
+        ticket_id = ticket.get("id", "Unknown")
+        ticket_content = ticket.get("content", ticket.get("subject"))
+        customer_info = ticket.get("customer_info", {})
+        try:
+            triage, rules, keyword_scan = self.analysis_agent._triage(ticket_content, customer_info)
+        except Exception as e:
+            # same as process_ticket: a ticket that can not be analysed gets the default error resolution
+            resolution = self._error_resolution(ticket)
+            analysis = resolution.analysis
+            triage = TicketTriage(analysis.category, analysis.priority, analysis.required_expertise, analysis.business_impact,
+                                  analysis.suggested_response_type)
+            return TriagedTicket(ticket_id, triage, resolution=resolution)
+
+        def finish() -> TicketResolution:
+            # the rest of process_ticket: near duplicates, the resolution cache, customer history and the store see the
+            # ticket as if it had been processed now, only the analysis goes on from the triage's keyword scan
+            metrics.incr("tickets_processed")
+            with metrics.stage("process_ticket"):
+                try:
+                    match = self._near_duplicate(ticket_content, customer_info)
+                    if match is not None and match.analysis is not None:
+                        analysis = match.analysis
+                    else:
+                        key, analysis = self._from_cache(ticket_content, customer_info)
+                        if analysis is None:
+                            analysis = self.analysis_agent.finish_analysis(ticket_content, customer_info, rules, keyword_scan,
+                                                                          triage.category, triage=triage)
+                            if key is not None:
+                                self.resolution_cache.put(key, analysis)
+                        if match is not None:
+                            self.near_duplicates.remember(match, analysis)
+                    resolution = self._resolve(ticket, analysis, response_templates, match)
+                except Exception as e:
+                    resolution = self._error_resolution(ticket)
+            if self.store is not None:
+                self._store_from_sync(ticket, resolution)
+            return resolution
+
+        return TriagedTicket(ticket_id, triage, finish)
+
+    async def _store(self, tickets: List[dict[str, any]], resolutions: List[TicketResolution], raise_errors: bool = False) -> None:
+        # a row that can not be stored (a closed store, a resolution without an analysis) is counted and reported, the
+        # resolution is still returned. With raise_errors the error is raised, the work queue must not acknowledge the ticket.
+        for ticket, resolution in zip(tickets, resolutions):
+            try:
+                await self.store.add_async(ticket, resolution)
+            except Exception as e:
+                self._store_failed(ticket, e)
+                if raise_errors:
+                    raise
+
+    def _store_from_sync(self, ticket: dict[str, any], resolution: TicketResolution) -> None:
+        # for the second stage of a triaged ticket, which is not a coroutine but is often read on the event loop: there
+        # the row goes in without waiting (past max_pending the store keeps it in its overflow list), anywhere else add() may wait
+        try:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                self.store.add(ticket, resolution)
+            else:
+                self.store.add_nowait(ticket, resolution)
+        except Exception as e:
+            self._store_failed(ticket, e)
+
+    def _store_failed(self, ticket: dict[str, any], error: Exception) -> None:
+        metrics.incr("store_errors")
+        ticket_id = ticket.get("id", "Unknown") if isinstance(ticket, dict) else "Unknown"
+        print(f"Could not store the resolution of ticket {ticket_id}: {error}", file=sys.stderr)
+
+    async def process_many(self, tickets: Union[Iterable[dict[str, any]], AsyncIterable[dict[str, any]]], response_templates: dict[str, str],
+                           max_in_flight: int = 100) -> AsyncIterator[TicketResolution]:
+        # Process a (possibly endless) stream of tickets concurrently on this one processor and yield each resolution as soon as
+        # it is done, so the order can differ from the input. At most max_in_flight tickets are pulled from the input and
+        # processed at the same time, the next ticket is only read once one of them has finished.
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        is_async = hasattr(tickets, "__aiter__")
+        ticket_iterator = tickets.__aiter__() if is_async else iter(tickets)
+        in_flight = set()
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    try:
+                        ticket = await ticket_iterator.__anext__() if is_async else next(ticket_iterator)
+                    except (StopIteration, StopAsyncIteration):
+                        exhausted = True
+                        break
+                    in_flight.add(asyncio.ensure_future(self.process_ticket(ticket, response_templates)))
+
+                if not in_flight:
+                    break
+
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # the caller stopped early (or was cancelled), do not leave tickets running in the background
+            for task in in_flight:
+                task.cancel()
+
+    def _error_resolution(self, ticket: dict[str, any]) -> TicketResolution:
+        metrics.incr("error_resolutions")
+        # Error handling here and return a resolution with an error message
+        #dummy response text
+        error_response = ResponseSuggestion(
+            response_text="An error occurred while processing the ticket.",
+            confidence_score=0.0,
+            requires_approval=True,
+            suggested_actions=["Review error logs", "Contact system administrator"]
+        )
+
+        # default analysis incase of error to keep the system running and still displaying a solution with response type
+        default_analysis = TicketAnalysis(
+            category=TicketCategory.TECHNICAL,
+            priority=Priority.LOW,
+            key_points=[],
+            required_expertise=["Error Handling"],
+            sentiment=0.0,
+            urgency_indicators=[],
+            business_impact="Low",
+            suggested_response_type="general_response"
+        )
+
+        # default ticket resolution return type 
+        return TicketResolution(
+            ticket_id=ticket.get("id", "Unknown"),
+            analysis=default_analysis,
+            response=error_response
+        )
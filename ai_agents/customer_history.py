@@ -0,0 +1,151 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+from data_classes import *
+
+# Recent history per customer (TicketProcessor(customer_history=CustomerHistory())), so a customer filing their fifth
+# ticket in an hour is not treated like a first timer.
+#
+# For every customer there is a ring buffer of `buckets` ticket counters covering the last `window` seconds (a
+# bucket per window / buckets seconds, a ticket leaves the count with its bucket) and a running total, and an average
+# sentiment that decays with `half_life` (older tickets count for less). Recording a ticket is constant time: the
+# buckets that went out of the window since the customer's last ticket are cleared (at most `buckets` of them) and the
+# decay is one multiplication. Customers are kept in LRU order, once there are max_customers the one whose last ticket
+# is oldest is dropped. A customer takes about 0.5 KB.
+#
+# The escalation (0 to 1) of a ticket grows with the customer's tickets in the window, from 0 for the first to 1 at
+# escalate_after, plus up to half for a customer whose average sentiment is below unhappy_below over 2 or more tickets.
+# TicketProcessor raises the priority one level from an escalation of 0.5 and two levels at 1.0, and the response
+# confidence goes down with it (see ResponseAgent), so repeat and unhappy customers reach a human sooner.
+# A customer is told apart by the first of "id", "customer_id", "email" and "name" in customer_info, tickets without
+# any of them have no history. The history is kept in memory only, it is per process.
+
+DEFAULT_MAX_CUSTOMERS = 100000
+DEFAULT_WINDOW = 3600.0
+DEFAULT_BUCKETS = 12
+DEFAULT_HALF_LIFE = 86400.0
+DEFAULT_ESCALATE_AFTER = 5
+DEFAULT_UNHAPPY_BELOW = 0.35
+
+CUSTOMER_KEYS = ("id", "customer_id", "email", "name")
+
+
+@dataclass
+class CustomerSnapshot:
+    recent_tickets: int        # tickets in the window, this one included
+    average_sentiment: float   # decayed average, this ticket included
+    escalation: float
+
+
+class _Customer:
+    __slots__ = ("counts", "bucket", "recent", "sentiment", "weight", "updated_at")
+
+    def __init__(self, buckets: int):
+        self.counts = array("I", bytes(4 * buckets))
+        self.bucket = 0        # number of the newest bucket (time // bucket width)
+        self.recent = 0        # sum of counts
+        self.sentiment = 0.0
+        self.weight = 0.0      # decayed number of tickets behind the average
+        self.updated_at = 0.0
+
+
+def customer_key(customer_info) -> Optional[str]:
+    if not isinstance(customer_info, dict):
+        return None
+    for key in CUSTOMER_KEYS:
+        value = customer_info.get(key)
+        if value not in (None, ""):
+            return f"{key}:{str(value).strip().lower()}"
+    return None
+
+
+class CustomerHistory:
+    def __init__(self, max_customers: int = DEFAULT_MAX_CUSTOMERS, window: float = DEFAULT_WINDOW, buckets: int = DEFAULT_BUCKETS,
+                 half_life: float = DEFAULT_HALF_LIFE, escalate_after: int = DEFAULT_ESCALATE_AFTER,
+                 unhappy_below: float = DEFAULT_UNHAPPY_BELOW, clock: Callable[[], float] = time.time):
+        if max_customers < 1 or buckets < 1 or window <= 0 or half_life <= 0:
+            raise ValueError("max_customers, buckets, window and half_life must be positive")
+        if escalate_after < 2 or not 0 <= unhappy_below <= 1:
+            raise ValueError("escalate_after must be at least 2 and unhappy_below in [0, 1]")
+        self.max_customers = max_customers
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.half_life = half_life
+        self.escalate_after = escalate_after
+        self.unhappy_below = unhappy_below
+        self.clock = clock
+        self.evictions = 0
+        self._customers: "OrderedDict[str, _Customer]" = OrderedDict()  # least recently seen first
+        self._lock = threading.Lock()
+
+    def record(self, customer_info: Optional[dict], sentiment: float) -> Optional[CustomerSnapshot]:
+        # adds a ticket of the customer (sentiment 0 to 1, as in TicketAnalysis) and returns their history with it,
+        # None when the customer can not be told apart
+        key = customer_key(customer_info)
+        if key is None:
+            return None
+        with self._lock:
+            now = self.clock()
+            customer = self._customers.get(key)
+            if customer is None:
+                customer = self._customers[key] = _Customer(self.buckets)
+                customer.bucket = int(now // self.bucket_width)
+                customer.updated_at = now
+                if len(self._customers) > self.max_customers:
+                    self._customers.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._customers.move_to_end(key)
+            self._advance(customer, now)
+
+            customer.counts[customer.bucket % self.buckets] += 1
+            customer.recent += 1
+            decay = 0.5 ** (max(0.0, now - customer.updated_at) / self.half_life)
+            weight = customer.weight * decay
+            customer.sentiment = (customer.sentiment * weight + sentiment) / (weight + 1)
+            customer.weight = weight + 1
+            customer.updated_at = now
+            return CustomerSnapshot(customer.recent, customer.sentiment, self._escalation(customer))
+
+    def _advance(self, customer: _Customer, now: float) -> None:
+        # clears the buckets that went out of the window since the customer's last ticket
+        bucket = int(now // self.bucket_width)
+        if bucket <= customer.bucket:
+            return
+        if bucket - customer.bucket >= self.buckets:
+            customer.counts = array("I", bytes(4 * self.buckets))
+            customer.recent = 0
+        else:
+            for number in range(customer.bucket + 1, bucket + 1):
+                slot = number % self.buckets
+                customer.recent -= customer.counts[slot]
+                customer.counts[slot] = 0
+        customer.bucket = bucket
+
+    def _escalation(self, customer: _Customer) -> float:
+        repeat = (customer.recent - 1) / (self.escalate_after - 1)
+        unhappy = 0.0
+        if customer.weight > 1.0 + 1e-9 and self.unhappy_below > 0 and customer.sentiment < self.unhappy_below:
+            unhappy = 0.5 * (self.unhappy_below - customer.sentiment) / self.unhappy_below
+        return round(min(1.0, repeat + unhappy), 2)
+
+    def __len__(self) -> int:
+        return len(self._customers)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._customers.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"customers": len(self._customers), "evictions": self.evictions}
+
+
+def escalate_priority(priority: Priority, escalation: float) -> Priority:
+    # one level up from an escalation of 0.5, two at 1.0, never past URGENT
+    levels = 2 if escalation >= 1.0 else 1 if escalation >= 0.5 else 0
+    return Priority(min(Priority.URGENT.value, priority.value + levels))
@@ -0,0 +1,202 @@
+import csv
+import json
+import os
+import sys
+from typing import Iterable, Optional, TextIO, Union
+from data_classes import *
+
+# Bulk export of resolutions for analytics, as chunked CSV or (with pyarrow installed) Arrow IPC files and Parquet.
+#
+# Resolutions are buffered in a ResolutionTable, which already keeps them column by column: category and priority as
+# one byte codes, sentiment and confidence as C double arrays, business impact and response type as codes into a value
+# pool, and the key points of all rows as one flat list plus an offsets array. Every chunk_rows resolutions the table
+# is written out as one chunk (a block of CSV rows, an Arrow record batch, a Parquet row group) and a new one is
+# started, so memory is bounded by the chunk size however many tickets go through.
+#
+#   with open_writer("resolutions.parquet", chunk_rows=10000) as writer:
+#       writer.write_many(resolutions)
+#
+# Arrow and Parquet get the columns as they are stored: category, priority, business impact and response type as
+# dictionary arrays, sentiment and confidence handed over as the table's double buffers without a copy, key points as
+# a list<string> column built from the offsets and the flat list. CSV gets one line per resolution, with the key
+# points as a JSON list.
+
+DEFAULT_CHUNK_ROWS = 10000
+
+COLUMNS = ("ticket_id", "category", "priority", "sentiment", "confidence_score", "requires_approval", "business_impact",
+           "suggested_response_type", "cluster_id", "key_points")
+
+# pooled ResolutionTable columns exported as dictionary arrays, their values repeat across the whole export
+DICTIONARY_COLUMNS = ("business_impact", "suggested_response_type")
+
+CATEGORY_NAMES = [category.value for category in ResolutionTable.CATEGORIES]
+PRIORITY_NAMES = [priority.name for priority in sorted(Priority, key=lambda priority: priority.value)]  # code = value - 1
+
+FORMATS = {".csv": "csv", ".arrow": "arrow", ".ipc": "arrow", ".feather": "arrow", ".parquet": "parquet"}
+
+
+class ResolutionWriter:
+    # Buffers resolutions and writes them out chunk_rows at a time. Subclasses write one chunk in _write_chunk.
+    def __init__(self, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be at least 1")
+        self.chunk_rows = chunk_rows
+        self.rows_written = 0
+        self.chunks_written = 0
+        self.closed = False
+        self._table = ResolutionTable()
+
+    def __enter__(self) -> "ResolutionWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def write(self, resolution: TicketResolution) -> None:
+        if self.closed:
+            raise ValueError("write to a closed ResolutionWriter")
+        self._table.append(resolution)
+        if len(self._table) >= self.chunk_rows:
+            self.flush()
+
+    def write_many(self, resolutions: Iterable[TicketResolution]) -> None:
+        for resolution in resolutions:
+            self.write(resolution)
+
+    def flush(self) -> None:
+        # writes the buffered resolutions as a chunk, even when there are fewer than chunk_rows
+        if len(self._table):
+            table, self._table = self._table, ResolutionTable()
+            self._write_chunk(table)
+            self.rows_written += len(table)
+            self.chunks_written += 1
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self.flush()
+            finally:
+                self.closed = True
+                self._close()
+
+    def _write_chunk(self, table: ResolutionTable) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        pass
+
+
+class CsvResolutionWriter(ResolutionWriter):
+    # One header line, then a block of lines per chunk. target is a path or an open text stream (left open on close).
+    def __init__(self, target: Union[str, TextIO], chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        super().__init__(chunk_rows)
+        self._own_stream = isinstance(target, (str, os.PathLike))
+        self.stream = open(target, "w", encoding="utf-8", newline="") if self._own_stream else target
+        self._writer = csv.writer(self.stream)
+        self._writer.writerow(COLUMNS)
+
+    def _write_chunk(self, table: ResolutionTable) -> None:
+        impacts, impact_values = table.codes("business_impact")
+        response_types, response_type_values = table.codes("suggested_response_type")
+        offsets, key_points = table.key_point_offsets, table.key_points
+        self._writer.writerows(
+            (table.ticket_ids[row], CATEGORY_NAMES[table.categories[row]], PRIORITY_NAMES[table.priorities[row] - 1],
+             table.sentiments[row], table.confidence_scores[row], "true" if table.requires_approval[row] else "false",
+             impact_values[impacts[row]], response_type_values[response_types[row]], table.cluster_ids[row] or "",
+             json.dumps(key_points[offsets[row]:offsets[row + 1]]))
+            for row in range(len(table)))
+        self.stream.flush()
+
+    def _close(self) -> None:
+        if self._own_stream:
+            self.stream.close()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:
+        raise ImportError("Arrow and Parquet export needs pyarrow (pip install pyarrow), or export to .csv")
+    return pyarrow
+
+
+class ArrowResolutionWriter(ResolutionWriter):
+    # Arrow IPC file (format="arrow", one record batch per chunk) or Parquet (format="parquet", one row group per chunk).
+    # The dictionaries of the dictionary columns only ever grow, later chunks add their new values as deltas, which is
+    # what an IPC file allows.
+    def __init__(self, path: str, format: str = "parquet", chunk_rows: int = DEFAULT_CHUNK_ROWS, compression: str = "snappy"):
+        if format not in ("arrow", "parquet"):
+            raise ValueError(f"format must be 'arrow' or 'parquet', not {format!r}")
+        super().__init__(chunk_rows)
+        pa = self._pa = _import_pyarrow()
+        self.format = format
+        self.schema = pa.schema([
+            ("ticket_id", pa.string()),
+            ("category", pa.dictionary(pa.int8(), pa.string())),
+            ("priority", pa.dictionary(pa.int8(), pa.string())),
+            ("sentiment", pa.float64()),
+            ("confidence_score", pa.float64()),
+            ("requires_approval", pa.bool_()),
+            ("business_impact", pa.dictionary(pa.int32(), pa.string())),
+            ("suggested_response_type", pa.dictionary(pa.int32(), pa.string())),
+            ("cluster_id", pa.string()),
+            ("key_points", pa.list_(pa.string())),
+        ])
+        self._categories = pa.array(CATEGORY_NAMES, pa.string())
+        self._priorities = pa.array(PRIORITY_NAMES, pa.string())
+        self._dictionaries = {name: {} for name in DICTIONARY_COLUMNS}  # value -> code, for the whole file
+        if format == "parquet":
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    def _doubles(self, values: array):
+        # the array's buffer as it is, no copy
+        return self._pa.Array.from_buffers(self._pa.float64(), len(values), [None, self._pa.py_buffer(values)])
+
+    def _dictionary_column(self, table: ResolutionTable, name: str):
+        pa = self._pa
+        codes, values = table.codes(name)
+        dictionary = self._dictionaries[name]
+        # chunk codes -> file codes, then one take() maps every row
+        remap = pa.array([dictionary.setdefault(value, len(dictionary)) for value in values], pa.int32())
+        indices = remap.take(pa.array(codes, pa.int32()))
+        return pa.DictionaryArray.from_arrays(indices, pa.array(list(dictionary), pa.string()))
+
+    def _write_chunk(self, table: ResolutionTable) -> None:
+        pa = self._pa
+        rows = len(table)
+        categories = pa.Array.from_buffers(pa.int8(), rows, [None, pa.py_buffer(table.categories)])
+        priorities = pa.compute.subtract(pa.Array.from_buffers(pa.int8(), rows, [None, pa.py_buffer(table.priorities)]),
+                                         pa.scalar(1, pa.int8()))
+        key_points = pa.ListArray.from_arrays(pa.array(table.key_point_offsets, pa.int32()),
+                                              pa.array(table.key_points, pa.string()))
+        batch = pa.record_batch([
+            pa.array(table.ticket_ids, pa.string()),
+            pa.DictionaryArray.from_arrays(categories, self._categories),
+            pa.DictionaryArray.from_arrays(priorities, self._priorities),
+            self._doubles(table.sentiments),
+            self._doubles(table.confidence_scores),
+            pa.array(table.requires_approval, pa.int8()).cast(pa.bool_()),
+            self._dictionary_column(table, "business_impact"),
+            self._dictionary_column(table, "suggested_response_type"),
+            pa.array(table.cluster_ids, pa.string()),
+            key_points,
+        ], schema=self.schema)
+        self._writer.write_batch(batch)
+
+    def _close(self) -> None:
+        self._writer.close()
+
+
+def open_writer(path: str, format: Optional[str] = None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> ResolutionWriter:
+    # a writer for path, the format ("csv", "arrow" or "parquet") is taken from the file extension when not given
+    if format is None:
+        format = FORMATS.get(os.path.splitext(path)[1].lower())
+        if format is None:
+            raise ValueError(f"can not tell the export format of {path!r}, use one of {', '.join(FORMATS)} or pass format")
+    if format == "csv":
+        return CsvResolutionWriter(sys.stdout if path == "-" else path, chunk_rows)
+    return ArrowResolutionWriter(path, format, chunk_rows)
@@ -0,0 +1,278 @@
+import asyncio
+import json
+from collections import deque
+from typing import List, Optional, Tuple
+from data_classes import *
+from .agent_orchestration import TicketProcessor
+from .metrics import metrics
+
+# Small HTTP front end for TicketProcessor, built on asyncio streams only (no web framework needed).
+#
+#   POST /tickets   one ticket object or an array of tickets, answers with the TicketResolution JSON (or an array of them)
+#   GET  /health    {"status": "ok", "queue_depth": ...}
+#   GET  /metrics   the metrics.py counters and stage timings in the Prometheus text format
+#
+# Tickets from concurrent requests are collected by a MicroBatcher for up to batch_window seconds (or until
+# max_batch_size tickets are waiting) and analysed together with TicketProcessor.process_batch. When more than
+# max_queue tickets are waiting or being processed, new requests get 429 with a Retry-After header straight away
+# instead of queueing up without limit. Start it with `python main.py serve`, see benchmarks/load_test.py for load tests.
+
+DEFAULT_BATCH_WINDOW = 0.005
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_QUEUE = 1024
+DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+DEFAULT_KEEP_ALIVE_TIMEOUT = 15.0
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+           413: "Payload Too Large", 429: "Too Many Requests", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error", 501: "Not Implemented"}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    def __init__(self, processor: TicketProcessor, response_templates: dict[str, str], batch_window: float = DEFAULT_BATCH_WINDOW,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_queue: int = DEFAULT_MAX_QUEUE):
+        if max_batch_size < 1 or max_queue < 1:
+            raise ValueError("max_batch_size and max_queue must be at least 1")
+        self.processor = processor
+        self.response_templates = response_templates
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.in_progress = 0
+        self.batches = 0
+        self._pending = deque()  # (ticket, future) waiting for the next batch
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        # tickets waiting plus tickets in the batch that is being processed
+        return len(self._pending) + self.in_progress
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            _, future = self._pending.popleft()
+            future.cancel()
+
+    def submit(self, tickets: List[dict]) -> List[asyncio.Future]:
+        # queues the tickets for the next batches, raises Overloaded when they do not fit in the queue
+        if self.depth + len(tickets) > self.max_queue:
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for ticket in tickets:
+            future = loop.create_future()
+            self._pending.append((ticket, future))
+            futures.append(future)
+        self._wakeup.set()
+        return futures
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # the first ticket is here, give tickets from other requests up to batch_window to join it
+            deadline = loop.time() + self.batch_window
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                ticket, future = self._pending.popleft()
+                if not future.cancelled():  # the client went away
+                    batch.append((ticket, future))
+            if not batch:
+                continue
+
+            self.in_progress = len(batch)
+            self.batches += 1
+            try:
+                with metrics.stage("micro_batch"):
+                    resolutions = await self.processor.process_batch([ticket for ticket, _ in batch], self.response_templates)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), resolution in zip(batch, resolutions):
+                    if not future.done():
+                        future.set_result(resolution)
+            finally:
+                self.in_progress = 0
+
+
+class TicketService:
+    def __init__(self, processor: TicketProcessor, response_templates: dict[str, str], batch_window: float = DEFAULT_BATCH_WINDOW,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES, keep_alive_timeout: float = DEFAULT_KEEP_ALIVE_TIMEOUT):
+        self.processor = processor
+        self.batcher = MicroBatcher(processor, response_templates, batch_window, max_batch_size, max_queue)
+        self.max_body_bytes = max_body_bytes
+        self.keep_alive_timeout = keep_alive_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connections = {}  # handler task -> its writer
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        # port 0 picks a free port, see self.port
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        await self.start(host, port)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            # closing the connections ends the handlers that wait for the next keep alive request, a handler that waits
+            # for its batch ends when the batch is done (its answer can not be sent any more)
+            for writer in list(self._connections.values()):
+                writer.close()
+            if self._connections:
+                await asyncio.wait(list(self._connections), timeout=self.keep_alive_timeout)
+            await self.server.wait_closed()
+            self.server = None
+        await self.batcher.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # HTTP/1.1 with keep alive, one request after the other on the connection
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keep_alive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, {"error": "request headers too large"}, keep_alive=False)
+                    break
+
+                try:
+                    request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                    method, target, version = request_line.split(" ", 2)
+                    headers = {}
+                    for line in header_lines:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", "0"))
+                    if length < 0:
+                        raise ValueError("negative Content-Length")
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request"}, keep_alive=False)
+                    break
+                if "transfer-encoding" in headers:
+                    await self._respond(writer, 501, {"error": "chunked request bodies are not supported, send Content-Length"}, keep_alive=False)
+                    break
+                if length > self.max_body_bytes:
+                    await self._respond(writer, 413, {"error": f"request body is larger than {self.max_body_bytes} bytes"}, keep_alive=False)
+                    break
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length), self.keep_alive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                status, payload, extra_headers = await self._route(method, target.split("?", 1)[0], body)
+                await self._respond(writer, status, payload, keep_alive, extra_headers)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, object, dict]:
+        if path == "/tickets":
+            if method != "POST":
+                return 405, {"error": "use POST"}, {"Allow": "POST"}
+            metrics.incr("http_requests")
+            return await self._tickets(body)
+        if path == "/health":
+            if method != "GET":
+                return 405, {"error": "use GET"}, {"Allow": "GET"}
+            return 200, {"status": "ok", "queue_depth": self.batcher.depth, "max_queue": self.batcher.max_queue,
+                         "batches": self.batcher.batches}, {}
+        if path == "/metrics":
+            if method != "GET":
+                return 405, {"error": "use GET"}, {"Allow": "GET"}
+            return 200, metrics.prometheus_text(), {}
+        return 404, {"error": f"no such endpoint {path}"}, {}
+
+    async def _tickets(self, body: bytes) -> Tuple[int, object, dict]:
+        try:
+            data = json.loads(body)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return 400, {"error": "request body is not valid JSON"}, {}
+        tickets = data if isinstance(data, list) else [data]
+        if not all(isinstance(ticket, dict) for ticket in tickets):
+            return 400, {"error": "send a ticket object or an array of ticket objects"}, {}
+        if len(tickets) > self.batcher.max_queue:
+            return 413, {"error": f"at most {self.batcher.max_queue} tickets per request"}, {}
+
+        try:
+            futures = self.batcher.submit(tickets)
+        except Overloaded:
+            metrics.incr("http_overloaded")
+            return 429, {"error": "too many tickets waiting, try again later"}, {"Retry-After": "1"}
+        try:
+            resolutions = await asyncio.gather(*futures)
+        except Exception as e:
+            return 500, {"error": f"processing failed: {e}"}, {}
+        finally:
+            # the request was cancelled (client went away), do not leave its tickets in the queue
+            for future in futures:
+                future.cancel()
+
+        results = [resolution_to_dict(resolution) for resolution in resolutions]
+        return 200, results if isinstance(data, list) else results[0], {}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: object, keep_alive: bool, extra_headers: Optional[dict] = None) -> None:
+        if isinstance(payload, str):
+            content_type, body = "text/plain; version=0.0.4; charset=utf-8", payload.encode("utf-8")
+        else:
+            content_type, body = "application/json", json.dumps(payload).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}",
+                 "Connection: " + ("keep-alive" if keep_alive else "close")]
+        lines += [f"{name}: {value}" for name, value in (extra_headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
@@ -0,0 +1,88 @@
+from typing import Dict, List, Optional
+from .keyword_matcher import KeywordScan
+from .rules import RuleIndex
+from .sentiment import IncrementalSentiment
+
+# State for analysing a ticket thread that grows as the customer replies (see TicketAnalysisAgent.analyze_appended).
+# Instead of the whole thread it keeps what the analysis needs: the keyword scan (carried on by KeywordMatcher.extend),
+# the text of the lines that have keywords on them, the first three non empty lines for the key point fallback and
+# the per word VADER values (IncrementalSentiment). Appending a reply only looks at the reply, the unfinished last line
+# and a few characters / words before it, and the analysis built from the state is the same as analysing the whole thread.
+
+
+class ThreadAnalysisState:
+    def __init__(self, rules: RuleIndex, customer_info: Optional[dict] = None, lexicon_path: Optional[str] = None):
+        self.rules = rules
+        self.matcher = rules.matcher
+        self.customer_info = customer_info
+        self.lexicon_path = lexicon_path
+        self.keyword_scan = KeywordScan(groups=self.matcher.groups)
+        self.sentiment = IncrementalSentiment(lexicon_path)
+        self.line_texts: Dict[int, str] = {}  # line number -> stripped line, for lines with keywords on them
+        self.first_sentences: List[str] = []  # first three non empty finished lines
+        self.open_line = ""                   # the last line, it can still grow with the next reply
+        self.line = 0                         # number of the last line
+        self._chunks: List[str] = []
+
+        # "Σ".lower() depends on the letters around it, so a reply can change how the end of the text before it is
+        # lowercased. That only matters when a keyword has a sigma in it, then the keywords are scanned from scratch.
+        self._sigma_keywords = any("σ" in word or "ς" in word for word in self.matcher.keyword_groups)
+        self._has_sigma = False
+
+    def use_rules(self, rules: RuleIndex) -> None:
+        # scan the thread so far again with other rules, the lines and the sentiment do not depend on the rules
+        content = self.content
+        self.rules = rules
+        self.matcher = rules.matcher
+        self._sigma_keywords = any("σ" in word or "ς" in word for word in self.matcher.keyword_groups)
+        self.keyword_scan = self.matcher.scan(content.lower())
+        self.line_texts = {}
+        for line_number, line in enumerate(content.split("\n")):
+            if line_number in self.keyword_scan.line_hits and line.strip():
+                self.line_texts[line_number] = line.strip()
+
+    @property
+    def content(self) -> str:
+        # the whole thread so far
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def append(self, text: str) -> None:
+        self._chunks.append(text)
+        self._has_sigma = self._has_sigma or "Σ" in text
+        if self._sigma_keywords and self._has_sigma:
+            self.keyword_scan = self.matcher.scan(self.content.lower())
+        else:
+            self.matcher.extend(self.keyword_scan, text.lower())
+
+        first_line = self.line
+        lines = (self.open_line + text).split("\n")
+        self.open_line = lines[-1]
+        self.line += len(lines) - 1
+        line_hits = self.keyword_scan.line_hits
+        for offset, line in enumerate(lines):
+            sentence = line.strip()
+            if not sentence:
+                continue
+            if first_line + offset in line_hits:
+                self.line_texts[first_line + offset] = sentence
+            if offset < len(lines) - 1 and len(self.first_sentences) < 3:
+                self.first_sentences.append(sentence)
+
+        self.sentiment.append(text)
+
+    def key_points(self, category_group: str) -> List[str]:
+        # the lines with urgent keywords or keywords of the ticket category, in thread order
+        key_points = []
+        for line_number, groups_on_line in self.keyword_scan.line_hits.items():
+            if ("urgency" in groups_on_line or category_group in groups_on_line) and line_number in self.line_texts:
+                key_points.append(self.line_texts[line_number])
+        return key_points
+
+    def sentences(self, count: int) -> List[str]:
+        sentences = list(self.first_sentences)
+        last = self.open_line.strip()
+        if last and len(sentences) < count:
+            sentences.append(last)
+        return sentences[:count]
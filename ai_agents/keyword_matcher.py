@@ -0,0 +1,167 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+
+# Result of scanning one (already lowercased) text with a KeywordMatcher.
+# counts follow str.count rules (occurrences of the same keyword do not overlap) and first_offsets
+# follow str.find, so the analysis agent gets exactly the same numbers it used to compute itself.
+@dataclass
+class KeywordScan:
+    groups: Dict[str, List[str]]
+    counts: Dict[str, int] = field(default_factory=dict)
+    first_offsets: Dict[str, int] = field(default_factory=dict)
+    line_hits: Dict[int, Set[str]] = field(default_factory=dict)  # line number (as in text.split("\n")) -> groups found on it
+    # where the scan got to, so KeywordMatcher.extend can carry on when more text is appended
+    length: int = 0
+    lines: int = 0
+    tail: str = ""
+    last_end: Dict[str, int] = field(default_factory=dict)
+    # with line_limit, line_hits only has the first line_limit lines of each group (for very large tickets, see
+    # large_tickets.py), group_lines counts them. Counts and first offsets are not limited.
+    line_limit: Optional[int] = None
+    group_lines: Dict[str, int] = field(default_factory=dict)
+
+    def group_count(self, group: str) -> int:
+        return sum(self.counts.get(word, 0) for word in self.groups[group])
+
+    def group_first(self, group: str) -> int:
+        # earliest offset of any keyword of the group, -1 when none of them is in the text
+        offsets = [self.first_offsets[word] for word in self.groups[group] if word in self.first_offsets]
+        return min(offsets) if offsets else -1
+
+    def group_present(self, group: str) -> bool:
+        return any(word in self.first_offsets for word in self.groups[group])
+
+
+def _trie_pattern(words: List[str]) -> str:
+    # Builds the alternation as a prefix tree ("bill(?:ing)?" instead of "billing|bill") so the regex engine only
+    # follows one branch per position. Optional endings are greedy, so the longest keyword at a position wins.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    # Compiles every keyword table into one regular expression that is built once and then finds all keywords
+    # in a single pass, instead of calling count / find / in once per keyword and again once per line.
+    #
+    # The regex only returns the longest keyword at each match, so for every keyword we also work out up front
+    # which other keywords can hide inside it ("crash" in "system crash", "bill" in "billing") and which ones can
+    # start inside it and run past its end. Those are checked at the match position, which means overlapping
+    # keywords are still counted exactly like the old per keyword str.count calls.
+    def __init__(self, groups: Dict[str, List[str]]):
+        self.groups = {name: list(words) for name, words in groups.items()}
+
+        self.keyword_groups = defaultdict(set)  # keyword -> names of the groups it belongs to
+        for name, words in self.groups.items():
+            for word in words:
+                if not word or "\n" in word:
+                    raise ValueError(f"Keywords must be non empty single line strings, got {word!r} in group '{name}'")
+                self.keyword_groups[word].add(name)
+
+        keywords = sorted(self.keyword_groups, key=len, reverse=True)
+        self.inner = {}     # keyword -> [(offset, word)] for words fully inside it, including itself at offset 0
+        self.straddle = {}  # keyword -> [(offset, word)] for words that start inside it and may continue after it
+        for keyword in keywords:
+            inner, straddle = [], []
+            for offset in range(len(keyword)):
+                for word in keywords:
+                    if keyword.startswith(word, offset):
+                        inner.append((offset, word))
+                    elif offset > 0 and word.startswith(keyword[offset:]):
+                        straddle.append((offset, word))
+            self.inner[keyword] = inner
+            self.straddle[keyword] = straddle
+
+        self.pattern = re.compile(_trie_pattern(keywords))
+        self.max_length = len(keywords[0]) if keywords else 0
+
+    def scan(self, text: str) -> KeywordScan:
+        return self.extend(KeywordScan(groups=self.groups), text)
+
+    def extend(self, result: KeywordScan, text: str) -> KeywordScan:
+        # Adds text that was appended to the text result has already seen (for ticket threads that grow with every reply).
+        # Only the end of the old text that a keyword could still run out of (max keyword length - 1 characters) is
+        # looked at again, so the work is in proportion to the new text. Counts, offsets and lines come out exactly as
+        # if the whole text had been scanned at once. text must be lowercased like the text before it.
+        counts = result.counts
+        first_offsets = result.first_offsets
+        line_hits = result.line_hits
+        last_end = result.last_end
+        line_limit = result.line_limit
+
+        tail = result.tail
+        window = tail + text
+        base = result.length - len(tail)  # offset of the window in the whole text
+        seen = len(tail)                  # keywords that end inside the tail were counted by the earlier scan
+        line = result.lines - tail.count("\n")
+        line_checked = 0
+
+        for match in self.pattern.finditer(window):
+            start = match.start()
+            keyword = match.group()
+
+            # keywords never contain a newline, so everything found from this match is on the same line
+            line += window.count("\n", line_checked, start)
+            line_checked = start
+            groups_on_line = None
+
+            found = self.inner[keyword]
+            if self.straddle[keyword]:
+                found = sorted(found + [(offset, word) for offset, word in self.straddle[keyword]
+                                        if window.startswith(word, start + offset)])
+
+            for offset, word in found:
+                position = start + offset
+                if position + len(word) <= seen:
+                    continue
+                position += base
+                # the same keyword overlapping with itself is only counted once, like str.count
+                if position >= last_end.get(word, 0):
+                    counts[word] = counts.get(word, 0) + 1
+                    last_end[word] = position + len(word)
+                    if word not in first_offsets:
+                        first_offsets[word] = position
+                if line_limit is not None:
+                    self._add_limited_line(result, line, word)
+                    continue
+                if groups_on_line is None:
+                    groups_on_line = line_hits.get(line)
+                    if groups_on_line is None:
+                        groups_on_line = line_hits[line] = set()
+                groups_on_line.update(self.keyword_groups[word])
+
+        result.length += len(text)
+        result.lines += text.count("\n")
+        result.tail = window[max(0, len(window) - self.max_length + 1):] if self.max_length > 1 else ""
+        return result
+
+    def _add_limited_line(self, result: KeywordScan, line: int, word: str) -> None:
+        # records the line for the groups of word that have fewer than line_limit lines so far
+        groups_on_line = result.line_hits.get(line)
+        group_lines = result.group_lines
+        for group in self.keyword_groups[word]:
+            if groups_on_line is not None and group in groups_on_line:
+                continue
+            if group_lines.get(group, 0) >= result.line_limit:
+                continue
+            group_lines[group] = group_lines.get(group, 0) + 1
+            if groups_on_line is None:
+                groups_on_line = result.line_hits[line] = set()
+            groups_on_line.add(group)
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from typing import Dict
+
+# Optional per stage timers and counters for the ticket pipeline.
+# Turned off by default (or turned on with TICKET_METRICS=1 / metrics.enable()). When off, stage() hands back one shared
+# do-nothing context manager and incr() returns straight away, so the instrumented code costs a couple of attribute
+# lookups per stage. Each process has its own numbers, with TicketProcessor(workers=N) the analysis stages are
+# recorded inside the worker processes and only the overall timings are seen here.
+
+# stages the agents report, in the order they happen
+STAGES = ["process_ticket", "triage", "analyze_ticket", "category_matching", "sentiment", "key_points", "generate_response", "template_rendering",
+          "micro_batch"]
+COUNTERS = ["tickets_processed", "category_fallbacks", "key_point_fallbacks", "template_fallbacks", "template_format_errors", "error_resolutions",
+            "resolution_cache_hits", "http_requests", "http_overloaded", "queue_retries", "queue_dead_letters", "large_tickets",
+            "near_duplicates", "near_duplicate_reuses", "urgent_slo_misses", "customer_escalations"]
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _Stage:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: Dict[str, int] = {name: 0 for name in COUNTERS}
+            self.timers: Dict[str, list] = {name: [0, 0.0, 0.0] for name in STAGES}  # stage -> [count, total seconds, max seconds]
+
+    def stage(self, name: str):
+        # with metrics.stage("sentiment"): ...
+        if not self.enabled:
+            return _NOOP_STAGE
+        return _Stage(self, name)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self) -> dict:
+        # current numbers as plain dicts, safe to json.dumps
+        from . import sentiment
+
+        with self._lock:
+            stages = {
+                name: {
+                    "count": count,
+                    "total_seconds": total,
+                    "avg_ms": (total / count * 1000) if count else 0.0,
+                    "max_ms": longest * 1000,
+                }
+                for name, (count, total, longest) in self.timers.items()
+            }
+            counters = dict(self.counters)
+        return {"enabled": self.enabled, "counters": counters, "stages": stages, "sentiment_cache": sentiment.cache_stats()}
+
+    def prometheus_text(self, prefix: str = "ticket_processing") -> str:
+        # the snapshot in the Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        lines.append(f"# TYPE {prefix}_stage_seconds summary")
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total_seconds"]:.9f}')
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{name}"}} {stage["max_ms"] / 1000:.9f}')
+
+        cache = snapshot["sentiment_cache"]
+        for name in ("hits", "misses"):
+            lines.append(f"# TYPE {prefix}_sentiment_cache_{name}_total counter")
+            lines.append(f"{prefix}_sentiment_cache_{name}_total {cache[name]}")
+        lines.append(f"# TYPE {prefix}_sentiment_cache_size gauge")
+        lines.append(f"{prefix}_sentiment_cache_size {cache['size']}")
+        return "\n".join(lines) + "\n"
+
+
+# process wide metrics used by the agents and the processor
+metrics = Metrics(enabled=os.environ.get("TICKET_METRICS", "") in ("1", "true", "yes"))
@@ -0,0 +1,242 @@
+import bisect
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from data_classes import *
+
+# Near duplicate index for tickets (TicketProcessor(near_duplicates=NearDuplicateIndex())).
+#
+# An outage brings in hundreds of tickets that say the same thing in slightly different words, the resolution cache
+# only catches exact copies. Every ticket gets a MinHash signature of its word shingles (runs of shingle_size words),
+# the share of equal signature values estimates the Jaccard similarity of the shingle sets. The signature is split
+# into bands and every band is a bucket key (LSH), so finding the tickets that are likely similar is a few dict
+# lookups instead of comparing with every ticket in the index. Candidates are then checked on the whole signature,
+# kept as one byte per value packed into an int (b-bit MinHash): a candidate is one XOR and a count of the zero bytes,
+# corrected for the 1 in 256 chance that two different values share their lowest byte.
+#
+# The signature is a one permutation MinHash: each shingle is hashed once, the hash picks one of num_hashes bins and
+# the smallest value per bin is kept. Bins that get no shingle (short tickets) borrow the value of the next filled bin
+# (rotation densification). That is one hash per shingle instead of one per shingle and hash function, a ticket of a
+# few hundred words is indexed in well under a millisecond. The defaults (2 word shingles, 16 bands of 4 values) find
+# pairs from about 0.7 similarity, e.g. the same outage report with another greeting, a ticket number and a changed word.
+#
+# A ticket whose best match has at least `threshold` estimated similarity joins that ticket's cluster, otherwise it
+# starts a new one. With reuse_threshold, a ticket at least that similar to an earlier ticket from a customer with the
+# same role (and the same rules, see namespace) gets a copy of its analysis instead of being analysed again.
+# The index only holds tickets of the last `window` seconds and at most max_size of them, oldest first out. During an
+# outage a bucket can hold hundreds of tickets of the same cluster, only the newest candidates_per_bucket of each bucket
+# are checked, so a lookup costs the same however full the index is.
+# Python's hash() is salted per process, so signatures only mean something inside the process that made them.
+
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_WINDOW = 3600.0
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_NUM_HASHES = 64
+DEFAULT_BANDS = 16
+DEFAULT_SHINGLE_SIZE = 2
+DEFAULT_MAX_CHARS = 4000  # only the start of a very long ticket (pasted logs) is looked at
+DEFAULT_CANDIDATES_PER_BUCKET = 4
+
+_WORD = re.compile(r"\w+")
+_MASK = (1 << 64) - 1
+_EMPTY = 1 << 64
+_ROTATION = 1 << 64  # added per bin a borrowed value moved, so it never equals a value of its own bin
+
+
+@dataclass
+class ClusterMatch:
+    cluster_id: str
+    entry_id: int
+    similarity: float                    # estimated similarity to the closest earlier ticket, 0.0 when it started the cluster
+    analysis: Optional[TicketAnalysis]   # a copy of a near duplicate's analysis that can be used instead, see reuse_threshold
+
+
+@dataclass(slots=True)
+class _Entry:
+    sketch: int               # lowest byte of every signature value
+    buckets: Tuple[int, ...]
+    added_at: float
+    cluster_id: str
+    reuse_key: str
+    analysis: Optional[bytes] = None  # pickled, set by remember()
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, window: float = DEFAULT_WINDOW, max_size: int = DEFAULT_MAX_SIZE,
+                 reuse_threshold: Optional[float] = None, num_hashes: int = DEFAULT_NUM_HASHES, bands: int = DEFAULT_BANDS,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, max_chars: int = DEFAULT_MAX_CHARS,
+                 candidates_per_bucket: int = DEFAULT_CANDIDATES_PER_BUCKET, clock: Callable[[], float] = time.time):
+        if not 0 < threshold <= 1 or (reuse_threshold is not None and not threshold <= reuse_threshold <= 1):
+            raise ValueError("threshold must be in (0, 1] and reuse_threshold in [threshold, 1]")
+        if max_size < 1 or window <= 0 or shingle_size < 1 or max_chars < 1 or candidates_per_bucket < 1:
+            raise ValueError("max_size, window, shingle_size, max_chars and candidates_per_bucket must be positive")
+        if bands < 1 or num_hashes % bands:
+            raise ValueError(f"num_hashes ({num_hashes}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.window = window
+        self.max_size = max_size
+        self.reuse_threshold = reuse_threshold
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.shingle_size = shingle_size
+        self.max_chars = max_chars
+        self.candidates_per_bucket = candidates_per_bucket
+        # fewest equal sketch bytes for reusing an analysis
+        self._reuse_equal = None if reuse_threshold is None else next(
+            (equal for equal in range(num_hashes + 1) if self._estimate(equal) >= reuse_threshold), num_hashes)
+        self.clock = clock
+        self.lookups = 0
+        self.matches = 0
+        self.reuses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # oldest first
+        self._buckets: Dict[int, List[int]] = {}  # band hash -> entry ids, oldest first
+        self._next_entry = 0
+        self._next_cluster = 0
+        self._lock = threading.Lock()
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        # MinHash signature of the word shingles of text, None when it has no words
+        words = _WORD.findall(text[:self.max_chars].lower())
+        if not words:
+            return None
+        size = self.shingle_size
+        shingles = zip(*(words[i:] for i in range(size))) if len(words) >= size else (tuple(words),)
+
+        bins = self.num_hashes
+        values = [_EMPTY] * bins
+        for shingle in shingles:
+            value = hash(shingle) & _MASK
+            slot = value % bins
+            value //= bins
+            if value < values[slot]:
+                values[slot] = value
+
+        if _EMPTY in values:
+            filled = [slot for slot, value in enumerate(values) if value != _EMPTY]
+            dense = list(values)
+            for slot in range(bins):
+                if values[slot] == _EMPTY:
+                    position = bisect.bisect_left(filled, slot)
+                    source = filled[position] if position < len(filled) else filled[0]
+                    dense[slot] = values[source] + ((source - slot) % bins) * _ROTATION
+            values = dense
+        return tuple(values)
+
+    def similarity(self, first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+        # estimated Jaccard similarity of the shingles of two signatures
+        return sum(a == b for a, b in zip(first, second)) / self.num_hashes
+
+    def _sketch(self, signature: Tuple[int, ...]) -> int:
+        return int.from_bytes(bytes(value & 0xFF for value in signature), "little")
+
+    def _estimate(self, equal: int) -> float:
+        # similarity from the number of equal sketch bytes
+        return max(0.0, (equal / self.num_hashes - 1 / 256) / (1 - 1 / 256))
+
+    def assign(self, ticket_content: str, customer_info: Optional[dict] = None, namespace: str = "") -> Optional[ClusterMatch]:
+        # Adds the ticket to the index and returns its cluster (None for a ticket without words, it is not indexed).
+        # Call remember() with the analysis once it is known, so later near duplicates can reuse it.
+        signature = self.signature(ticket_content)
+        if signature is None:
+            return None
+        role = customer_info.get("role", "") if isinstance(customer_info, dict) else ""
+        reuse_key = f"{str(role).lower()}\0{namespace}"
+        rows = self.rows
+        buckets = tuple(hash((band,) + signature[band * rows:(band + 1) * rows]) for band in range(self.bands))
+        sketch = self._sketch(signature)
+
+        with self._lock:
+            now = self.clock()
+            self._evict(now)
+            self.lookups += 1
+
+            candidates = set()
+            for bucket in buckets:
+                members = self._buckets.get(bucket)
+                if members:
+                    candidates.update(members[-self.candidates_per_bucket:])
+
+            # compared by the number of equal bytes, the similarity is only worked out for the best one
+            entries = self._entries
+            size = self.num_hashes
+            reuse_equal = self._reuse_equal
+            best, best_equal = None, -1
+            reuse, reuse_best = None, -1
+            for entry_id in candidates:
+                entry = entries[entry_id]
+                equal = (sketch ^ entry.sketch).to_bytes(size, "little").count(0)
+                # the newest of equally similar tickets wins (entry ids grow)
+                if equal > best_equal or (equal == best_equal and entry_id > best):
+                    best, best_equal = entry_id, equal
+                if (reuse_equal is not None and equal >= reuse_equal and equal > reuse_best and entry.analysis is not None
+                        and entry.reuse_key == reuse_key):
+                    reuse, reuse_best = entry_id, equal
+
+            best_similarity = self._estimate(best_equal) if best is not None else 0.0
+            if best is not None and best_similarity >= self.threshold:
+                cluster_id = self._entries[best].cluster_id
+                self.matches += 1
+            else:
+                cluster_id = f"cluster-{self._next_cluster}"
+                self._next_cluster += 1
+                best_similarity = 0.0
+
+            analysis = None
+            if reuse is not None:
+                analysis = self._entries[reuse].analysis
+                self.reuses += 1
+
+            entry_id = self._next_entry
+            self._next_entry += 1
+            self._entries[entry_id] = _Entry(sketch, buckets, now, cluster_id, reuse_key)
+            for bucket in buckets:
+                members = self._buckets.get(bucket)
+                if members is None:
+                    self._buckets[bucket] = [entry_id]
+                elif members[-1] != entry_id:  # two bands of a ticket can hash alike
+                    members.append(entry_id)
+
+        # a fresh copy, like the resolution cache, so callers can change their analysis
+        return ClusterMatch(cluster_id, entry_id, best_similarity, pickle.loads(analysis) if analysis is not None else None)
+
+    def remember(self, match: ClusterMatch, analysis: TicketAnalysis) -> None:
+        # stores the analysis of the ticket that got match, if it is still in the index
+        value = pickle.dumps(analysis, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            entry = self._entries.get(match.entry_id)
+            if entry is not None:
+                entry.analysis = value
+
+    def _evict(self, now: float) -> None:
+        # tickets older than the window, then the oldest until there is room for one more
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if entry.added_at > now - self.window and len(self._entries) < self.max_size:
+                break
+            del self._entries[entry_id]
+            for bucket in entry.buckets:
+                members = self._buckets.get(bucket)
+                if members and members[0] == entry_id:  # the oldest entry is at the front
+                    del members[0]
+                    if not members:
+                        del self._buckets[bucket]
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "buckets": len(self._buckets), "lookups": self.lookups, "matches": self.matches,
+                    "reuses": self.reuses, "evictions": self.evictions}
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import sys
+from typing import Iterator, List, Optional, TextIO
+from data_classes import *
+from .agent_orchestration import TicketProcessor
+from .export import ResolutionWriter
+
+# Non interactive ticket pipeline: tickets are read as JSON lines (a file or stdin), pushed through TicketProcessor
+# in batches and every TicketResolution is written back out as one JSON line.
+#
+# Memory stays bounded whatever the input size: the reader only runs ahead of the processor by max_pending_batches
+# batches (it waits on the queue when the processor falls behind), so at most
+# (max_pending_batches + 1) * batch_size tickets and one batch of resolutions are held at any time.
+# With export, every resolution also goes to a columnar ResolutionWriter (ai_agents/export.py), which holds at most
+# one chunk of its own.
+
+
+def read_tickets(stream: TextIO, stats: dict) -> Iterator[dict]:
+    # yields one ticket per non empty line, lines that are not a JSON object are skipped and counted
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            ticket = json.loads(line)
+        except json.JSONDecodeError as e:
+            ticket = None
+        if not isinstance(ticket, dict):
+            stats["skipped_lines"] += 1
+            print(f"Skipping line {line_number}: not a JSON ticket object", file=sys.stderr)
+            continue
+        yield ticket
+
+
+def _next_batch(tickets: Iterator[dict], batch_size: int) -> List[dict]:
+    batch = []
+    for ticket in tickets:
+        batch.append(ticket)
+        if len(batch) == batch_size:
+            break
+    return batch
+
+
+async def run_pipeline(processor: TicketProcessor, input_stream: TextIO, output_stream: TextIO, response_templates: dict[str, str],
+                       batch_size: int = 100, max_pending_batches: int = 2, export: Optional[ResolutionWriter] = None) -> dict:
+    if batch_size < 1 or max_pending_batches < 1:
+        raise ValueError("batch_size and max_pending_batches must be at least 1")
+
+    stats = {"tickets": 0, "skipped_lines": 0}
+    tickets = read_tickets(input_stream, stats)
+    batches = asyncio.Queue(maxsize=max_pending_batches)
+
+    async def read_batches():
+        # reading runs in a thread so a slow input (e.g. a pipe) does not block the event loop
+        try:
+            while True:
+                batch = await asyncio.to_thread(_next_batch, tickets, batch_size)
+                await batches.put(batch)  # waits here when the processor is behind, which is the backpressure
+                if not batch:
+                    return
+        except Exception:
+            await batches.put(None)  # wake the writer up, awaiting the reader below raises the error
+            raise
+
+    reader = asyncio.create_task(read_batches())
+    try:
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                await reader
+            if not batch:
+                break
+            resolutions = await processor.process_batch(batch, response_templates)
+            for resolution in resolutions:
+                output_stream.write(json.dumps(resolution_to_dict(resolution)) + "\n")
+            output_stream.flush()
+            if export is not None:
+                export.write_many(resolutions)
+            stats["tickets"] += len(batch)
+        await reader
+    finally:
+        reader.cancel()
+    return stats
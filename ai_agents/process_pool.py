@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Union
+from data_classes import *
+from .ticket_analysis_agent import TicketAnalysisAgent
+from .large_tickets import LargeTicketLimits
+
+# Ticket analysis is plain CPU work (keyword scan + VADER), so running it on the event loop gives no parallelism.
+# These helpers run it in a pool of worker processes instead. Each worker builds its own TicketAnalysisAgent
+# (keyword tables, matcher) and loads the VADER lexicon once when it starts, then analyses chunks of tickets.
+# Results come back to the parent as normal pickled TicketAnalysis objects.
+
+_worker_agent: Optional[TicketAnalysisAgent] = None
+
+
+def _init_worker(lexicon_path: Optional[str] = None, rules_path: Optional[str] = None, rules_reload_interval: Optional[float] = None,
+                 vectorized_sentiment: bool = False, large_tickets: Optional[LargeTicketLimits] = None) -> None:
+    global _worker_agent
+    _worker_agent = TicketAnalysisAgent(lexicon_path=lexicon_path, rules_path=rules_path, vectorized_sentiment=vectorized_sentiment,
+                                        large_tickets=large_tickets)
+    _worker_agent.warm_up()
+    if rules_path and rules_reload_interval:
+        # every worker watches the rules file itself, like the processor in the parent
+        _worker_agent.watch_rules(rules_reload_interval)
+
+
+def analyze_one(ticket_content: str, customer_info: Optional[dict] = None) -> TicketAnalysis:
+    return _worker_agent._analyze(ticket_content, customer_info)
+
+
+def analyze_chunk(tickets: List[tuple]) -> List[Union[TicketAnalysis, Exception]]:
+    # one bad ticket should not throw away the rest of the chunk, so errors are sent back in its place
+    results = []
+    batch_scores = _worker_agent.batch_sentiment([ticket_content for ticket_content, _ in tickets])
+    for (ticket_content, customer_info), sentiment_scores in zip(tickets, batch_scores):
+        try:
+            results.append(_worker_agent._analyze(ticket_content, customer_info, sentiment_scores))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def create_analysis_pool(workers: Optional[int] = None, lexicon_path: Optional[str] = None, rules_path: Optional[str] = None,
+                         rules_reload_interval: Optional[float] = None, vectorized_sentiment: bool = False,
+                         large_tickets: Optional[LargeTicketLimits] = None) -> ProcessPoolExecutor:
+    # workers=None uses one process per CPU core
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(lexicon_path, rules_path, rules_reload_interval, vectorized_sentiment, large_tickets))
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from data_classes import *
+from .large_tickets import normalized_pieces
+
+# Cache for duplicate tickets (monitoring alerts, customers mailing the same thing twice).
+# The key is a hash of the normalised ticket content plus the customer role, the two things the analysis depends on.
+# Content is normalised by stripping every line and dropping empty lines: key points are stripped non-empty lines,
+# VADER only looks at whitespace separated tokens and no keyword starts or ends with whitespace, so the normalised
+# text always gives the same analysis. The normalised text is hashed a chunk at a time (large_tickets.normalized_pieces),
+# so the key of a multi megabyte ticket takes no more memory than its bounded analysis. What is cached is the
+# TicketAnalysis, the response is still rendered for every ticket because it has the customer's name in it (that is a
+# few microseconds with the compiled templates).
+#
+# Entries are evicted least recently used first, when they are older than ttl seconds, and when the cache grows over
+# max_bytes (the size of an entry is its pickled size). The storage is a backend: MemoryBackend (default) or
+# SQLiteBackend, a local database file that survives restarts and can be shared by several processes.
+
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class MemoryBackend:
+    # key -> (pickled analysis, size, expires at), in least recently used order
+    evict_every = 1
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key: str, now: float) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= now:
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value: bytes, now: float, expires_at: float) -> None:
+        self.delete(key)
+        self._entries[key] = (value, len(value), expires_at)
+        self.total_bytes += len(value)
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def evict(self, now: float, max_bytes: int, max_entries: Optional[int]) -> int:
+        # expired entries at the old end first, then the least recently used until the cache fits again. An expired entry
+        # further in is dropped when it is next looked up or reaches the old end, it still counts towards max_bytes until then.
+        evicted = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[2] > now:
+                break
+            self.delete(key)
+            evicted += 1
+        while self._entries and (self.total_bytes > max_bytes or (max_entries is not None and len(self._entries) > max_entries)):
+            key = next(iter(self._entries))
+            self.delete(key)
+            evicted += 1
+        return evicted
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBackend:
+    # Entries in a local SQLite database, so they survive a restart. last_used is updated on every hit for the LRU order.
+    # Working out the total size is a table scan, so eviction only runs every evict_every inserts and the database can
+    # go over max_bytes by that many entries in between.
+    evict_every = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS resolution_cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS resolution_cache_last_used ON resolution_cache (last_used)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS resolution_cache_expires_at ON resolution_cache (expires_at)")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM resolution_cache").fetchone()[0]
+
+    def get(self, key: str, now: float) -> Optional[bytes]:
+        row = self._connection.execute("SELECT value, expires_at FROM resolution_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self.delete(key)
+            return None
+        self._connection.execute("UPDATE resolution_cache SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, value: bytes, now: float, expires_at: float) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO resolution_cache (key, value, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), expires_at, now))
+
+    def delete(self, key: str) -> None:
+        self._connection.execute("DELETE FROM resolution_cache WHERE key = ?", (key,))
+
+    def evict(self, now: float, max_bytes: int, max_entries: Optional[int]) -> int:
+        evicted = self._connection.execute("DELETE FROM resolution_cache WHERE expires_at <= ?", (now,)).rowcount
+        total = self.total_bytes
+        count = len(self)
+        if total <= max_bytes and (max_entries is None or count <= max_entries):
+            return evicted
+        # walk from the least recently used end until enough bytes and entries are freed
+        doomed = []
+        for key, size in self._connection.execute("SELECT key, size FROM resolution_cache ORDER BY last_used"):
+            if total <= max_bytes and (max_entries is None or count <= max_entries):
+                break
+            doomed.append((key,))
+            total -= size
+            count -= 1
+        self._connection.executemany("DELETE FROM resolution_cache WHERE key = ?", doomed)
+        return evicted + len(doomed)
+
+    def clear(self) -> None:
+        self._connection.execute("DELETE FROM resolution_cache")
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM resolution_cache").fetchone()[0]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class ResolutionCache:
+    def __init__(self, backend=None, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_entries: Optional[int] = None, clock: Callable[[], float] = time.time):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def sqlite(cls, path: str, **options) -> "ResolutionCache":
+        # ResolutionCache.sqlite("cache.db", ttl=600)
+        return cls(SQLiteBackend(os.path.expanduser(path)), **options)
+
+    @staticmethod
+    def key(ticket_content: str, customer_info: Optional[dict] = None, namespace: str = "") -> str:
+        # namespace keeps entries apart that were made with different rules (TicketProcessor passes the rules fingerprint)
+        role = (customer_info or {}).get("role", "").lower()
+        digest = hashlib.blake2b(digest_size=20)
+        for piece in normalized_pieces(ticket_content):
+            digest.update(piece.encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+        digest.update(role.encode("utf-8", "surrogatepass"))
+        if namespace:
+            digest.update(b"\0" + namespace.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[TicketAnalysis]:
+        # a fresh copy of the cached analysis, or None
+        with self._lock:
+            value = self.backend.get(key, self.clock())
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(value)
+
+    def put(self, key: str, analysis: TicketAnalysis) -> None:
+        value = pickle.dumps(analysis, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            now = self.clock()
+            self.backend.put(key, value, now, now + self.ttl)
+            self._puts += 1
+            if self._puts % self.backend.evict_every == 0:
+                self.evictions += self.backend.evict(now, self.max_bytes, self.max_entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.backend.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self.backend), "bytes": self.backend.total_bytes}
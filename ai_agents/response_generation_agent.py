@@ -1,21 +1,171 @@
+from collections import OrderedDict
+from string import Formatter
 from data_classes import *
+from .metrics import metrics
+
+# Placeholders a response template is allowed to use. name and priority_level change with every ticket, the rest come
+# from the ticket category or the (rarely overridden) defaults.
+TEMPLATE_FIELDS = {"name", "feature", "diagnosis", "resolution_steps", "priority_level", "eta", "billing_topic", "explanation", "next_steps"}
+PER_TICKET_FIELDS = {"name", "priority_level"}
+
+# how many rendered responses of static templates are kept
+RENDER_CACHE_SIZE = 1024
+# how many parsed templates are kept, templates can come with every call so they are evicted least recently used first
+COMPILED_CACHE_SIZE = 256
+
+
+class CompiledTemplate:
+    # A response template parsed once into literal text and placeholders. Unknown placeholders, positional or
+    # attribute/index fields and broken format specs raise ValueError here, when the template is registered,
+    # instead of failing on every ticket later.
+    def __init__(self, key: str, template: str):
+        self.key = key
+        self.template = template
+        self.parts = []  # (literal text, field name or None, conversion, format spec)
+        try:
+            parsed = list(Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f"Response template '{key}' is not a valid format string: {e}")
+
+        for literal, field_name, format_spec, conversion in parsed:
+            if field_name is not None and field_name not in TEMPLATE_FIELDS:
+                raise ValueError(f"Unknown placeholder {{{field_name}}} in response template '{key}', "
+                                 f"allowed placeholders are: {', '.join(sorted(TEMPLATE_FIELDS))}")
+            if format_spec and "{" in format_spec:
+                raise ValueError(f"Nested placeholders are not supported in response template '{key}'")
+            self.parts.append((literal, field_name, conversion, format_spec))
+
+        self.fields = {field_name for _, field_name, _, _ in self.parts if field_name is not None}
+        self.simple = all(not conversion and not format_spec for _, _, conversion, format_spec in self.parts)
+        # nothing in the output changes between tickets of the same category, so the rendered text can be cached
+        self.static = not (self.fields & PER_TICKET_FIELDS)
+
+        # render once with dummy values so bad format specs ({name:d}) fail now
+        try:
+            self.render({field_name: "" for field_name in self.fields})
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Response template '{key}' can not be rendered: {e}")
+
+    def render(self, values: dict) -> str:
+        if self.simple:
+            out = []
+            for literal, field_name, _, _ in self.parts:
+                out.append(literal)
+                if field_name is not None:
+                    out.append(str(values[field_name]))
+            return "".join(out)
+
+        out = []
+        for literal, field_name, conversion, format_spec in self.parts:
+            out.append(literal)
+            if field_name is not None:
+                value = values[field_name]
+                if conversion == "r":
+                    value = repr(value)
+                elif conversion == "a":
+                    value = ascii(value)
+                elif conversion == "s":
+                    value = str(value)
+                out.append(format(value, format_spec))
+        return "".join(out)
+
 
 class ResponseAgent:
-    async def generate_response(self, ticket_analysis: TicketAnalysis, response_templates: dict[str, str], context: dict[str, any]) -> ResponseSuggestion:
-       
+    def __init__(self, response_templates: Optional[dict[str, str]] = None):
+        # Map response type to suggested actions based on response type. Built once, not on every response.
+        self.action_mapping = {
+            "access_issue": ["please reset your password and check user permissions with system administrator while the support team looks into the issue from their end."],
+            "billing_inquiry": ["please verify billing details and contact billing department. We would also discuss this query with the Billing Manager and get back to you. "],
+            "technical_issue": ["contact technical support and note down the error logs. The support team is already looking into problem and will get back to you with a solution soon."],
+            "feature_request": ["please forward all product feature requests to customer relations team and they would review it."],
+            "general_response": ["we are looking into the problem and would get back to you soon."]
+        }
+        self.default_actions = ["Review ticket/error details and please contact customer support"]
+
+        # default template values that do not depend on the ticket, the context can override any of them
+        self.default_values = {
+            "name": "Customer_Name",
+            "feature": "the admin dashboard or admin functions",
+            "eta": "As Soon As Possible",
+            "billing_topic": "billing and payments",
+            "explanation": "We are reviewing your invoice and payment records.",
+            "next_steps": "For the next steps, please verify billing details and contact billing department. We would also discuss this query with the Billing and Account Managers and get back to you soon."
+        }
+
+        # Use a generic fallback template when there is no template for the response type
+        self.fallback_template = CompiledTemplate("fallback", (
+            "Hello {name},\n\nThank you for contacting support. "
+            "We are looking into your issue and would get to you as soon as possible.\n\nBest regards,\nSupport Team"))
+
+        # template text -> CompiledTemplate (or the message of the ValueError it raised), so each template is only parsed once
+        self.compiled_templates = OrderedDict()
+        self.render_cache = {}
+        if response_templates:
+            self.register_templates(response_templates)
+
+    def register_templates(self, response_templates: dict[str, str]) -> None:
+        # parse and check every template up front, raises ValueError on the first bad one
+        for key, template in response_templates.items():
+            self._compiled(key, template)
+
+    def _compiled(self, key: str, template: str) -> CompiledTemplate:
+        # a template that does not compile is remembered by its error message, it raises again on every call
+        # without being parsed again
+        compiled = self.compiled_templates.get(template)
+        if compiled is None:
+            try:
+                compiled = CompiledTemplate(key, template)
+            except ValueError as e:
+                compiled = str(e)
+            self.compiled_templates[template] = compiled
+            if len(self.compiled_templates) > COMPILED_CACHE_SIZE:
+                self.compiled_templates.popitem(last=False)
+        else:
+            self.compiled_templates.move_to_end(template)
+        if isinstance(compiled, str):
+            raise ValueError(compiled)
+        return compiled
+
+    def _render_cached(self, compiled: CompiledTemplate, template_vals: dict) -> str:
+        # same template and same values always give the same text, so static templates are only rendered once
+        cache_key = (compiled.template, tuple(sorted(template_vals.items())))
+        try:
+            response_text = self.render_cache.get(cache_key)
+        except TypeError:  # a value from the context that can not be used as a key
+            return compiled.render(template_vals)
+        if response_text is None:
+            response_text = compiled.render(template_vals)
+            if len(self.render_cache) >= RENDER_CACHE_SIZE:
+                self.render_cache.clear()
+            self.render_cache[cache_key] = response_text
+        return response_text
+
+    async def generate_response(self, ticket_analysis: TicketAnalysis, response_templates: dict[str, str], context: dict[str, any],
+                                escalation: float = 0.0) -> ResponseSuggestion:
+        # escalation (0 to 1) is how much the customer's recent tickets call for attention, see customer_history.py
+        return self.build_response(ticket_analysis, response_templates, context, escalation)
+
+    def build_response(self, ticket_analysis: TicketAnalysis, response_templates: dict[str, str], context: dict[str, any],
+                       escalation: float = 0.0) -> ResponseSuggestion:
+        # generate_response for callers that are not coroutines (TicketProcessor, the second stage of a triaged ticket)
+        with metrics.stage("generate_response"):
+            return self._build_response(ticket_analysis, response_templates, context, escalation)
+
+    def _build_response(self, ticket_analysis: TicketAnalysis, response_templates: dict[str, str], context: dict[str, any],
+                        escalation: float) -> ResponseSuggestion:
+
         # Select template based on the suggested response type from analysis
         template_key = ticket_analysis.suggested_response_type
 
 
         template = response_templates.get(template_key)
 
-        # if response type is general then use this - 
+        # if response type is general then use the fallback template
         if not template:
-            # Use a generic fallback template
-            template = ("Hello {name},\n\nThank you for contacting support. "
-                        "We are looking into your issue and would get to you as soon as possible.\n\nBest regards,\nSupport Team")
-            
-        
+            compiled = self.fallback_template
+            metrics.incr("template_fallbacks")
+
+
         # Base confidence starts high 0.95 and is adjusted by several factors like rore key points may indicate a more complex ticket.
         # So we can assume that if there are many key points, our confidence might be lower.
         key_points_count = len(ticket_analysis.key_points)
@@ -28,52 +178,55 @@ class ResponseAgent:
         # Urgent tickets might be more challenging to resolve quickly.
         urgency_factor = 0.88 if ticket_analysis.priority == Priority.URGENT else 1.0
 
+        # A customer who keeps writing in (or keeps being unhappy) is less likely to be helped by a template answer,
+        # a fully escalated customer loses a quarter of the confidence and so nearly always gets a human to approve.
+        escalation_factor = 1.0 - 0.25 * escalation
+
         # Combine factors into a final confidence score
         base_confidence = 0.95
-        confidence_score = base_confidence * key_points_factor * sentiment_factor * urgency_factor
+        confidence_score = base_confidence * key_points_factor * sentiment_factor * urgency_factor * escalation_factor
 
         # Determine if approval is required: if the confidence score is below a threshold flag it for approval.
-        # In our case I chose 0.80 to be on safe side 
+        # In our case I chose 0.80 to be on safe side
         requires_approval = confidence_score < 0.80
 
-        
-        # Map response type to suggested actions based on response type
-        action_mapping = {
-            "access_issue": ["please reset your password and check user permissions with system administrator while the support team looks into the issue from their end."],
-            "billing_inquiry": ["please verify billing details and contact billing department. We would also discuss this query with the Billing Manager and get back to you. "],
-            "technical_issue": ["contact technical support and note down the error logs. The support team is already looking into problem and will get back to you with a solution soon."],
-            "feature_request": ["please forward all product feature requests to customer relations team and they would review it."],
-            "general_response": ["we are looking into the problem and would get back to you soon."]
-        }
-
-        # let action value and default incase no other suitable option 
-        suggested_actions = action_mapping.get(ticket_analysis.suggested_response_type, ["Review ticket/error details and please contact customer support"])
-
-        #return response suggestion
-
-        # here we add template values using context or default values incase some fields are not available
-        template_vals = {
-            "name": context.get("name", "Customer_Name"),
-            "feature": context.get("feature","the admin dashboard or admin functions") ,
-            "diagnosis": context.get("diagnosis","We are forwarding the error and diagnosis report to " + ticket_analysis.required_expertise[0]),
-            "resolution_steps": context.get("resolution_steps" , "For the next steps, " + suggested_actions[0]),
-            "priority_level": ticket_analysis.priority.name,
-            "eta": context.get("eta", "As Soon As Possible"),
-            "billing_topic": context.get("billing_topic" , "billing and payments"),
-            "explanation": context.get("explanation" ,"We are reviewing your invoice and payment records."),
-            "next_steps": context.get("next_steps" , "For the next steps, please verify billing details and contact billing department. We would also discuss this query with the Billing and Account Managers and get back to you soon.")
-        }
+        # let action value and default incase no other suitable option
+        suggested_actions = self.action_mapping.get(ticket_analysis.suggested_response_type, self.default_actions)
 
-        # here we use try and except statements to handle errors in data entry and prevent whole system from crashing 
+        # here we use try and except statements to handle errors in data entry and prevent whole system from crashing,
+        # a per call template with a bad placeholder gets the error text instead of failing the ticket
         try:
-            response_text = template.format(**template_vals)
+            if template:
+                compiled = self._compiled(template_key, template)
+
+            # here we add template values using context or default values incase some fields are not available.
+            # Only the placeholders the template actually uses are worked out.
+            template_vals = {}
+            for field_name in compiled.fields:
+                if field_name == "priority_level":
+                    template_vals[field_name] = ticket_analysis.priority.name
+                elif field_name in context:
+                    template_vals[field_name] = context[field_name]
+                elif field_name == "diagnosis":
+                    template_vals[field_name] = "We are forwarding the error and diagnosis report to " + ticket_analysis.required_expertise[0]
+                elif field_name == "resolution_steps":
+                    template_vals[field_name] = "For the next steps, " + suggested_actions[0]
+                else:
+                    template_vals[field_name] = self.default_values[field_name]
+
+            with metrics.stage("template_rendering"):
+                if compiled.static:
+                    response_text = self._render_cached(compiled, template_vals)
+                else:
+                    response_text = compiled.render(template_vals)
         except Exception as e:
             response_text = "Error formatting response template."
+            metrics.incr("template_format_errors")
 
         return ResponseSuggestion(
         response_text=response_text,
         confidence_score=confidence_score,
         requires_approval=requires_approval,
-        suggested_actions=suggested_actions
+        suggested_actions=list(suggested_actions)
 
-        )
\ No newline at end of file
+        )
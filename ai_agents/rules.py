@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional, Tuple
+from data_classes import *
+from .keyword_matcher import KeywordMatcher
+
+# Rule tables (keywords, priority roles, expertise, response types and follow up texts) compiled into one read only
+# RuleIndex. The agent keeps its built in tables as the defaults, a JSON or YAML rules file can replace any of them:
+#
+#   {
+#     "categories": {
+#       "billing": {"keywords": ["invoice", "refund"], "expertise": ["Billing team."], "response_type": "billing_inquiry",
+#                   "follow_up": "The client may ask about the refund date."},
+#       ...
+#     },
+#     "urgency_keywords": ["asap", "urgent"],
+#     "impact_words": ["revenue", "outage"],
+#     "customer_priority": ["director", "ceo"],
+#     "priority_roles": ["admin"],
+#     "stressed_follow_up": "The customer is stressed ..."
+#   }
+#
+# Top level keys that are left out keep the default. A file given to "categories" replaces the whole category table
+# (the order of the categories is the tie break order). Everything is checked and compiled (keyword matcher included)
+# when the file is loaded, the agent then swaps the new index in with one assignment. A ticket reads agent.rules once
+# when it starts, so tickets that are already running finish with the rules they started with.
+
+RULE_KEYS = ("categories", "urgency_keywords", "impact_words", "customer_priority", "priority_roles", "stressed_follow_up")
+CATEGORY_KEYS = ("keywords", "expertise", "response_type", "follow_up")
+DEFAULT_RELOAD_INTERVAL = 2.0
+
+
+@dataclass(frozen=True)
+class RuleIndex:
+    category_keywords: Mapping[TicketCategory, Tuple[str, ...]]
+    support_expertise: Mapping[TicketCategory, Tuple[str, ...]]
+    mapping_response: Mapping[TicketCategory, str]
+    follow_up_predictions: Mapping[TicketCategory, str]
+    urgency_keywords: Tuple[str, ...]
+    impact_words: Tuple[str, ...]
+    customer_priority: Tuple[str, ...]
+    priority_roles: frozenset
+    stressed_follow_up: str
+    matcher: KeywordMatcher
+    fingerprint: str  # hash of the rules, changes whenever any rule changes
+    source: Optional[str] = None
+
+
+def _string_list(config: dict, key: str, where: str) -> Tuple[str, ...]:
+    values = config.get(key, [])
+    if not isinstance(values, (list, tuple)) or not all(isinstance(value, str) for value in values):
+        raise ValueError(f"Rules: '{key}' in {where} must be a list of strings")
+    return tuple(values)
+
+
+def compile_rules(config: dict, source: Optional[str] = None) -> RuleIndex:
+    # checks a full rules dict (see the top of this file) and builds the read only index, raises ValueError when it is not valid
+    unknown = set(config) - set(RULE_KEYS)
+    if unknown:
+        raise ValueError(f"Rules: unknown keys {', '.join(sorted(unknown))}, allowed keys are: {', '.join(RULE_KEYS)}")
+
+    categories = config.get("categories", {})
+    if not isinstance(categories, dict):
+        raise ValueError("Rules: 'categories' must map a category name to its rules")
+    category_keywords, support_expertise, mapping_response, follow_up_predictions = {}, {}, {}, {}
+    for name, rules in categories.items():
+        try:
+            category = TicketCategory(name)
+        except ValueError:
+            raise ValueError(f"Rules: unknown category '{name}', categories are: {', '.join(c.value for c in TicketCategory)}")
+        if not isinstance(rules, dict) or set(rules) - set(CATEGORY_KEYS):
+            raise ValueError(f"Rules: category '{name}' must be an object with the keys: {', '.join(CATEGORY_KEYS)}")
+        category_keywords[category] = tuple(keyword.lower() for keyword in _string_list(rules, "keywords", f"category '{name}'"))
+        if "expertise" in rules:
+            support_expertise[category] = _string_list(rules, "expertise", f"category '{name}'")
+        for key, table in (("response_type", mapping_response), ("follow_up", follow_up_predictions)):
+            if key in rules:
+                if not isinstance(rules[key], str):
+                    raise ValueError(f"Rules: '{key}' of category '{name}' must be a string")
+                table[category] = rules[key]
+
+    urgency_keywords = tuple(keyword.lower() for keyword in _string_list(config, "urgency_keywords", "the rules"))
+    impact_words = tuple(keyword.lower() for keyword in _string_list(config, "impact_words", "the rules"))
+    stressed_follow_up = config.get("stressed_follow_up", "")
+    if not isinstance(stressed_follow_up, str):
+        raise ValueError("Rules: 'stressed_follow_up' must be a string")
+
+    # KeywordMatcher raises ValueError for empty or multi line keywords
+    matcher = KeywordMatcher({
+        **{category.value: list(keywords) for category, keywords in category_keywords.items()},
+        "urgency": list(urgency_keywords),
+        "impact": list(impact_words),
+    })
+
+    canonical = json.dumps(config, sort_keys=True, ensure_ascii=False, default=list)
+    return RuleIndex(
+        category_keywords=MappingProxyType(category_keywords),
+        support_expertise=MappingProxyType(support_expertise),
+        mapping_response=MappingProxyType(mapping_response),
+        follow_up_predictions=MappingProxyType(follow_up_predictions),
+        urgency_keywords=urgency_keywords,
+        impact_words=impact_words,
+        customer_priority=tuple(role.lower() for role in _string_list(config, "customer_priority", "the rules")),
+        priority_roles=frozenset(role.lower() for role in _string_list(config, "priority_roles", "the rules")),
+        stressed_follow_up=stressed_follow_up,
+        matcher=matcher,
+        fingerprint=hashlib.blake2b(canonical.encode("utf-8"), digest_size=12).hexdigest(),
+        source=source,
+    )
+
+
+def load_rules_file(path: str) -> dict:
+    # reads a .json, .yaml or .yml rules file, YAML needs PyYAML to be installed
+    with open(path, encoding="utf-8") as rules_file:
+        text = rules_file.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML rules files needs PyYAML (pip install pyyaml), or use a .json rules file")
+        config = yaml.safe_load(text)
+    else:
+        config = json.loads(text)
+    if not isinstance(config, dict):
+        raise ValueError(f"Rules file {path} must contain an object at the top level")
+    return config
+
+
+class RuleReloader:
+    # Checks the rules file every interval seconds in a background thread. When its modification time or size changes
+    # the file is loaded and compiled in that thread and handed to apply(). A file that does not load or compile is
+    # reported on stderr and the rules in use stay as they are.
+    def __init__(self, path: str, load: Callable[[str], RuleIndex], apply: Callable[[RuleIndex], None],
+                 interval: float = DEFAULT_RELOAD_INTERVAL):
+        self.path = path
+        self.load = load
+        self.apply = apply
+        self.interval = interval
+        self.last_error: Optional[Exception] = None
+        self._signature = self._file_signature()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rules-reloader", daemon=True)
+
+    def _file_signature(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def start(self) -> "RuleReloader":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def check(self) -> bool:
+        # reloads when the file changed, returns True when new rules were applied
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            rules = self.load(self.path)
+        except Exception as e:
+            self.last_error = e
+            print(f"Could not reload rules from {self.path}, keeping the current rules: {e}", file=sys.stderr)
+            return False
+        self.last_error = None
+        self.apply(rules)
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
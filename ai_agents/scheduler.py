@@ -0,0 +1,227 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+from data_classes import *
+from .agent_orchestration import TicketProcessor
+from .metrics import metrics
+from .triage import TriagedTicket
+
+# Priority aware scheduling in front of a TicketProcessor.
+#
+# Tickets are normally processed in arrival order, so during a burst an URGENT ticket from a director waits behind
+# hundreds of LOW ones. PriorityScheduler triages every ticket when it is submitted (keyword scan and customer role,
+# about 70 µs, see TicketProcessor.triage_ticket) and puts it in a queue per priority, the processing later goes on from
+# that keyword scan. Workers take the next ticket:
+#   1. starvation protection: a ticket that has waited max_wait seconds or more is taken first, oldest first,
+#   2. the URGENT SLO: an URGENT ticket that has used half of urgent_slo waiting is taken next,
+#   3. otherwise weighted fair dequeuing (smooth weighted round robin): with every queue full, out of every
+#      8 + 4 + 2 + 1 tickets 8 are URGENT, 4 HIGH, 2 MEDIUM and 1 LOW with the default weights, spread evenly.
+# A ticket taken by 1. or 2. still counts as its queue's turn in 3., and a queue that runs empty starts again from no
+# credit, so no priority gets more than its weight from turns it saved up earlier.
+# On top of the `concurrency` general workers, urgent_workers workers only ever take URGENT tickets, so an URGENT ticket
+# never waits for a slow batch of LOW tickets to finish. The ticket itself goes through processor.process_triaged, so the
+# resolution cache, near duplicate index and analysis worker processes of the processor are used as usual.
+#
+#   async with PriorityScheduler(processor, RESPONSE_TEMPLATES) as scheduler:
+#       resolution = await scheduler.process(ticket)
+#       scheduler.stats()   # queue depth, wait times and SLO misses per priority
+#
+# Everything runs on one event loop, the scheduler is not thread safe.
+
+DEFAULT_WEIGHTS = {Priority.URGENT: 8, Priority.HIGH: 4, Priority.MEDIUM: 2, Priority.LOW: 1}
+DEFAULT_CONCURRENCY = 4
+DEFAULT_URGENT_WORKERS = 1
+DEFAULT_MAX_WAIT = 30.0
+DEFAULT_URGENT_SLO = 1.0
+WAIT_SAMPLES = 1000  # recent waits kept per priority for the percentiles
+
+# highest priority first, ties in the round robin go to the higher priority
+PRIORITY_ORDER = sorted(Priority, key=lambda priority: priority.value, reverse=True)
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+@dataclass
+class _Job:
+    ticket: dict
+    triaged: TriagedTicket
+    enqueued_at: float
+    future: asyncio.Future
+
+    @property
+    def priority(self) -> Priority:
+        return self.triaged.priority
+
+
+@dataclass
+class _LevelStats:
+    enqueued: int = 0
+    completed: int = 0
+    starvation_promotions: int = 0
+    slo_misses: int = 0
+    waits: deque = field(default_factory=lambda: deque(maxlen=WAIT_SAMPLES))
+    max_wait: float = 0.0
+
+
+class PriorityScheduler:
+    def __init__(self, processor: TicketProcessor, response_templates: dict[str, str], concurrency: int = DEFAULT_CONCURRENCY,
+                 urgent_workers: int = DEFAULT_URGENT_WORKERS, weights: Optional[Dict[Priority, int]] = None,
+                 max_wait: float = DEFAULT_MAX_WAIT, urgent_slo: float = DEFAULT_URGENT_SLO, max_queue: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        if set(weights) != set(Priority) or any(weight < 1 for weight in weights.values()):
+            raise ValueError("weights needs a weight of at least 1 for every priority")
+        if concurrency < 1 or urgent_workers < 0:
+            raise ValueError("concurrency must be at least 1 and urgent_workers at least 0")
+        if max_wait <= 0 or urgent_slo <= 0 or (max_queue is not None and max_queue < 1):
+            raise ValueError("max_wait, urgent_slo and max_queue must be positive")
+        self.processor = processor
+        self.response_templates = response_templates
+        self.concurrency = concurrency
+        self.urgent_workers = urgent_workers
+        self.weights = weights
+        self.max_wait = max_wait
+        self.urgent_slo = urgent_slo
+        self.max_queue = max_queue
+        self.clock = clock
+        self._queues: Dict[Priority, deque] = {priority: deque() for priority in Priority}
+        self._credit = {priority: 0 for priority in Priority}  # smooth weighted round robin state
+        self._stats = {priority: _LevelStats() for priority in Priority}
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+
+    async def __aenter__(self) -> "PriorityScheduler":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback) -> None:
+        await self.close()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.ensure_future(self._work(urgent_only=False)) for _ in range(self.concurrency)]
+            self._workers += [asyncio.ensure_future(self._work(urgent_only=True)) for _ in range(self.urgent_workers)]
+
+    async def close(self) -> None:
+        # stops the workers, tickets still waiting are cancelled
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().future.cancel()
+
+    def submit(self, ticket: dict) -> asyncio.Future:
+        # triages the ticket and queues it, the future gets its TicketResolution. Raises asyncio.QueueFull when
+        # max_queue tickets are already waiting.
+        if self.max_queue is not None and self.depth >= self.max_queue:
+            raise asyncio.QueueFull()
+        # the cheap first half of the analysis, a ticket that can not be triaged gets the error resolution as LOW
+        job = _Job(ticket, self.processor.triage(ticket, self.response_templates), self.clock(),
+                   asyncio.get_running_loop().create_future())
+        self._queues[job.priority].append(job)
+        self._stats[job.priority].enqueued += 1
+        self._wakeup.set()
+        return job.future
+
+    async def process(self, ticket: dict) -> TicketResolution:
+        return await self.submit(ticket)
+
+    async def process_many(self, tickets: Iterable[dict]) -> List[TicketResolution]:
+        # all tickets at once, resolutions in the order of the tickets
+        return list(await asyncio.gather(*(self.submit(ticket) for ticket in tickets)))
+
+    def _take(self, urgent_only: bool) -> Optional[_Job]:
+        queues = self._queues
+        if urgent_only:
+            return queues[Priority.URGENT].popleft() if queues[Priority.URGENT] else None
+        waiting = []
+        for priority in PRIORITY_ORDER:
+            if queues[priority]:
+                waiting.append(priority)
+            else:
+                self._credit[priority] = 0  # an empty queue does not keep credit (or debt) for its next burst
+        if not waiting:
+            return None
+        now = self.clock()
+
+        # every waiting queue earns its weight, the one that is served pays back the total, however it was chosen
+        total = 0
+        for priority in waiting:
+            self._credit[priority] += self.weights[priority]
+            total += self.weights[priority]
+        oldest = min(waiting, key=lambda priority: queues[priority][0].enqueued_at)
+        urgent = queues[Priority.URGENT]
+        if now - queues[oldest][0].enqueued_at >= self.max_wait:
+            chosen = oldest
+            self._stats[oldest].starvation_promotions += 1
+        elif urgent and now - urgent[0].enqueued_at >= self.urgent_slo / 2:
+            chosen = Priority.URGENT
+        else:
+            chosen = max(waiting, key=self._credit.get)  # the one with the most credit
+        self._credit[chosen] -= total
+        return queues[chosen].popleft()
+
+    async def _work(self, urgent_only: bool) -> None:
+        while True:
+            job = self._take(urgent_only)
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if job.future.cancelled():  # the caller went away
+                continue
+
+            stats = self._stats[job.priority]
+            wait = self.clock() - job.enqueued_at
+            stats.waits.append(wait)
+            stats.max_wait = max(stats.max_wait, wait)
+            try:
+                resolution = await self.processor.process_triaged(job.triaged, job.ticket, self.response_templates)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(resolution)
+            stats.completed += 1
+            if job.priority is Priority.URGENT and self.clock() - job.enqueued_at > self.urgent_slo:
+                stats.slo_misses += 1
+                metrics.incr("urgent_slo_misses")
+            # with the analysis on the event loop process_ticket may never suspend, let callers and new submissions in
+            await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        # per priority: tickets waiting, submitted and done, wait before processing started (recent percentiles and the
+        # longest), how often starvation protection kicked in, and for URGENT how often the SLO was missed
+        report = {}
+        for priority in PRIORITY_ORDER:
+            stats = self._stats[priority]
+            waits = list(stats.waits)
+            report[priority.name] = {
+                "depth": len(self._queues[priority]),
+                "enqueued": stats.enqueued,
+                "completed": stats.completed,
+                "wait_p50_ms": _percentile(waits, 0.5) * 1000,
+                "wait_p95_ms": _percentile(waits, 0.95) * 1000,
+                "wait_max_ms": stats.max_wait * 1000,
+                "starvation_promotions": stats.starvation_promotions,
+            }
+        report[Priority.URGENT.name]["slo_ms"] = self.urgent_slo * 1000
+        report[Priority.URGENT.name]["slo_misses"] = self._stats[Priority.URGENT].slo_misses
+        return report
@@ -0,0 +1,264 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# VADER sentiment analyzer loading.
+# nltk and the lexicon are only loaded the first time a sentiment score is needed (or when warm_up is called),
+# so importing the agents is close to free and nothing here ever goes to the network.
+#
+# The lexicon is looked up in this order:
+#   1. the lexicon_path given to the agent / warm_up
+#   2. the TICKET_VADER_LEXICON environment variable
+#   3. the project's own nltk_data folder (install it there with `python -m nltk.downloader -d nltk_data vader_lexicon`)
+#   4. the normal nltk data folders (NLTK_DATA, ~/nltk_data, ...)
+# lexicon_path can be the vader_lexicon.txt file, the vader_lexicon.zip file or an nltk_data folder.
+
+LEXICON_ENV_VAR = "TICKET_VADER_LEXICON"
+VADER_RESOURCE = "sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt"
+PROJECT_NLTK_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nltk_data")
+
+DEFAULT_CACHE_SIZE = 10000
+
+# one analyzer per lexicon for the whole process, shared by every agent and thread
+_analyzers: Dict[Optional[str], object] = {}
+_analyzers_lock = threading.Lock()
+
+
+class SentimentCache:
+    # Bounded LRU cache of VADER polarity_scores results, shared by all threads in the process.
+    # Keys are a hash of the ticket text with all whitespace runs collapsed to one space. VADER only looks at
+    # whitespace separated tokens and at the "!" / "?" counts, so the normalised text always gets the same score
+    # and re-sent emails or repeated alerts that only differ in spacing or line breaks are scored once.
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str, lexicon_path: Optional[str] = None) -> tuple:
+        normalized = " ".join(text.split())
+        digest = hashlib.blake2b(normalized.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        return (lexicon_path, digest)
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            scores = self._entries.get(key)
+            if scores is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(scores)
+
+    def put(self, key: tuple, scores: dict) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = dict(scores)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def resize(self, maxsize: int) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+cache = SentimentCache(int(os.environ.get("TICKET_SENTIMENT_CACHE_SIZE", DEFAULT_CACHE_SIZE)))
+
+
+def _lexicon_url(lexicon_path: Optional[str]) -> str:
+    import nltk
+
+    lexicon_path = lexicon_path or os.environ.get(LEXICON_ENV_VAR)
+    if lexicon_path:
+        lexicon_path = os.path.abspath(os.path.expanduser(lexicon_path))
+        if os.path.isdir(lexicon_path):
+            lexicon_path = os.path.join(lexicon_path, VADER_RESOURCE)
+        elif lexicon_path.endswith(".zip"):
+            lexicon_path = os.path.join(lexicon_path, "vader_lexicon", "vader_lexicon.txt")
+        candidates = [lexicon_path]
+    else:
+        candidates = [os.path.join(folder, VADER_RESOURCE) for folder in [PROJECT_NLTK_DATA] + list(nltk.data.path)]
+
+    for candidate in candidates:
+        try:
+            # nltk.data.find also looks for the unzipped version of the file, it never downloads anything
+            nltk.data.find(candidate, paths=[""])
+            return "file:" + candidate
+        except LookupError:
+            continue
+
+    raise LookupError(
+        "VADER lexicon not found (looked in: " + ", ".join(candidates) + "). "
+        "Install it once with `python -m nltk.downloader vader_lexicon` or point "
+        + LEXICON_ENV_VAR + " at the lexicon file."
+    )
+
+
+def get_analyzer(lexicon_path: Optional[str] = None):
+    # returns the process wide SentimentIntensityAnalyzer for this lexicon, loading it on first use
+    analyzer = _analyzers.get(lexicon_path)
+    if analyzer is None:
+        with _analyzers_lock:
+            # another thread may have loaded it while we were waiting for the lock
+            analyzer = _analyzers.get(lexicon_path)
+            if analyzer is None:
+                from nltk.sentiment import SentimentIntensityAnalyzer
+
+                analyzer = SentimentIntensityAnalyzer(lexicon_file=_lexicon_url(lexicon_path))
+                _analyzers[lexicon_path] = analyzer
+    return analyzer
+
+
+def polarity_scores(text: str, lexicon_path: Optional[str] = None) -> dict:
+    # VADER scores for the text, served from the cache for texts that were already scored
+    key = cache.key(text, lexicon_path)
+    scores = cache.get(key)
+    if scores is None:
+        scores = get_analyzer(lexicon_path).polarity_scores(text)
+        cache.put(key, scores)
+    return scores
+
+
+def configure_cache(maxsize: int) -> None:
+    # change how many scores are kept, 0 turns the cache off
+    cache.resize(maxsize)
+
+
+def cache_stats() -> dict:
+    return cache.stats()
+
+
+def warm_up(lexicon_path: Optional[str] = None) -> None:
+    # Load nltk and the lexicon now instead of on the first ticket, e.g. when a worker starts before it takes traffic.
+    # Raises LookupError straight away if the lexicon is not installed.
+    get_analyzer(lexicon_path)
+
+
+class IncrementalSentiment:
+    # VADER scores for a text that keeps growing (a ticket thread with replies), giving exactly what polarity_scores
+    # returns for the whole text so far without scoring every word again on each reply.
+    #
+    # VADER scores every distinct word once, at the position where it first appears, looking back at most 3 words and
+    # ahead at most 2. So the value of a word only changes when it first appeared in the last two words of the old text,
+    # or when the "some but not all words are ALL CAPS" flag flips (then all words are scored again, which happens at most
+    # a few times per thread). Appending only scores the new words and the last few old ones. The final score is a sum
+    # over the cached per word values in text order (the "but" rule scales everything before the first "but"), which is
+    # one cheap pass in the same order VADER adds them up, so the floats match exactly.
+    def __init__(self, lexicon_path: Optional[str] = None):
+        self.analyzer = get_analyzer(lexicon_path)
+        self.words = []          # VADER's words_and_emoticons of the whole text
+        self.first_index = {}    # word -> position it first appears at
+        self.values = {}         # word -> its valence, scored at first_index
+        self.allcaps = 0
+        self.is_cap_diff = False
+        self.but_index = None    # position of the first "but"
+        self.exclamations = 0
+        self.questions = 0
+        self.open_token = ""     # last whitespace separated token, when the text did not end with whitespace
+        self.open_token_added = False
+
+    def append(self, text: str) -> None:
+        from nltk.sentiment.vader import SentiText
+
+        constants = self.analyzer.constants
+        self.exclamations += text.count("!")
+        self.questions += text.count("?")
+
+        # the last token of the old text may continue in the new text, so it is split again together with it
+        if self.open_token_added:
+            self._pop_word()
+        piece = self.open_token + text
+        stable = len(self.words)
+
+        # a word is mapped (punctuation stripped) by looking only at the word itself, so splitting a piece of the text
+        # gives the same words as splitting the whole text
+        new_words = SentiText(piece, constants.PUNC_LIST, constants.REGEX_REMOVE_PUNCTUATION).words_and_emoticons
+        raw_tokens = piece.split()
+        if raw_tokens and not piece[-1].isspace():
+            self.open_token = raw_tokens[-1]
+            self.open_token_added = len(raw_tokens[-1]) > 1
+        else:
+            self.open_token = ""
+            self.open_token_added = False
+
+        for word in new_words:
+            index = len(self.words)
+            self.words.append(word)
+            if word not in self.first_index:
+                self.first_index[word] = index
+            if word.isupper():
+                self.allcaps += 1
+            if self.but_index is None and word.lower() == "but":
+                self.but_index = index
+
+        is_cap_diff = 0 < len(self.words) - self.allcaps < len(self.words)
+        if is_cap_diff != self.is_cap_diff:
+            self.is_cap_diff = is_cap_diff
+            rescore = range(len(self.words))
+        else:
+            rescore = range(max(0, stable - 2), len(self.words))
+        for index in rescore:
+            word = self.words[index]
+            if self.first_index[word] == index:
+                self.values[word] = self._valence(word, index)
+
+    def _pop_word(self) -> None:
+        index = len(self.words) - 1
+        word = self.words.pop()
+        if word.isupper():
+            self.allcaps -= 1
+        if self.first_index.get(word) == index:
+            del self.first_index[word]
+            del self.values[word]
+        if self.but_index == index:
+            self.but_index = None
+
+    def _valence(self, word: str, index: int) -> float:
+        # the same steps as SentimentIntensityAnalyzer.polarity_scores for one word
+        constants = self.analyzer.constants
+        words = self.words
+        if (index < len(words) - 1 and word.lower() == "kind" and words[index + 1].lower() == "of") or word.lower() in constants.BOOSTER_DICT:
+            return 0
+        sentitext = _SentiTextView(words, self.is_cap_diff)
+        return self.analyzer.sentiment_valence(0, sentitext, word, index, [])[0]
+
+    def scores(self) -> dict:
+        values = self.values
+        sentiments = [values[word] for word in self.words]
+        if self.but_index is not None:
+            # same as SentimentIntensityAnalyzer._but_check
+            for index, sentiment in enumerate(sentiments):
+                if index < self.but_index:
+                    sentiments[index] = sentiment * 0.5
+                elif index > self.but_index:
+                    sentiments[index] = sentiment * 1.5
+        # only the number of "!" (up to 4) and "?" (4 and more count the same) of the text is used
+        punctuation = "!" * min(self.exclamations, 4) + "?" * min(self.questions, 4)
+        return self.analyzer.score_valence(sentiments, punctuation)
+
+
+class _SentiTextView:
+    # the two attributes of nltk's SentiText that sentiment_valence reads
+    __slots__ = ("words_and_emoticons", "is_cap_diff")
+
+    def __init__(self, words_and_emoticons: list, is_cap_diff: bool):
+        self.words_and_emoticons = words_and_emoticons
+        self.is_cap_diff = is_cap_diff
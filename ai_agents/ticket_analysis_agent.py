@@ -1,48 +1,330 @@
 from data_classes import *
-from nltk.sentiment import SentimentIntensityAnalyzer
-import nltk
-# Ensure VADER lexicon is downloaded (run this once)
-nltk.download('vader_lexicon')
 from collections import defaultdict
+from .keyword_matcher import KeywordMatcher, KeywordScan
+from .incremental_analysis import ThreadAnalysisState
+from .rules import DEFAULT_RELOAD_INTERVAL, RuleIndex, RuleReloader, compile_rules, load_rules_file
+from . import sentiment as sentiment_analysis
+from . import large_tickets
+from .large_tickets import LargeTicketLimits
+from .metrics import metrics
 
 
 class TicketAnalysisAgent:
-    async def analyze_ticket(self, ticket_content: str, customer_info: Optional[dict] = None) -> TicketAnalysis:
-
-        # Convert the ticket content to lowercase to make the search case-insensitive.
-        # For extra in future could use advacned tokenisation and stemming with stop word removal for more in depth analysis
-        content_lowercase = ticket_content.lower()
+    def __init__(self, lexicon_path: Optional[str] = None, rules_path: Optional[str] = None, vectorized_sentiment: bool = False,
+                 large_tickets: Optional[LargeTicketLimits] = None):
+        # Rule tables are built once per agent instead of on every ticket,
+        # so analysing a large batch of tickets only pays the setup cost a single time.
+        # The tables below are the built in defaults, a rules file (rules_path, see rules.py) can replace any of them.
 
     # Determine the category of the ticket based on the presence of certain words . 
     # For extra work in future would like to tackle this part with advanced nlp and sentiment analysis using llms or sentiment packages to understand context.
 
-        billing = ["billing" , "invoice" , "pro-rating" , "account" , "cost" , "money" , "payroll"]
-        access = ["access" , "login" , "403" , "authentication" , "security" , "admin" , "dashboard" , "permission"]
-        feature = ["feature" , "function"]
-        technical = ["crash" , "system" , "failed" , "technical error" , "not working" , "server" , "down" , "stuck"]
+        self.billing = ["billing" , "invoice" , "pro-rating" , "account" , "cost" , "money" , "payroll"]
+        self.access = ["access" , "login" , "403" , "authentication" , "security" , "admin" , "dashboard" , "permission"]
+        self.feature = ["feature" , "function"]
+        self.technical = ["crash" , "system" , "failed" , "technical error" , "not working" , "server" , "down" , "stuck"]
 
-        category_keywords = {
-        TicketCategory.BILLING: billing,
-        TicketCategory.ACCESS: access,
-        TicketCategory.FEATURE: feature,
-        TicketCategory.TECHNICAL: technical,
+        self.category_keywords = {
+        TicketCategory.BILLING: self.billing,
+        TicketCategory.ACCESS: self.access,
+        TicketCategory.FEATURE: self.feature,
+        TicketCategory.TECHNICAL: self.technical,
     }
-    # Algorithm to assign categories -
-    # first count the occurrences of category keywords and then assign the category based on the highest count. 
-    # In case of a tie, it selects the category whose word appears first.
 
-    # Count occurrences of each category
+        # Define urgency keywords. I have added some extra keywords from those mentioned in the document ! 
+        self.urgency_keywords = ["asap", "urgent", "emergency" , "immediately" , "fast" , "quick"]
+
+        # high value customers
+        self.customer_priority = ["director", "c-level", "ceo", "cto" , "vp" , "cfo" , "md","managing"]
+        self.priority_roles = ["admin"]  # roles that have to match exactly
+
+        # Check for business-impact keywords.
+        self.impact_words = ["pay", "demo" , "impact on business", "system is down" , "business problem" , "emergency" , "revenue" , "invoice" , "system crash" , "bill" , "dashboard"]
+
+        # Assign the correct support team
+        self.support_expertise = {
+            TicketCategory.ACCESS: ["System Administrator and Access Manager."],
+            TicketCategory.BILLING: ["Billing accountant and Account Manager. "],
+            TicketCategory.TECHNICAL: ["Technical Support Engineer and Customer Support."],
+            TicketCategory.FEATURE: ["Product Manager and Developer."]
+        }
+
+        # Map category to suggested response type
+        self.mapping_response = {
+            TicketCategory.ACCESS: "access_issue",
+            TicketCategory.BILLING: "billing_inquiry",
+            TicketCategory.TECHNICAL: "technical_issue",
+            TicketCategory.FEATURE: "feature_request"
+        }
+
+        # Extra feature - Follow-up Prediction based on category and sentiment
+        self.follow_up_predictions = {
+            TicketCategory.BILLING: "The client may ask for more information about invoices or payment methods.",
+            TicketCategory.ACCESS: "The customer might request additional troubleshooting steps or more privileged access.",
+            TicketCategory.TECHNICAL: "The customer might ask for further technical support .",
+            TicketCategory.FEATURE: "The customer might inquire about the product roadmap or feature release timeline."
+        }
+        self.stressed_follow_up = "The customer is stressed as their issue seems to be complicated and may need to be escalated to higher authorities."
+
+        # All the tables compiled into one read only index (with the keyword matcher, so each ticket is scanned once for every
+        # keyword). A new index is swapped in as a whole when the rules file changes, see reload_rules / watch_rules.
+        self.rules_path = rules_path
+        self._rule_reloader = None
+        self.rules = self.load_rules(rules_path) if rules_path else compile_rules(self.default_rules())
+
+        ## Advanced extra sentiment analysis using vader package to determine positive or negative sentiment of ticket data 
+        # The VADER lexicon is loaded lazily on the first ticket (see sentiment.py) and never downloaded at runtime
+        self.lexicon_path = lexicon_path
+        # with vectorized_sentiment, analyze_batch scores the whole batch at once with NumPy (see vector_sentiment.py)
+        self.vectorized_sentiment = vectorized_sentiment
+        self._vector_sentiment = None
+        if vectorized_sentiment:
+            from .vector_sentiment import np
+            if np is None:
+                raise ImportError("vectorized_sentiment needs NumPy (pip install numpy)")
+
+        # with large_tickets, tickets over its threshold are analysed in bounded memory (see large_tickets.py)
+        self.large_tickets = large_tickets
+
+    def is_large(self, ticket_content) -> bool:
+        return self.large_tickets is not None and self.large_tickets.applies(ticket_content)
+
+    def _sentiment_text(self, ticket_content: str) -> str:
+        # the text VADER scores, a window of it for large tickets
+        if self.is_large(ticket_content):
+            return large_tickets.sentiment_window(ticket_content, self.large_tickets.sentiment_window)
+        return ticket_content
+
+    @property
+    def matcher(self) -> KeywordMatcher:
+        return self.rules.matcher
+
+    def default_rules(self) -> dict:
+        # the built in tables as a rules dict, in the format of a rules file
+        return {
+            "categories": {
+                category.value: {
+                    "keywords": list(keywords),
+                    "expertise": list(self.support_expertise[category]),
+                    "response_type": self.mapping_response[category],
+                    "follow_up": self.follow_up_predictions[category],
+                }
+                for category, keywords in self.category_keywords.items()
+            },
+            "urgency_keywords": list(self.urgency_keywords),
+            "impact_words": list(self.impact_words),
+            "customer_priority": list(self.customer_priority),
+            "priority_roles": list(self.priority_roles),
+            "stressed_follow_up": self.stressed_follow_up,
+        }
+
+    def load_rules(self, path: str) -> RuleIndex:
+        # the rules file on top of the defaults, compiled. Raises (ValueError, OSError, ...) when the file is not usable
+        return compile_rules({**self.default_rules(), **load_rules_file(path)}, source=path)
+
+    def reload_rules(self) -> RuleIndex:
+        # load the rules file again and swap the new rules in, tickets that are running keep the rules they started with
+        self.rules = self.load_rules(self.rules_path)
+        return self.rules
+
+    def watch_rules(self, interval: float = DEFAULT_RELOAD_INTERVAL) -> RuleReloader:
+        # reload the rules file in a background thread whenever it changes
+        if not self.rules_path:
+            raise ValueError("watch_rules needs the agent to be created with a rules_path")
+        if self._rule_reloader is None:
+            self._rule_reloader = RuleReloader(self.rules_path, self.load_rules, self._swap_rules, interval).start()
+        return self._rule_reloader
+
+    def stop_watching_rules(self) -> None:
+        if self._rule_reloader is not None:
+            self._rule_reloader.stop()
+            self._rule_reloader = None
+
+    def _swap_rules(self, rules: RuleIndex) -> None:
+        self.rules = rules
+
+    def warm_up(self):
+        # preload nltk and the VADER lexicon so the first ticket does not pay for it
+        sentiment_analysis.warm_up(self.lexicon_path)
+
+    async def analyze_ticket(self, ticket_content: str, customer_info: Optional[dict] = None, lazy: bool = False) -> TicketAnalysis:
+        # with lazy=True the result is a LazyTicketAnalysis: category and routing are done now, key points, sentiment,
+        # urgency indicators and follow up are worked out the first time they are read (only the stages that are needed run)
+        with metrics.stage("analyze_ticket"):
+            if lazy:
+                return self._analyze_lazy(ticket_content, customer_info)
+            return self._analyze(ticket_content, customer_info)
+
+    async def analyze_batch(self, tickets: List[tuple]) -> List[TicketAnalysis]:
+        # tickets is a list of (ticket_content, customer_info) pairs. The rule tables and analyzer built in __init__
+        # are shared by every ticket and the results are returned in the same order as the input.
+        analyses = []
+        batch_scores = self.batch_sentiment([ticket_content for ticket_content, _ in tickets])
+        for (ticket_content, customer_info), sentiment_scores in zip(tickets, batch_scores):
+            with metrics.stage("analyze_ticket"):
+                analyses.append(self._analyze(ticket_content, customer_info, sentiment_scores))
+        return analyses
+
+    def batch_sentiment(self, contents: List[str]) -> List[Optional[dict]]:
+        # VADER scores for a batch of ticket texts in one go when vectorized_sentiment is on, otherwise (and for contents
+        # that are not text, they fail in _analyze as usual) None, then every ticket is scored on its own
+        if not self.vectorized_sentiment:
+            return [None] * len(contents)
+        if self._vector_sentiment is None:
+            from .vector_sentiment import VectorSentiment
+            self._vector_sentiment = VectorSentiment(self.lexicon_path)
+        texts = [self._sentiment_text(content) for content in contents if isinstance(content, str)]
+        with metrics.stage("sentiment"):
+            scores = iter(self._vector_sentiment.polarity_scores_batch(texts))
+        return [next(scores) if isinstance(content, str) else None for content in contents]
+
+    def thread_state(self, customer_info: Optional[dict] = None) -> ThreadAnalysisState:
+        # empty state for a ticket thread, feed it the first message and every reply with analyze_appended
+        return ThreadAnalysisState(self.rules, customer_info, self.lexicon_path)
+
+    async def analyze_appended(self, state: ThreadAnalysisState, appended_content: str) -> TicketAnalysis:
+        # Adds a reply (or the first message) to the thread state and returns the analysis of the whole thread so far,
+        # the same as analyze_ticket(state.content, customer_info) but without going over the earlier messages again.
+        with metrics.stage("analyze_ticket"):
+            if state.rules is not self.rules:
+                state.use_rules(self.rules)  # the rules were reloaded, the thread is scanned again once with the new ones
+            state.append(appended_content)
+            rules = state.rules
+            category = self._select_category(state.keyword_scan, rules)
+            key_points = state.key_points(category.value)
+            if not key_points:
+                key_points = state.sentences(3)  # store first 3 sentences if no category defined
+                metrics.incr("key_point_fallbacks")
+            return self._build_analysis(state.keyword_scan, category, key_points, state.sentiment.scores(), state.customer_info, rules)
+
+    async def triage_ticket(self, ticket_content: str, customer_info: Optional[dict] = None) -> TicketTriage:
+        # Routing only: category, priority, team and response type from the keyword scan and the customer role.
+        # No sentiment and no key points, see TicketProcessor.triage_ticket for getting the rest later when it is needed.
+        return self._triage(ticket_content, customer_info)[0]
+
+    def _triage(self, ticket_content: str, customer_info: Optional[dict] = None) -> tuple:
+        # (triage, rules, keyword scan), the last two are what finish_analysis needs to complete the analysis later
+        with metrics.stage("triage"):
+            rules = self.rules
+            keyword_scan, category = self._categorize(ticket_content, rules)
+            return self._routing(keyword_scan, category, customer_info, rules), rules, keyword_scan
+
+    def _categorize(self, ticket_content: str, rules: RuleIndex) -> tuple:
+        with metrics.stage("category_matching"):
+            # Convert the ticket content to lowercase to make the search case-insensitive.
+            # For extra in future could use advacned tokenisation and stemming with stop word removal for more in depth analysis
+            if self.is_large(ticket_content):
+                # chunk by chunk instead of a lowercase copy of the whole ticket, the same counts and offsets
+                metrics.incr("large_tickets")
+                limits = self.large_tickets
+                keyword_scan = large_tickets.scan_chunked(rules.matcher, ticket_content, limits.chunk_size, limits.max_key_points)
+            else:
+                content_lowercase = ticket_content.lower()
+
+                # one pass over the ticket finds every category, urgency and impact keyword along with the line it is on
+                keyword_scan = rules.matcher.scan(content_lowercase)
+            category = self._select_category(keyword_scan, rules)
+        return keyword_scan, category
+
+    def _analyze(self, ticket_content: str, customer_info: Optional[dict] = None, sentiment_scores: Optional[dict] = None) -> TicketAnalysis:
+        rules = self.rules  # the same rules for the whole ticket, even if new ones are swapped in meanwhile
+        keyword_scan, category = self._categorize(ticket_content, rules)
+        return self.finish_analysis(ticket_content, customer_info, rules, keyword_scan, category, sentiment_scores)
+
+    def _analyze_lazy(self, ticket_content: str, customer_info: Optional[dict] = None) -> LazyTicketAnalysis:
+        # category and routing now (a bad ticket fails here, like in _analyze), the rest when it is read
+        triage, rules, keyword_scan = self._triage(ticket_content, customer_info)
+        category = triage.category
+        # each function gets the analysis, follow up reads its sentiment (and so computes it first if needed)
+        return LazyTicketAnalysis.deferred(
+            {
+                "key_points": lambda analysis: self._key_points(ticket_content, keyword_scan, category),
+                "sentiment": lambda analysis: self._sentiment(ticket_content),
+                "urgency_indicators": lambda analysis: keyword_scan.group_present("urgency"),
+                "follow_up_prediction": lambda analysis: self._follow_up(category, analysis.sentiment, rules),
+            },
+            category=category,
+            priority=triage.priority,
+            required_expertise=list(triage.required_expertise),
+            business_impact=triage.business_impact,
+            suggested_response_type=triage.suggested_response_type,
+        )
+
+    def finish_analysis(self, ticket_content: str, customer_info: Optional[dict], rules: RuleIndex, keyword_scan: KeywordScan,
+                        category: TicketCategory, sentiment_scores: Optional[dict] = None, triage: Optional[TicketTriage] = None) -> TicketAnalysis:
+        # the second half of the analysis (key points, sentiment, follow up) for a ticket that was already scanned
+        key_points = self._key_points(ticket_content, keyword_scan, category)
+
+        # Get sentiment scores from the process wide analyzer, duplicate tickets are answered from its cache
+        # (unless the batch was already scored by batch_sentiment)
+        if sentiment_scores is None:
+            with metrics.stage("sentiment"):
+                sentiment_scores = sentiment_analysis.polarity_scores(self._sentiment_text(ticket_content), self.lexicon_path)
+        
+        return self._build_analysis(keyword_scan, category, key_points, sentiment_scores, customer_info, rules, triage)
+
+    def _key_points(self, ticket_content: str, keyword_scan: KeywordScan, category: TicketCategory) -> List[str]:
+        # Extract key sentences with keywords
+
+        with metrics.stage("key_points"):
+            if self.is_large(ticket_content):
+                # read straight out of the ticket at the lines the scan found, capped in number and length
+                key_points = large_tickets.key_points(ticket_content, keyword_scan, category.value, self.large_tickets)
+                if not key_points:
+                    key_points = large_tickets.first_sentences(ticket_content, min(3, self.large_tickets.max_key_points),
+                                                               self.large_tickets)
+                    metrics.incr("key_point_fallbacks")
+                return key_points
+
+            #split text on new line. The keyword scan already knows which lines have urgent or category words on them
+            lines = ticket_content.split("\n")
+            sentences = []
+            key_points = []
+            category_group = category.value
+
+            for line_number, line in enumerate(lines):
+                sentence = line.strip()
+                if not sentence:
+                    continue
+                sentences.append(sentence)
+
+                #store sentences with urgent keywords or with keywords of the ticket category
+                groups_on_line = keyword_scan.line_hits.get(line_number)
+                if groups_on_line and ("urgency" in groups_on_line or category_group in groups_on_line):
+                    key_points.append(sentence)
+
+
+            if not key_points:
+                key_points = sentences[:3]  # store first 3 sentences if no category defined 
+                metrics.incr("key_point_fallbacks")
+        return key_points
+
+    def _sentiment(self, ticket_content: str) -> float:
+        with metrics.stage("sentiment"):
+            sentiment_scores = sentiment_analysis.polarity_scores(self._sentiment_text(ticket_content), self.lexicon_path)
+        return (sentiment_scores["compound"] + 1) / 2  # Normalize to scale 0 to 1
+
+    def _follow_up(self, category: TicketCategory, sentiment: float, rules: RuleIndex) -> str:
+        # Extra feature - Follow-up Prediction based on category and sentiment
+        follow_up_prediction = rules.follow_up_predictions.get(category, "")
+        if sentiment < 0.4:
+            follow_up_prediction += rules.stressed_follow_up
+        return follow_up_prediction
+
+    def _select_category(self, keyword_scan: KeywordScan, rules: RuleIndex) -> TicketCategory:
+        # Algorithm to assign categories -
+        # first count the occurrences of category keywords and then assign the category based on the highest count. 
+        # In case of a tie, it selects the category whose word appears first.
+
+        # Count occurrences of each category
         category_counts = defaultdict(int)
         first_occurrence = {}
 
-        for category, keywords in category_keywords.items():
-            for word in keywords: # iterate over words from each category
-                count = content_lowercase.count(word)  # Count occurrences
-                if count > 0:
-                    category_counts[category] += count
-                    index = content_lowercase.find(word) # store index of word in content
-                    if category not in first_occurrence or index < first_occurrence[category]:
-                        first_occurrence[category] = index  # Track first occurrence index
+        for category in rules.category_keywords:
+            count = keyword_scan.group_count(category.value)  # Count occurrences of all the category words
+            if count > 0:
+                category_counts[category] += count
+                first_occurrence[category] = keyword_scan.group_first(category.value)  # Track first occurrence index
 
         # Get the category with max occurrences
         if category_counts:
@@ -55,7 +337,12 @@ class TicketAnalysisAgent:
             category = min(equal_categories, key=lambda cat: first_occurrence[cat])
         else:
             category = TicketCategory.TECHNICAL  # Default category if no keywords found
+            metrics.incr("category_fallbacks")
+
+        return category
 
+    def _routing(self, keyword_scan: KeywordScan, category: TicketCategory, customer_info: Optional[dict], rules: RuleIndex) -> TicketTriage:
+        # the fields that only need the keyword scan and the customer role: priority, team and response type
 
         # Determine priority based on urgency , business impact and customer role. Keep default Low Priority
         # I have done basic priority identification based on words present for each priority category. There is some overlap also .
@@ -63,25 +350,18 @@ class TicketAnalysisAgent:
 
         priority = Priority.LOW
 
-        # Define urgency keywords. I have added some extra keywords from those mentioned in the document ! 
-        urgency_keywords = ["asap", "urgent", "emergency" , "immediately" , "fast" , "quick"]
-
         # Check if any urgency keywords are present in the ticket content.
-        urgency_detection = any(keyword in content_lowercase for keyword in urgency_keywords)
+        urgency_detection = keyword_scan.group_present("urgency")
 
-        # high value customers
-        customer_priority = ["director", "c-level", "ceo", "cto" , "vp" , "cfo" , "md","managing"]
-        
         # check if the customer role indicates high-level like C-suite
         customer_is_high_level = False
         if customer_info:
             role = customer_info.get("role", "").lower()
-            if any(keyword in role for keyword in customer_priority) or role == 'admin':
+            if any(keyword in role for keyword in rules.customer_priority) or role in rules.priority_roles:
                 customer_is_high_level = True
         
         # Check for business-impact keywords. Initial default impact set to low. 
-        impact_words = ["pay", "demo" , "impact on business", "system is down" , "business problem" , "emergency" , "revenue" , "invoice" , "system crash" , "bill" , "dashboard"]
-        business_impact_present = any(word in content_lowercase for word in impact_words)
+        business_impact_present = keyword_scan.group_present("impact")
         business_impact = "High" if business_impact_present else "Low"
 
         # Count how many priority factors are present
@@ -109,101 +389,38 @@ class TicketAnalysisAgent:
             priority = Priority.LOW 
 
 
-        # Extract key sentences with keywords
-
-        #split text on new line
-        sentences = [s.strip() for s in ticket_content.split("\n") if s.strip()]
-        key_points = []
-
-        for sentence in sentences:
-
-            #store sentences with urgent keywords
-            if any(keyword in sentence.lower() for keyword in urgency_keywords):
-                key_points.append(sentence)
-            
-            #store important sentences related to billing
-            elif category == TicketCategory.BILLING and any(keyword in sentence.lower() for keyword in billing):
-                key_points.append(sentence)
-
-            #store important sentences related to access
-            elif category == TicketCategory.ACCESS and any(keyword in sentence.lower() for keyword in access):
-                key_points.append(sentence)
-            
-            #store important sentences related to features
-            elif category == TicketCategory.FEATURE and any(keyword in sentence.lower() for keyword in feature):
-                key_points.append(sentence)
-            
-            #store important sentences related to technical stuff
-            elif category == TicketCategory.TECHNICAL and any(keyword in sentence.lower() for keyword in technical):
-                key_points.append(sentence)
-
-
-        if not key_points:
-            key_points = sentences[:3]  # store first 3 sentences if no category defined 
-
-        # Assign the correct support team
-        support_expertise = {
-            TicketCategory.ACCESS: ["System Administrator and Access Manager."],
-            TicketCategory.BILLING: ["Billing accountant and Account Manager. "],
-            TicketCategory.TECHNICAL: ["Technical Support Engineer and Customer Support."],
-            TicketCategory.FEATURE: ["Product Manager and Developer."]
-        }
         # determine support and if no category send to general support 
-        required_expertise = support_expertise.get(category, ["General Support."])
-        
-        ## Advanced extra sentiment analysis using vader package to determine positive or negative sentiment of ticket data 
-        # Initialize VADER SentimentIntensityAnalyzer
-        sia = SentimentIntensityAnalyzer()
+        required_expertise = list(rules.support_expertise.get(category, ["General Support."]))  # a list of its own, the rules are read only
         
-        # Get sentiment scores
-        sentiment_scores = sia.polarity_scores(ticket_content)
-        sentiment = (sentiment_scores["compound"] + 1) / 2  # Normalize to scale 0 to 1
-        
-        # Map category to suggested response type
-        mapping_response = {
-            TicketCategory.ACCESS: "access_issue",
-            TicketCategory.BILLING: "billing_inquiry",
-            TicketCategory.TECHNICAL: "technical_issue",
-            TicketCategory.FEATURE: "feature_request"
-        }
         #incase no category so general response
-        suggested_response_type = mapping_response.get(category, "general_response")
+        suggested_response_type = rules.mapping_response.get(category, "general_response")
 
-        # Extra feature - Follow-up Prediction based on category and sentiment
-        follow_up_prediction = ""
-        if category == TicketCategory.BILLING:
-            follow_up_prediction = "The client may ask for more information about invoices or payment methods."
-        elif category == TicketCategory.ACCESS:
-            follow_up_prediction = "The customer might request additional troubleshooting steps or more privileged access."
-        elif category == TicketCategory.TECHNICAL:
-            follow_up_prediction = "The customer might ask for further technical support ."
-        elif category == TicketCategory.FEATURE:
-            follow_up_prediction = "The customer might inquire about the product roadmap or feature release timeline."
-        if sentiment < 0.4:
-            follow_up_prediction += "The customer is stressed as their issue seems to be complicated and may need to be escalated to higher authorities."
+        return TicketTriage(
+            category=category,
+            priority=priority,
+            required_expertise=required_expertise,
+            business_impact=business_impact,
+            suggested_response_type=suggested_response_type
+        )
 
-        
+    def _build_analysis(self, keyword_scan: KeywordScan, category: TicketCategory, key_points: List[str], sentiment_scores: dict,
+                        customer_info: Optional[dict], rules: RuleIndex, triage: Optional[TicketTriage] = None) -> TicketAnalysis:
+        # everything that follows from the keyword scan, key points and sentiment, shared by the full and the incremental analysis
+        sentiment = (sentiment_scores["compound"] + 1) / 2  # Normalize to scale 0 to 1
+        if triage is None:
+            triage = self._routing(keyword_scan, category, customer_info, rules)
+
+        follow_up_prediction = self._follow_up(category, sentiment, rules)
 
         #returning all required values 
         return TicketAnalysis(
             category=category,
-            priority=priority,
+            priority=triage.priority,
             key_points=key_points,
-            required_expertise=required_expertise,
+            required_expertise=list(triage.required_expertise),
             sentiment=sentiment,
-            urgency_indicators=urgency_detection,
-            business_impact=business_impact,
-            suggested_response_type=suggested_response_type ,
+            urgency_indicators=keyword_scan.group_present("urgency"),
+            business_impact=triage.business_impact,
+            suggested_response_type=triage.suggested_response_type ,
             follow_up_prediction=follow_up_prediction
         )
-
-        
-
-    
-
-
-
-
-
-    
-        
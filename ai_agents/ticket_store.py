@@ -0,0 +1,299 @@
+import asyncio
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Iterator, List, Optional
+from data_classes import *
+
+# Persistent store of processed tickets (TicketProcessor(store=TicketStore("tickets.db"))), so questions like "all
+# URGENT access tickets of the last hour" or "the earlier tickets of this customer" are an index lookup instead of
+# a scan through logs.
+#
+# Every resolution is one row with its category, priority, customer name and role, the time it was stored and the
+# resolution as JSON (resolution_to_dict). Writing is kept off the hot path: add() only takes the indexed columns and
+# a reference to the resolution (do not change it afterwards), the writer thread encodes the JSON and inserts whatever
+# has piled up in one transaction (group commit). While one commit is on its way to disk the next rows gather, so
+# under load a commit carries hundreds of rows and there is one disk sync per batch, not per ticket. Rows waiting to
+# be written are lost if the process dies, flush() waits until everything added so far is committed. add() blocks
+# when max_pending rows are waiting, so a slow disk can not make the list grow without bound. On an event loop use
+# await add_async() (TicketProcessor does), which waits for room in a thread instead of stopping the loop, try_add(),
+# which never waits and queues nothing when the store is full, or add_nowait(), which never waits either and keeps
+# rows that find the store full in an overflow list the writer takes them from in order (unbounded, for callers that
+# can not wait, like the second stage of a triaged ticket).
+#
+# The database is in WAL mode, so queries (on their own connection) never wait for the writer. Query helpers return
+# a TicketQuery that fetches page_size rows at a time, newest first, as it is iterated. Pages continue from the last
+# row seen (keyset paging) instead of an OFFSET, so a late page costs the same as the first one.
+#
+#   store = TicketStore("tickets.db")
+#   for stored in store.find(category=TicketCategory.ACCESS, priority=Priority.URGENT, since=time.time() - 3600):
+#       stored.ticket_id, stored.created_at, stored.resolution["response"]["response_text"]
+#   store.customer_history("John Smith").first(10)
+
+DEFAULT_BATCH_SIZE = 1000      # most rows in one commit
+DEFAULT_MAX_PENDING = 10000    # rows waiting for the writer before add() blocks
+DEFAULT_PAGE_SIZE = 100
+
+_COLUMNS = "id, ticket_id, category, priority, customer_name, customer_role, created_at, cluster_id, resolution"
+
+
+@dataclass
+class StoredTicket:
+    row_id: int
+    ticket_id: str
+    category: TicketCategory
+    priority: Priority
+    customer_name: Optional[str]
+    customer_role: Optional[str]
+    created_at: float
+    cluster_id: Optional[str]
+    resolution: dict  # as written by resolution_to_dict
+
+
+def _stored_ticket(row: tuple) -> StoredTicket:
+    row_id, ticket_id, category, priority, name, role, created_at, cluster_id, resolution = row
+    return StoredTicket(row_id, ticket_id, TicketCategory[category], Priority(priority), name, role, created_at, cluster_id,
+                        json.loads(resolution))
+
+
+def _text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+class TicketQuery:
+    # The rows matching one query, newest first, read page_size rows at a time while iterating.
+    def __init__(self, store: "TicketStore", where: List[str], params: list, page_size: int = DEFAULT_PAGE_SIZE):
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        self.store = store
+        self.where = where
+        self.params = params
+        self.page_size = page_size
+
+    def pages(self) -> Iterator[List[StoredTicket]]:
+        last = None
+        while True:
+            where, params = list(self.where), list(self.params)
+            if last is not None:
+                where.append("(created_at, id) < (?, ?)")
+                params += last
+            page = self.store._select(where, params, self.page_size)
+            if not page:
+                return
+            yield page
+            if len(page) < self.page_size:
+                return
+            last = [page[-1].created_at, page[-1].row_id]
+
+    def __iter__(self) -> Iterator[StoredTicket]:
+        for page in self.pages():
+            yield from page
+
+    def first(self, count: int) -> List[StoredTicket]:
+        return list(islice(self, count))
+
+    def count(self) -> int:
+        return self.store._count(self.where, self.params)
+
+
+class TicketStore:
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE, max_pending: int = DEFAULT_MAX_PENDING,
+                 clock: Callable[[], float] = time.time):
+        if batch_size < 1 or max_pending < 1:
+            raise ValueError("batch_size and max_pending must be at least 1")
+        self.path = path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.clock = clock
+        self.commits = 0
+        self.failed = 0  # rows lost to a commit that failed
+        self._pending: List[tuple] = []
+        self._overflow = deque()  # rows add_nowait() queued while max_pending rows were waiting, oldest first
+        self._added = 0
+        self._written = 0  # rows the writer is done with, committed or failed
+        self._closed = False
+        self._condition = threading.Condition()
+        self._read_lock = threading.Lock()
+
+        self._connection = self._connect()
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            " id INTEGER PRIMARY KEY, ticket_id TEXT, category TEXT NOT NULL, priority INTEGER NOT NULL,"
+            " customer_name TEXT, customer_role TEXT, created_at REAL NOT NULL, cluster_id TEXT, resolution TEXT NOT NULL)")
+        # every index ends in created_at, so a filtered query comes out newest first without sorting
+        for name, columns in (("category", "category, priority, created_at"), ("priority", "priority, created_at"),
+                              ("customer", "customer_name, created_at"), ("role", "customer_role, created_at"),
+                              ("created", "created_at"), ("ticket_id", "ticket_id, created_at")):
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS tickets_{name} ON tickets ({columns})")
+        self._writer = threading.Thread(target=self._write_loop, name="ticket-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # in WAL mode a crash can lose the last commits, never corrupt the file
+        return connection
+
+    def add(self, ticket: dict, resolution: TicketResolution) -> None:
+        # queues the resolution of ticket for the writer, the ticket gives the customer name and role. Waits while
+        # max_pending rows are waiting, do not call it on an event loop.
+        self._append(self._row(ticket, resolution), wait=True)
+
+    def try_add(self, ticket: dict, resolution: TicketResolution) -> bool:
+        # add() that never waits, False (and nothing queued) when max_pending rows are waiting
+        return self._append(self._row(ticket, resolution), wait=False)
+
+    def add_nowait(self, ticket: dict, resolution: TicketResolution) -> None:
+        # add() that never waits and never drops the row: past max_pending it goes to the overflow list, which the
+        # writer moves into the pending rows as there is room. It counts for flush() straight away.
+        row = self._row(ticket, resolution)
+        with self._condition:
+            if self._closed:
+                raise ValueError("add to a closed TicketStore")
+            if self._overflow or len(self._pending) >= self.max_pending:
+                self._overflow.append(row)
+            else:
+                self._pending.append(row)
+            self._added += 1
+            self._condition.notify_all()
+
+    async def add_async(self, ticket: dict, resolution: TicketResolution) -> None:
+        # add() for coroutines: only when the store is full it waits for room, in a thread, so the event loop keeps going
+        row = self._row(ticket, resolution)
+        if not self._append(row, wait=False):
+            await asyncio.to_thread(self._append, row, True)
+
+    def add_many(self, tickets: List[dict], resolutions: List[TicketResolution]) -> None:
+        for ticket, resolution in zip(tickets, resolutions):
+            self.add(ticket, resolution)
+
+    async def add_many_async(self, tickets: List[dict], resolutions: List[TicketResolution]) -> None:
+        for ticket, resolution in zip(tickets, resolutions):
+            await self.add_async(ticket, resolution)
+
+    def _row(self, ticket: dict, resolution: TicketResolution) -> tuple:
+        customer_info = ticket.get("customer_info") if isinstance(ticket, dict) else None
+        if not isinstance(customer_info, dict):
+            customer_info = {}
+        analysis = resolution.analysis
+        return (_text(resolution.ticket_id), analysis.category.name, analysis.priority.value, _text(customer_info.get("name")),
+                _text(customer_info.get("role")), self.clock(), resolution.cluster_id, resolution)
+
+    def _append(self, row: tuple, wait: bool) -> bool:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ValueError("add to a closed TicketStore")
+                if len(self._pending) < self.max_pending and not self._overflow:  # overflow rows go first
+                    break
+                if not wait:
+                    return False
+                self._condition.wait()
+            self._pending.append(row)
+            self._added += 1
+            self._condition.notify_all()
+            return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # waits until every row added so far is written, False when timeout ran out first. From a coroutine use
+        # await asyncio.to_thread(store.flush).
+        with self._condition:
+            target = self._added
+            return self._condition.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self) -> None:
+        # writes what is still pending, then stops the writer
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        self._connection.close()
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._pending or self._closed)
+                    if not self._pending:
+                        return
+                    batch = self._pending[:self.batch_size]
+                    del self._pending[:self.batch_size]
+                    while self._overflow and len(self._pending) < self.max_pending:
+                        self._pending.append(self._overflow.popleft())
+                    self._condition.notify_all()  # room for add() again
+                try:
+                    rows = [row[:-1] + (json.dumps(resolution_to_dict(row[-1])),) for row in batch]
+                    connection.execute("BEGIN IMMEDIATE")
+                    connection.executemany(
+                        "INSERT INTO tickets (ticket_id, category, priority, customer_name, customer_role, created_at, cluster_id,"
+                        " resolution) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    connection.execute("COMMIT")
+                    failed = 0
+                except Exception as e:
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    failed = len(batch)
+                    print(f"Ticket store could not write {failed} tickets: {e}", file=sys.stderr)
+                with self._condition:
+                    self.commits += not failed
+                    self.failed += failed
+                    self._written += len(batch)
+                    self._condition.notify_all()
+        finally:
+            connection.close()
+
+    def find(self, category: Optional[TicketCategory] = None, priority: Optional[Priority] = None,
+             min_priority: Optional[Priority] = None, customer_name: Optional[str] = None, customer_role: Optional[str] = None,
+             since: Optional[float] = None, until: Optional[float] = None, page_size: int = DEFAULT_PAGE_SIZE) -> TicketQuery:
+        # stored tickets matching every given filter, newest first. since / until are time.time() values, until excluded.
+        where, params = [], []
+        for column, value in (("category = ?", category.name if category is not None else None),
+                              ("priority = ?", priority.value if priority is not None else None),
+                              ("priority >= ?", min_priority.value if min_priority is not None else None),
+                              ("customer_name = ?", customer_name), ("customer_role = ?", customer_role),
+                              ("created_at >= ?", since), ("created_at < ?", until)):
+            if value is not None:
+                where.append(column)
+                params.append(value)
+        return TicketQuery(self, where, params, page_size)
+
+    def recent(self, seconds: float, **filters) -> TicketQuery:
+        # e.g. store.recent(3600, category=TicketCategory.ACCESS, priority=Priority.URGENT)
+        return self.find(since=self.clock() - seconds, **filters)
+
+    def customer_history(self, customer_name: str, page_size: int = DEFAULT_PAGE_SIZE) -> TicketQuery:
+        return self.find(customer_name=customer_name, page_size=page_size)
+
+    def get(self, ticket_id: str) -> Optional[StoredTicket]:
+        # the newest stored resolution of a ticket id
+        page = self._select(["ticket_id = ?"], [ticket_id], 1)
+        return page[0] if page else None
+
+    def _select(self, where: List[str], params: list, limit: int) -> List[StoredTicket]:
+        sql = f"SELECT {_COLUMNS} FROM tickets"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._read_lock:
+            rows = self._connection.execute(sql + " ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit]).fetchall()
+        return [_stored_ticket(row) for row in rows]
+
+    def _count(self, where: List[str], params: list) -> int:
+        sql = "SELECT COUNT(*) FROM tickets" + (" WHERE " + " AND ".join(where) if where else "")
+        with self._read_lock:
+            return self._connection.execute(sql, params).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._count([], [])
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"added": self._added, "pending": len(self._pending) + len(self._overflow), "written": self._written - self.failed,
+                    "failed": self.failed, "commits": self.commits}
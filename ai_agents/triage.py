@@ -0,0 +1,66 @@
+from typing import Callable, Optional
+from data_classes import *
+
+# Triage only mode (TicketProcessor.triage_ticket / triage_batch).
+#
+# Routing a ticket (category, priority, team, response type) only needs the keyword scan and the customer role, which
+# takes microseconds, while the sentiment pass over the whole text is most of the cost of a full analysis. A
+# TriagedTicket has the routing fields straight away and works out the rest (key points, sentiment, follow up, the
+# rendered response) the first time .analysis, .response or .resolution is read. The keyword scan from the triage
+# is reused for that, so a ticket that is triaged and then resolved costs the same as process_ticket.
+#
+# The second stage runs in the thread that reads the property. Tickets that are never looked at in full never pay for it.
+
+
+class TriagedTicket:
+    def __init__(self, ticket_id: str, triage: TicketTriage, finish: Optional[Callable[[], TicketResolution]] = None,
+                 resolution: Optional[TicketResolution] = None):
+        # finish() runs the second stage and returns the full resolution, or resolution is already known (e.g. an error)
+        self.ticket_id = ticket_id
+        self.triage = triage
+        self._finish = finish
+        self._resolution = resolution
+
+    @property
+    def category(self) -> TicketCategory:
+        return self.triage.category
+
+    @property
+    def priority(self) -> Priority:
+        return self.triage.priority
+
+    @property
+    def required_expertise(self) -> List[str]:
+        return self.triage.required_expertise
+
+    @property
+    def business_impact(self) -> str:
+        return self.triage.business_impact
+
+    @property
+    def suggested_response_type(self) -> str:
+        return self.triage.suggested_response_type
+
+    @property
+    def resolved(self) -> bool:
+        # True once the second stage has run
+        return self._resolution is not None
+
+    @property
+    def resolution(self) -> TicketResolution:
+        if self._resolution is None:
+            self._resolution = self._finish()
+            self._finish = None  # drops the ticket text and keyword scan
+        return self._resolution
+
+    @property
+    def analysis(self) -> TicketAnalysis:
+        return self.resolution.analysis
+
+    @property
+    def response(self) -> ResponseSuggestion:
+        return self.resolution.response
+
+    def __repr__(self) -> str:
+        state = "resolved" if self.resolved else "triaged"
+        return f"TriagedTicket({self.ticket_id!r}, {self.category.name}, {self.priority.name}, {state})"
@@ -0,0 +1,263 @@
+import math
+from typing import Dict, List, Optional
+from .sentiment import get_analyzer
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for vectorized sentiment
+    np = None
+
+# Batched VADER scoring with NumPy, for bulk backfills (TicketAnalysisAgent(vectorized_sentiment=True)).
+#
+# nltk's polarity_scores walks every word in Python, and building its punctuation table alone costs a dict of
+# 34 entries per distinct word. Here a batch of tickets is split into words once, every word is mapped through a
+# vocabulary to an id (a new word is looked at in Python once, then reused for every later batch), and the VADER rules
+# are worked out for all words of all tickets at once with array operations on per word properties:
+#   - lexicon valence, ALL CAPS emphasis, boosters / dampeners up to 3 words back
+#   - negations, "never so / this", "least", the special idioms and "kind of" / "sort of"
+#   - the first-appearance rule (VADER scores a repeated word with the context of its first appearance), the "but" rule
+#     and the "!" / "?" emphasis
+# Each step is the same formula on the same floats as nltk, in the same order, so the scores match polarity_scores;
+# tests/test_vector_sentiment.py and `python -m benchmarks.sentiment` check that on the sample tickets and the
+# synthetic corpus. The vocabulary is dropped and built again when it grows past max_vocabulary words (log dumps
+# are full of one-off tokens).
+
+DEFAULT_MAX_VOCABULARY = 200_000
+
+
+class VectorSentiment:
+    def __init__(self, lexicon_path: Optional[str] = None, max_vocabulary: int = DEFAULT_MAX_VOCABULARY):
+        if np is None:
+            raise ImportError("Vectorized sentiment needs NumPy (pip install numpy), or leave vectorized_sentiment off")
+        self.analyzer = get_analyzer(lexicon_path)
+        self.constants = self.analyzer.constants
+        self.max_vocabulary = max_vocabulary
+        self.punctuation = set(self.constants.PUNC_LIST)
+        self.punctuation_regex = self.constants.REGEX_REMOVE_PUNCTUATION
+        self._reset_vocabulary()
+
+    def _reset_vocabulary(self) -> None:
+        self._token_ids: Dict[str, int] = {}  # token as split from the text -> id of the word VADER turns it into
+        self._word_ids: Dict[str, int] = {}   # word -> id
+        self._words: List[str] = []
+        self._columns: Dict[str, "np.ndarray"] = {}  # per word property arrays, new words are added on the next batch
+        self._arrays = None                   # the columns plus the neutral entry, None when words were added since
+
+        # the words of the idioms and "kind of" style boosters always have an id, so they can be compared by id
+        self.idioms = [(tuple(self._word_id(word) for word in phrase.split()), value)
+                       for phrase, value in self.constants.SPECIAL_CASE_IDIOMS.items()]
+        self.booster_pairs = [tuple(self._word_id(word) for word in phrase.split())
+                              for phrase in self.constants.BOOSTER_DICT if " " in phrase]
+        self.never, self.so, self.this = (self._word_id(word) for word in ("never", "so", "this"))
+
+    def _word_id(self, word: str) -> int:
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            word_id = self._word_ids[word] = len(self._words)
+            self._words.append(word)
+            self._arrays = None
+        return word_id
+
+    def _token_id(self, token: str) -> int:
+        # VADER's words_and_emoticons: tokens of one character are left out (id -1), a token that is one punctuation mark
+        # (of PUNC_LIST) plus a word without punctuation of 2 or more characters, on either side, becomes that word.
+        # It only depends on the token itself.
+        if len(token) < 2:
+            self._token_ids[token] = -1
+            return -1
+        word = token
+        stripped = self.punctuation_regex.sub("", token)
+        if len(stripped) > 1:
+            if token.endswith(stripped) and token[:len(token) - len(stripped)] in self.punctuation:
+                word = stripped
+            elif token.startswith(stripped) and token[len(stripped):] in self.punctuation:
+                word = stripped
+        token_id = self._token_ids[token] = self._word_id(word)
+        return token_id
+
+    def _properties(self) -> dict:
+        # one entry per word id, plus a last neutral entry for "no word here" (before the start / after the end of a ticket)
+        if self._arrays is not None:
+            return self._arrays
+        lexicon = self.analyzer.lexicon
+        constants = self.constants
+        known = len(self._columns["valence"]) if self._columns else 0
+        words = self._words[known:]
+        lowered = [word.lower() for word in words]
+        count = len(words)
+        new = {
+            "in_lexicon": np.fromiter((word in lexicon for word in lowered), bool, count),
+            "valence": np.fromiter((lexicon.get(word, 0.0) for word in lowered), float, count),
+            "upper": np.fromiter((word.isupper() for word in words), bool, count),
+            "booster": np.fromiter((constants.BOOSTER_DICT.get(word, 0.0) for word in lowered), float, count),
+            "is_booster": np.fromiter((word in constants.BOOSTER_DICT for word in lowered), bool, count),
+            "negated": np.fromiter((word in constants.NEGATE or "n't" in word for word in lowered), bool, count),
+        }
+        for word in ("but", "kind", "of", "least", "at", "very"):
+            new[word] = np.fromiter((lower == word for lower in lowered), bool, count)
+        if self._columns:
+            new = {name: np.concatenate((self._columns[name], column)) for name, column in new.items()}
+        self._columns = new
+        self._arrays = {name: np.append(column, column.dtype.type(0)) for name, column in new.items()}
+        return self._arrays
+
+    def polarity_scores_batch(self, texts: List[str]) -> List[dict]:
+        # the polarity_scores dict for every text, in order
+        if len(self._words) > self.max_vocabulary:
+            self._reset_vocabulary()
+        lookup = self._token_ids.get
+        ids, token_counts = [], []
+        for text in texts:
+            if not isinstance(text, str):
+                raise TypeError(f"Sentiment needs text, got {type(text).__name__}")
+            tokens = text.split()
+            token_counts.append(len(tokens))
+            found = list(map(lookup, tokens))
+            if None in found:
+                found = [self._token_id(token) if token_id is None else token_id for token, token_id in zip(tokens, found)]
+            ids.extend(found)
+
+        properties = self._properties()
+        sentinel = len(self._words)
+        documents = len(texts)
+        ids = np.array(ids, dtype=np.int64)
+        doc = np.repeat(np.arange(documents), token_counts)
+        kept = ids >= 0
+        word, doc = ids[kept], doc[kept]
+        lengths = np.bincount(doc, minlength=documents)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if documents else lengths
+        position = np.arange(len(word)) - starts[doc]
+        doc_length = lengths[doc]
+
+        def shifted(offset: int):
+            # the word offset places away in the same ticket (negative is before), the neutral entry outside it
+            result = np.full(len(word), sentinel, dtype=np.int64)
+            if offset < 0 and len(word) > -offset:
+                result[-offset:] = word[:offset]
+            elif offset > 0 and len(word) > offset:
+                result[:-offset] = word[offset:]
+            inside = (position + offset >= 0) & (position + offset < doc_length)
+            return np.where(inside, result, sentinel)
+
+        before1, before2, before3, after1, after2 = shifted(-1), shifted(-2), shifted(-3), shifted(1), shifted(2)
+        in_lexicon, upper, negated = properties["in_lexicon"], properties["upper"], properties["negated"]
+
+        # "some but not all words are ALL CAPS", per ticket
+        caps = np.bincount(doc, weights=upper[word], minlength=documents)
+        cap_diff = ((lengths - caps > 0) & (lengths - caps < lengths))[doc]
+
+        constants = self.constants
+        scored = in_lexicon[word]
+        valence = properties["valence"][word].copy()
+        emphasis = upper[word] & cap_diff
+        valence = np.where(emphasis, np.where(valence > 0, valence + constants.C_INCR, valence - constants.C_INCR), valence)
+
+        so_or_this = lambda ids: (ids == self.so) | (ids == self.this)
+        for start, before, damping in ((0, before1, 1.0), (1, before2, 0.95), (2, before3, 0.9)):
+            modifies = scored & (position > start) & ~in_lexicon[before]
+            scalar = properties["booster"][before]
+            scalar = np.where(valence < 0, -scalar, scalar)
+            booster_caps = properties["is_booster"][before] & upper[before] & cap_diff
+            scalar = np.where(booster_caps, np.where(valence > 0, scalar + constants.C_INCR, scalar - constants.C_INCR), scalar)
+            if damping != 1.0:
+                scalar = np.where(scalar != 0, scalar * damping, scalar)
+            valence = np.where(modifies, valence + scalar, valence)
+
+            # _never_check
+            if start == 0:
+                valence = np.where(modifies & negated[before1], valence * constants.N_SCALAR, valence)
+            elif start == 1:
+                never_so = (before2 == self.never) & so_or_this(before1)
+                valence = np.where(modifies & never_so, valence * 1.5,
+                                   np.where(modifies & negated[before2], valence * constants.N_SCALAR, valence))
+            else:
+                never_so = ((before3 == self.never) & so_or_this(before2)) | so_or_this(before1)
+                valence = np.where(modifies & never_so, valence * 1.25,
+                                   np.where(modifies & negated[before3], valence * constants.N_SCALAR, valence))
+                valence = self._idioms(valence, modifies, word, before1, before2, before3, after1, after2)
+
+        # _least_check
+        least_before = ~in_lexicon[before1] & properties["least"][before1]
+        not_at_least = ~(properties["at"][before2] | properties["very"][before2])
+        valence = np.where(scored & (position > 1) & least_before & not_at_least, valence * constants.N_SCALAR, valence)
+        valence = np.where(scored & (position == 1) & least_before, valence * constants.N_SCALAR, valence)
+
+        # words that are not in the lexicon, boosters and the "kind" of "kind of" count as 0
+        kind_of = properties["kind"][word] & properties["of"][after1]
+        valence = np.where(scored & ~properties["is_booster"][word] & ~kind_of, valence, 0.0)
+
+        # a repeated word gets the value of its first appearance in the ticket (polarity_scores uses list.index)
+        if len(word):
+            _, first, inverse = np.unique(doc * (sentinel + 1) + word, return_index=True, return_inverse=True)
+            sentiments = valence[first[inverse.reshape(-1)]]
+        else:
+            sentiments = valence
+
+        # _but_check: halve the words before the first "but" and add half to the ones after it
+        far = np.iinfo(np.int64).max
+        but_at = np.full(documents, far, dtype=np.int64)
+        is_but = properties["but"][word]
+        np.minimum.at(but_at, doc[is_but], position[is_but])
+        but_position = but_at[doc]
+        has_but = but_position != far
+        sentiments = np.where(has_but & (position < but_position), sentiments * 0.5,
+                              np.where(has_but & (position > but_position), sentiments * 1.5, sentiments))
+
+        # score_valence, the sums run over the words in order like the Python loops they replace
+        sums = np.bincount(doc, weights=sentiments, minlength=documents)
+        positive = np.bincount(doc, weights=np.where(sentiments > 0, sentiments + 1, 0.0), minlength=documents)
+        negative = np.bincount(doc, weights=np.where(sentiments < 0, sentiments - 1, 0.0), minlength=documents)
+        neutral = np.bincount(doc, weights=sentiments == 0, minlength=documents)
+        return [self._scores(text, length, total, positive_sum, negative_sum, neutral_count)
+                for text, length, total, positive_sum, negative_sum, neutral_count
+                in zip(texts, lengths.tolist(), sums.tolist(), positive.tolist(), negative.tolist(), neutral.tolist())]
+
+    def polarity_scores(self, text: str) -> dict:
+        return self.polarity_scores_batch([text])[0]
+
+    def _idioms(self, valence, modifies, word, before1, before2, before3, after1, after2):
+        # _idioms_check, only reached for the third word back. The first matching idiom before the word wins, an idiom
+        # starting at the word replaces it, then "kind of" / "sort of" / "just enough" before the word dampen it.
+        sequences = [(before1, word), (before2, before1, word), (before2, before1), (before3, before2, before1), (before3, before2)]
+        idiom = np.full(len(word), np.nan)
+        for sequence in reversed(sequences):
+            idiom = self._match_idioms(sequence, idiom)
+        for sequence in ((word, after1), (word, after1, after2)):
+            idiom = self._match_idioms(sequence, np.full(len(word), np.nan), idiom)
+        valence = np.where(modifies & ~np.isnan(idiom), idiom, valence)
+
+        dampened = np.zeros(len(word), dtype=bool)
+        for first, second in self.booster_pairs:
+            dampened |= ((before3 == first) & (before2 == second)) | ((before2 == first) & (before1 == second))
+        return np.where(modifies & dampened, valence + self.constants.B_DECR, valence)
+
+    def _match_idioms(self, sequence, idiom, keep=None):
+        for phrase, value in self.idioms:
+            if len(phrase) == len(sequence):
+                matches = np.logical_and.reduce([ids == phrase_id for ids, phrase_id in zip(sequence, phrase)])
+                idiom = np.where(matches, value, idiom)
+        if keep is not None:
+            idiom = np.where(np.isnan(idiom), keep, idiom)
+        return idiom
+
+    def _scores(self, text: str, length: int, total: float, positive_sum: float, negative_sum: float, neutral_count: float) -> dict:
+        # the end of SentimentIntensityAnalyzer.score_valence, per ticket
+        if not length:
+            return {"neg": 0.0, "neu": 0.0, "pos": 0.0, "compound": 0.0}
+        emphasis = self.analyzer._punctuation_emphasis(total, text)
+        if total > 0:
+            total += emphasis
+        elif total < 0:
+            total -= emphasis
+        compound = self.constants.normalize(total)
+        if positive_sum > math.fabs(negative_sum):
+            positive_sum += emphasis
+        elif positive_sum < math.fabs(negative_sum):
+            negative_sum -= emphasis
+        words = positive_sum + math.fabs(negative_sum) + neutral_count
+        return {
+            "neg": round(math.fabs(negative_sum / words), 3),
+            "neu": round(math.fabs(neutral_count / words), 3),
+            "pos": round(math.fabs(positive_sum / words), 3),
+            "compound": round(compound, 4),
+        }
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+from data_classes import *
+from .agent_orchestration import TicketProcessor
+from .metrics import metrics
+
+# Worker queue mode for ticket bursts (an outage can produce thousands of tickets in a few minutes).
+#
+# Tickets are first written to a local SQLite queue (WorkQueue) and QueueWorker takes them from there, so nothing is lost
+# when the workers fall behind or the process is stopped. Processing is at least once:
+#   - a worker leases a ticket for lease_seconds, a ticket whose lease runs out (the worker crashed or hung) is handed out again
+#   - the resolution is written into the ticket's row and the ticket is marked done in the same statement, so a ticket is
+#     only acknowledged once its resolution is stored
+#   - a ticket that fails (process_ticket raised or timed out) is put back with exponential backoff, after max_attempts
+#     tries it is moved to the dead letters with its last error instead of getting the default "An error occurred" resolution
+#
+# Workers lease a few tickets at a time and acknowledge them together, one disk sync per batch instead of per ticket. If a
+# worker dies, its whole batch is handed out again once the lease runs out (batch_size=1 keeps that to one ticket).
+# Several worker processes can share one queue file, leasing is one IMMEDIATE transaction.
+
+DEFAULT_LEASE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 300.0
+
+PENDING, LEASED, DONE, DEAD = "pending", "leased", "done", "dead"
+
+_thread_state = threading.local()
+
+
+def _run_in_thread(coroutine):
+    # runs coroutine on this thread's own event loop, made once per executor thread (asyncio.run per ticket costs
+    # about a third of the queue's throughput)
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None:
+        loop = _thread_state.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+@dataclass
+class QueuedTicket:
+    job_id: int
+    ticket: dict
+    attempt: int  # 1 for the first try, identifies the lease when the ticket is acknowledged
+
+
+class WorkQueue:
+    # available_at is when a pending ticket may be tried (again) and, for a leased ticket, when its lease runs out,
+    # so one index finds both the tickets that are due and the ones whose worker went away.
+    def __init__(self, path: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.path = path
+        self.max_attempts = max_attempts
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=FULL")  # an acknowledged ticket survives a power cut
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS work_queue ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, ticket TEXT NOT NULL, status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, enqueued_at REAL NOT NULL,"
+            " finished_at REAL, last_error TEXT, resolution TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS work_queue_due ON work_queue (status, available_at)")
+
+    def enqueue(self, tickets: Iterable[dict], now: Optional[float] = None) -> int:
+        # adds the tickets in one transaction, returns how many were added
+        now = time.time() if now is None else now
+        rows = []
+        for ticket in tickets:
+            if not isinstance(ticket, dict):
+                raise ValueError("Only ticket objects (dicts) can be queued")
+            rows.append((json.dumps(ticket), PENDING, now, now))
+        with self._transaction():
+            self._connection.executemany(
+                "INSERT INTO work_queue (ticket, status, available_at, enqueued_at) VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def lease(self, count: int = 1, lease_seconds: float = DEFAULT_LEASE_SECONDS, now: Optional[float] = None) -> List[QueuedTicket]:
+        # hands out up to count due tickets, oldest first. A ticket whose lease ran out on its last attempt is dead-lettered.
+        now = time.time() if now is None else now
+        leased = []
+        with self._transaction():
+            rows = self._connection.execute(
+                "SELECT id, ticket, status, attempts FROM work_queue WHERE status IN (?, ?) AND available_at <= ? ORDER BY id LIMIT ?",
+                (PENDING, LEASED, now, count)).fetchall()
+            for job_id, ticket, status, attempts in rows:
+                if status == LEASED and attempts >= self.max_attempts:
+                    self._dead_letter(job_id, f"lease ran out on attempt {attempts}", now)
+                    continue
+                self._connection.execute("UPDATE work_queue SET status = ?, attempts = ?, available_at = ? WHERE id = ?",
+                                         (LEASED, attempts + 1, now + lease_seconds, job_id))
+                leased.append(QueuedTicket(job_id, json.loads(ticket), attempts + 1))
+        return leased
+
+    def complete(self, item: QueuedTicket, resolution: TicketResolution, now: Optional[float] = None) -> bool:
+        # stores the resolution and acknowledges the ticket. Returns False when the lease was lost (it ran out and another
+        # worker has the ticket now), the other worker's result is then the one that is kept.
+        now = time.time() if now is None else now
+        with self._transaction():
+            updated = self._connection.execute(
+                "UPDATE work_queue SET status = ?, resolution = ?, finished_at = ?, last_error = NULL"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (DONE, json.dumps(resolution_to_dict(resolution)), now, item.job_id, LEASED, item.attempt)).rowcount
+        return updated == 1
+
+    def fail(self, item: QueuedTicket, error: str, retry_delay: float, now: Optional[float] = None) -> Optional[str]:
+        # puts the ticket back to be tried after retry_delay seconds, or dead-letters it after its last attempt.
+        # Returns the new status, None when the lease was lost.
+        now = time.time() if now is None else now
+        with self._transaction():
+            row = self._connection.execute("SELECT status, attempts FROM work_queue WHERE id = ?", (item.job_id,)).fetchone()
+            if row is None or row != (LEASED, item.attempt):
+                return None
+            if item.attempt >= self.max_attempts:
+                self._dead_letter(item.job_id, error, now)
+                return DEAD
+            self._connection.execute("UPDATE work_queue SET status = ?, available_at = ?, last_error = ? WHERE id = ?",
+                                     (PENDING, now + retry_delay, error, item.job_id))
+            return PENDING
+
+    def _dead_letter(self, job_id: int, error: str, now: float) -> None:
+        self._connection.execute("UPDATE work_queue SET status = ?, last_error = ?, finished_at = ? WHERE id = ?",
+                                 (DEAD, error, now, job_id))
+        metrics.incr("queue_dead_letters")
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys((PENDING, LEASED, DONE, DEAD), 0)
+        counts.update(self._connection.execute("SELECT status, COUNT(*) FROM work_queue GROUP BY status"))
+        return counts
+
+    def unfinished(self) -> int:
+        # tickets that are waiting, being worked on or waiting for a retry
+        return self._connection.execute("SELECT COUNT(*) FROM work_queue WHERE status IN (?, ?)", (PENDING, LEASED)).fetchone()[0]
+
+    def next_due(self) -> Optional[float]:
+        # when the next unfinished ticket can be leased, None when there is none
+        return self._connection.execute("SELECT MIN(available_at) FROM work_queue WHERE status IN (?, ?)",
+                                        (PENDING, LEASED)).fetchone()[0]
+
+    def resolutions(self) -> Iterator[dict]:
+        # stored resolutions in queue order, as the resolution_to_dict dicts
+        for (resolution,) in self._connection.execute("SELECT resolution FROM work_queue WHERE status = ? ORDER BY id", (DONE,)):
+            yield json.loads(resolution)
+
+    def dead_letters(self) -> List[dict]:
+        rows = self._connection.execute(
+            "SELECT id, ticket, attempts, last_error FROM work_queue WHERE status = ? ORDER BY id", (DEAD,)).fetchall()
+        return [{"job_id": job_id, "ticket": json.loads(ticket), "attempts": attempts, "error": error}
+                for job_id, ticket, attempts, error in rows]
+
+    def retry_dead(self, job_ids: Optional[List[int]] = None, now: Optional[float] = None) -> int:
+        # puts dead letters (all of them, or the given ones) back in the queue with a fresh set of attempts
+        now = time.time() if now is None else now
+        with self._transaction():
+            if job_ids is None:
+                return self._connection.execute(
+                    "UPDATE work_queue SET status = ?, attempts = 0, available_at = ?, finished_at = NULL WHERE status = ?",
+                    (PENDING, now, DEAD)).rowcount
+            return sum(self._connection.execute(
+                "UPDATE work_queue SET status = ?, attempts = 0, available_at = ?, finished_at = NULL WHERE id = ? AND status = ?",
+                (PENDING, now, job_id, DEAD)).rowcount for job_id in job_ids)
+
+    def purge_done(self) -> int:
+        # drops the finished tickets once their resolutions have been exported
+        with self._transaction():
+            return self._connection.execute("DELETE FROM work_queue WHERE status = ?", (DONE,)).rowcount
+
+    def release(self, item: QueuedTicket, now: Optional[float] = None) -> bool:
+        # hands a leased ticket that was not tried back straight away, without using up an attempt
+        now = time.time() if now is None else now
+        with self._transaction():
+            return self._connection.execute(
+                "UPDATE work_queue SET status = ?, attempts = attempts - 1, available_at = ? WHERE id = ? AND status = ? AND attempts = ?",
+                (PENDING, now, item.job_id, LEASED, item.attempt)).rowcount == 1
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def transaction(self) -> "_Transaction":
+        # groups several calls into one commit (one disk sync), e.g. acknowledging a batch of tickets
+        return self._transaction()
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self._connection)
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two processes can not lease the same ticket. Inside an open
+    # transaction it does nothing, the outer one commits.
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self.outer = False
+
+    def __enter__(self):
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.outer = True
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.outer:
+            self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+class QueueWorker:
+    # Runs concurrency loops that each lease batch_size tickets, put them through the processor one after the other
+    # (with TicketProcessor(workers=N) the analysis is spread over N processes) and acknowledge the batch in one commit.
+    # A ticket that takes longer than ticket_timeout counts as failed. Without worker processes (TicketProcessor(workers=0))
+    # the analysis would run on this event loop, where a ticket that hangs it stops every loop and the timeout never
+    # fires, so then each ticket is processed in a thread, on an event loop of that thread. A thread whose ticket timed out is
+    # not stopped, it keeps one of the default executor's threads until the analysis returns.
+    # Tickets of a batch that could not finish before the lease runs out, or that are still waiting when stop() is
+    # called, are handed back without using up an attempt.
+    def __init__(self, processor: TicketProcessor, queue: WorkQueue, response_templates: dict[str, str], concurrency: int = 4,
+                 batch_size: int = 8, lease_seconds: float = DEFAULT_LEASE_SECONDS, ticket_timeout: Optional[float] = None,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX, poll_interval: float = 0.5):
+        if concurrency < 1 or batch_size < 1:
+            raise ValueError("concurrency and batch_size must be at least 1")
+        self.processor = processor
+        self.queue = queue
+        self.response_templates = response_templates
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.ticket_timeout = ticket_timeout if ticket_timeout is not None else lease_seconds / 2
+        if self.ticket_timeout >= lease_seconds:
+            raise ValueError("ticket_timeout must be shorter than lease_seconds")
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.stats = {"completed": 0, "retried": 0, "dead_lettered": 0, "lost_leases": 0}
+        self._stop = asyncio.Event()
+
+    def retry_delay(self, attempt: int) -> float:
+        # exponential backoff with jitter, so tickets that failed together do not all come back at once
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def stop(self) -> None:
+        # the workers finish the ticket they are on, hand the rest of their batch back and return from run()
+        self._stop.set()
+
+    async def run(self, until_empty: bool = False) -> dict:
+        # works until stop() is called, or with until_empty until no ticket is left to do (retries and leases included)
+        self._stop.clear()
+        await asyncio.gather(*(self._work(until_empty) for _ in range(self.concurrency)))
+        return dict(self.stats)
+
+    async def _work(self, until_empty: bool) -> None:
+        while not self._stop.is_set():
+            lease_ends = time.time() + self.lease_seconds
+            items = self.queue.lease(self.batch_size, self.lease_seconds)
+            if not items:
+                if until_empty and not self.queue.unfinished():
+                    return
+                # sleep until the next retry is due (or new tickets may have arrived), stop() wakes us up
+                next_due = self.queue.next_due()
+                wait = self.poll_interval if next_due is None else min(self.poll_interval, max(0.0, next_due - time.time()))
+                try:
+                    await asyncio.wait_for(self._stop.wait(), max(wait, 0.001))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            outcomes = []
+            for item in items:
+                if self._stop.is_set() or time.time() + self.ticket_timeout > lease_ends:
+                    outcomes.append((item, None, None))
+                    continue
+                try:
+                    resolution = await asyncio.wait_for(self._process(item.ticket), self.ticket_timeout)
+                    outcomes.append((item, resolution, None))
+                except Exception as e:
+                    error = f"timed out after {self.ticket_timeout}s" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+                    outcomes.append((item, None, error))
+            self._acknowledge(outcomes)
+
+    async def _process(self, ticket: dict) -> TicketResolution:
+        processing = self.processor.process_ticket(ticket, self.response_templates, raise_errors=True)
+        if self.processor.workers:
+            return await processing  # the analysis runs in a worker process, the event loop only waits for it
+        return await asyncio.to_thread(_run_in_thread, processing)
+
+    def _acknowledge(self, outcomes: List[tuple]) -> None:
+        # stores the batch's resolutions and retries in one commit
+        with self.queue.transaction():
+            for item, resolution, error in outcomes:
+                if resolution is not None:
+                    self.stats["completed" if self.queue.complete(item, resolution) else "lost_leases"] += 1
+                elif error is None:
+                    self.queue.release(item)
+                else:
+                    status = self.queue.fail(item, error, self.retry_delay(item.attempt))
+                    if status == DEAD:
+                        self.stats["dead_lettered"] += 1
+                        print(f"Ticket {item.ticket.get('id', item.job_id)} moved to the dead letters after {item.attempt} attempts: {error}",
+                              file=sys.stderr)
+                    elif status == PENDING:
+                        self.stats["retried"] += 1
+                        metrics.incr("queue_retries")
+                    else:
+                        self.stats["lost_leases"] += 1
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import time
+from benchmarks.run import percentile
+from benchmarks.synthetic import generate_tickets
+
+# Load test for the HTTP service (python main.py serve).
+#
+#   python main.py serve --port 8080 --workers 4 &
+#   python -m benchmarks.load_test --port 8080 --requests 5000 --concurrency 64
+#   python -m benchmarks.load_test --requests 2000            # no --port: starts the service in this process
+#
+# Every connection is kept alive and sends its requests one after the other, --tickets-per-request > 1 sends arrays.
+# Reports requests/sec, tickets/sec, latency percentiles and how many requests were turned away with 429.
+
+
+async def post(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str, body: bytes) -> int:
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def run_load(host: str, port: int, bodies: list, concurrency: int) -> dict:
+    next_body = iter(bodies)
+    latencies, statuses = [], {}
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for body in next_body:
+                start = time.perf_counter()
+                status = await post(reader, writer, host, "/tickets", body)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {"seconds": seconds, "latencies": latencies, "statuses": statuses}
+
+
+async def main_async(args) -> dict:
+    tickets = list(generate_tickets(args.requests * args.tickets_per_request, seed=args.seed, log_dump_rate=args.log_dump_rate))
+    per_request = args.tickets_per_request
+    bodies = [json.dumps(tickets[i] if per_request == 1 else tickets[i:i + per_request]).encode("utf-8")
+              for i in range(0, len(tickets), per_request)]
+
+    if args.port:
+        return await run_load(args.host, args.port, bodies, args.concurrency)
+
+    # no server given, run one here (client and server then share this process and its CPU)
+    from ai_agents.agent_orchestration import TicketProcessor
+    from ai_agents.http_service import TicketService
+    from tests.templates import RESPONSE_TEMPLATES
+
+    processor = TicketProcessor(workers=args.workers, response_templates=RESPONSE_TEMPLATES)
+    processor.warm_up()
+    service = TicketService(processor, RESPONSE_TEMPLATES, batch_window=args.batch_window_ms / 1000,
+                            max_batch_size=args.max_batch_size, max_queue=args.max_queue)
+    await service.start("127.0.0.1", 0)
+    try:
+        result = await run_load("127.0.0.1", service.port, bodies, args.concurrency)
+        result["batches"] = service.batcher.batches
+        return result
+    finally:
+        await service.close()
+        processor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the ticket HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="port of a running service, leave out to start one in this process")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32, help="connections sending requests at the same time")
+    parser.add_argument("--tickets-per-request", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-dump-rate", type=float, default=0.05)
+    # only used for the in process service
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-queue", type=int, default=1024)
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    latencies = result["latencies"]
+    requests = len(latencies)
+    print(f"requests       {requests} in {result['seconds']:.2f}s over {args.concurrency} connections")
+    print(f"requests/sec   {requests / result['seconds']:.1f}")
+    print(f"tickets/sec    {requests * args.tickets_per_request / result['seconds']:.1f}")
+    print(f"latency ms     p50 {percentile(latencies, 50) * 1000:.2f}  p95 {percentile(latencies, 95) * 1000:.2f}  "
+          f"p99 {percentile(latencies, 99) * 1000:.2f}  max {latencies[-1] * 1000:.2f}")
+    print("statuses       " + ", ".join(f"{status}: {count}" for status, count in sorted(result["statuses"].items())))
+    if "batches" in result:
+        print(f"micro batches  {result['batches']} (avg {requests * args.tickets_per_request / max(result['batches'], 1):.1f} tickets)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import gc
+import pickle
+import tracemalloc
+from ai_agents.agent_orchestration import TicketProcessor
+from benchmarks.synthetic import generate_tickets
+from data_classes import CompactResolution, ResolutionTable
+from tests.templates import *
+
+# Memory held by a set of resolutions in the three representations:
+#   list of TicketResolution, list of CompactResolution and one ResolutionTable
+#
+#   python -m benchmarks.memory --tickets 20000
+
+
+def traced_size(build) -> tuple:
+    # bytes still allocated after build() returns (the result is kept alive while measuring)
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per resolution for the result representations")
+    parser.add_argument("--tickets", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tickets = list(generate_tickets(args.tickets, seed=args.seed, log_dump_rate=0.0))
+    processor = TicketProcessor(response_templates=RESPONSE_TEMPLATES)
+    raw = pickle.dumps(asyncio.run(processor.process_batch(tickets, RESPONSE_TEMPLATES)))
+
+    # every representation is built from its own unpickled copy, so nothing is shared with the processor caches
+    results = {}
+    _, results["TicketResolution list"] = traced_size(lambda: pickle.loads(raw))
+    resolutions = pickle.loads(raw)
+    _, results["CompactResolution list"] = traced_size(lambda: [CompactResolution.from_resolution(r) for r in pickle.loads(raw)])
+    _, results["ResolutionTable"] = traced_size(lambda: ResolutionTable(pickle.loads(raw)))
+
+    baseline = results["TicketResolution list"]
+    print(f"{'representation':24s} {'total KiB':>10s} {'bytes/resolution':>17s} {'vs dataclasses':>15s}")
+    for name, size in results.items():
+        print(f"{name:24s} {size / 1024:10.1f} {size / len(resolutions):17.1f} {(size / baseline - 1) * 100:+14.1f}%")
+
+
+if __name__ == "__main__":
+    main()
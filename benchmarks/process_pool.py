@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import os
+import time
+from ai_agents import sentiment as sentiment_analysis
+from ai_agents.agent_orchestration import TicketProcessor
+from benchmarks.synthetic import generate_tickets
+from tests.templates import *
+
+# Throughput of TicketProcessor.process_batch with analysis on the event loop versus in a process pool.
+# Run from the project root:  python -m benchmarks.process_pool --tickets 20000 --workers 1 2 4 8
+
+
+def make_tickets(count: int, log_lines: int) -> list:
+    # no duplicates, so the sentiment cache can not hide the analysis cost
+    return list(generate_tickets(count, duplicate_rate=0.0, log_dump_rate=1.0, log_lines=log_lines))
+
+
+async def run(processor: TicketProcessor, tickets: list, batch_size: int) -> float:
+    # forked workers inherit the parent's sentiment cache, start every run from an empty one
+    sentiment_analysis.cache.clear()
+    processor.warm_up()
+    start = time.perf_counter()
+    for offset in range(0, len(tickets), batch_size):
+        await processor.process_batch(tickets[offset:offset + batch_size], RESPONSE_TEMPLATES)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process pool throughput benchmark")
+    parser.add_argument("--tickets", type=int, default=5000)
+    parser.add_argument("--log-lines", type=int, default=20, help="extra log lines per ticket to make analysis heavier")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    tickets = make_tickets(args.tickets, args.log_lines)
+    print(f"{args.tickets} tickets, {os.cpu_count()} CPU cores")
+
+    baseline = asyncio.run(run(TicketProcessor(), tickets, args.batch_size))
+    print(f"in process      : {args.tickets / baseline:10.0f} tickets/sec")
+
+    for workers in args.workers:
+        processor = TicketProcessor(workers=workers)
+        try:
+            elapsed = asyncio.run(run(processor, tickets, args.batch_size))
+        finally:
+            processor.close()
+        print(f"{workers:2d} worker(s)    : {args.tickets / elapsed:10.0f} tickets/sec  ({baseline / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from ai_agents import sentiment as sentiment_analysis
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.response_generation_agent import ResponseAgent
+from ai_agents.ticket_analysis_agent import TicketAnalysisAgent
+from benchmarks.synthetic import generate_tickets
+from tests.templates import *
+
+# Benchmark suite for the ticket pipeline.
+# Times TicketAnalysisAgent.analyze_ticket, ResponseAgent.generate_response, TicketProcessor.process_ticket and
+# TicketProcessor.process_batch over a synthetic corpus and reports tickets/sec, p50/p95/p99 latency and peak memory.
+#
+#   python -m benchmarks.run --tickets 5000 --output bench.json
+#   python -m benchmarks.run --tickets 5000 --compare bench.json      # compare against an earlier run
+#
+# Peak memory is measured with tracemalloc in a second pass over the same tickets, so it does not slow down the timings.
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+async def time_per_ticket(run_one, items: list) -> list:
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        await run_one(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def measure(run_one, items: list) -> dict:
+    sentiment_analysis.cache.clear()
+    latencies = await time_per_ticket(run_one, items)
+
+    sentiment_analysis.cache.clear()
+    tracemalloc.start()
+    await time_per_ticket(run_one, items)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        "tickets": len(items),
+        "seconds": round(total, 4),
+        "tickets_per_sec": round(len(items) / total, 1) if total else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4) if latencies else 0.0,
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+async def run_suite(tickets: list, batch_size: int) -> dict:
+    analysis_agent = TicketAnalysisAgent()
+    response_agent = ResponseAgent(RESPONSE_TEMPLATES)
+    processor = TicketProcessor(response_templates=RESPONSE_TEMPLATES)
+    processor.warm_up()
+
+    results = {}
+    results["analyze_ticket"] = await measure(
+        lambda ticket: analysis_agent.analyze_ticket(ticket["content"], ticket["customer_info"]), tickets)
+
+    analyses = [(await analysis_agent.analyze_ticket(ticket["content"], ticket["customer_info"]), processor.ticket_context(ticket))
+                for ticket in tickets]
+    results["generate_response"] = await measure(
+        lambda item: response_agent.generate_response(item[0], RESPONSE_TEMPLATES, item[1]), analyses)
+
+    results["process_ticket"] = await measure(lambda ticket: processor.process_ticket(ticket, RESPONSE_TEMPLATES), tickets)
+
+    # for batches the latency is per batch, throughput is still in tickets
+    batches = [tickets[start:start + batch_size] for start in range(0, len(tickets), batch_size)]
+    batch_result = await measure(lambda batch: processor.process_batch(batch, RESPONSE_TEMPLATES), batches)
+    batch_result["tickets"] = len(tickets)
+    batch_result["tickets_per_sec"] = round(len(tickets) / batch_result["seconds"], 1) if batch_result["seconds"] else 0.0
+    batch_result["batch_size"] = batch_size
+    results["process_batch"] = batch_result
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    # prints the change against the baseline run, returns False when a stage got slower than the threshold (percent)
+    ok = True
+    print(f"\nCompared with {baseline['meta'].get('commit', '?')} ({baseline['meta'].get('timestamp', '?')}):")
+    for stage, result in results.items():
+        before = baseline["results"].get(stage)
+        if not before:
+            continue
+        throughput = (result["tickets_per_sec"] / before["tickets_per_sec"] - 1) * 100 if before["tickets_per_sec"] else 0.0
+        p95 = (result["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        regressed = throughput < -threshold
+        ok = ok and not regressed
+        print(f"  {stage:18s} tickets/sec {throughput:+7.1f}%   p95 {p95:+7.1f}%{'   REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ticket pipeline benchmark suite")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.1)
+    parser.add_argument("--log-dump-rate", type=float, default=0.1)
+    parser.add_argument("--log-lines", type=int, default=200)
+    parser.add_argument("--max-sentences", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--fail-threshold", type=float, default=10.0, help="percent of throughput loss reported as a regression")
+    args = parser.parse_args()
+
+    tickets = list(generate_tickets(args.tickets, seed=args.seed, duplicate_rate=args.duplicate_rate, log_dump_rate=args.log_dump_rate,
+                                    log_lines=args.log_lines, max_sentences=args.max_sentences))
+    results = asyncio.run(run_suite(tickets, args.batch_size))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "fail_threshold")},
+        },
+        "results": results,
+    }
+
+    print(f"{'stage':18s} {'tickets/sec':>12s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'peak KiB':>10s}")
+    for stage, result in results.items():
+        print(f"{stage:18s} {result['tickets_per_sec']:12.1f} {result['p50_ms']:9.3f} {result['p95_ms']:9.3f} "
+              f"{result['p99_ms']:9.3f} {result['peak_memory_kb']:10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            if not compare(results, json.load(baseline), args.fail_threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import time
+from collections import defaultdict, deque
+from ai_agents import sentiment as sentiment_analysis
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.scheduler import PriorityScheduler, PRIORITY_ORDER
+from benchmarks.synthetic import generate_tickets
+from tests.templates import *
+
+# Latency per priority for a burst of tickets, processed in arrival order versus through the PriorityScheduler.
+# Every ticket arrives at once, latency is from the burst to the ticket's resolution.
+# Run from the project root:  python -m benchmarks.scheduler --tickets 2000 --concurrency 4
+
+
+async def fifo(processor: TicketProcessor, tickets: list, concurrency: int) -> dict:
+    queue = deque(tickets)
+    latencies = defaultdict(list)
+    start = time.perf_counter()
+
+    async def work():
+        while queue:
+            resolution = await processor.process_ticket(queue.popleft(), RESPONSE_TEMPLATES)
+            latencies[resolution.analysis.priority].append(time.perf_counter() - start)
+
+    await asyncio.gather(*(work() for _ in range(concurrency)))
+    return latencies
+
+
+async def scheduled(processor: TicketProcessor, tickets: list, concurrency: int) -> dict:
+    latencies = defaultdict(list)
+    async with PriorityScheduler(processor, RESPONSE_TEMPLATES, concurrency=concurrency) as scheduler:
+        start = time.perf_counter()
+
+        async def one(ticket):
+            resolution = await scheduler.process(ticket)
+            latencies[resolution.analysis.priority].append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one(ticket) for ticket in tickets))
+    return latencies
+
+
+def report(name: str, latencies: dict) -> None:
+    print(name)
+    for priority in PRIORITY_ORDER:
+        values = sorted(latencies.get(priority, []))
+        if values:
+            p50 = values[len(values) // 2] * 1000
+            p95 = values[min(len(values) - 1, int(0.95 * len(values)))] * 1000
+            print(f"  {priority.name:<7}{len(values):6d} tickets  p50 {p50:8.1f} ms  p95 {p95:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Priority scheduler latency benchmark")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    # no duplicates or log dumps, every ticket costs about the same
+    tickets = list(generate_tickets(args.tickets, duplicate_rate=0.0, log_dump_rate=0.0))
+    TicketProcessor().warm_up()
+    # a new processor and an empty sentiment cache per run, so the first run does not speed up the second
+    for name, run in (("arrival order", fifo), ("priority scheduler", scheduled)):
+        sentiment_analysis.cache.clear()
+        report(name, asyncio.run(run(TicketProcessor(), tickets, args.concurrency)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import sys
+import time
+from ai_agents.sentiment import get_analyzer
+from ai_agents.vector_sentiment import VectorSentiment
+from benchmarks.synthetic import generate_tickets
+
+# Checks the vectorized sentiment against nltk's VADER on the synthetic corpus and compares the cost per ticket.
+# Exits with 1 when a compound score is further than --tolerance from VADER's.
+#
+#   python -m benchmarks.sentiment --tickets 5000 --batch-size 500
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized sentiment against VADER: agreement and speed")
+    parser.add_argument("--tickets", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-dump-rate", type=float, default=0.05)
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="largest allowed compound difference")
+    args = parser.parse_args()
+
+    texts = [ticket["content"] for ticket in generate_tickets(args.tickets, seed=args.seed, log_dump_rate=args.log_dump_rate)]
+    analyzer = get_analyzer()
+    engine = VectorSentiment()
+
+    start = time.perf_counter()
+    expected = [analyzer.polarity_scores(text) for text in texts]
+    vader_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = []
+    for batch_start in range(0, len(texts), args.batch_size):
+        scores.extend(engine.polarity_scores_batch(texts[batch_start:batch_start + args.batch_size]))
+    vector_seconds = time.perf_counter() - start
+
+    differences = [abs(score["compound"] - vader["compound"]) for score, vader in zip(scores, expected)]
+    exact = sum(score == vader for score, vader in zip(scores, expected))
+    print(f"tickets            {len(texts)} (batches of {args.batch_size})")
+    print(f"VADER              {vader_seconds / len(texts) * 1e6:9.1f} us/ticket")
+    print(f"vectorized         {vector_seconds / len(texts) * 1e6:9.1f} us/ticket ({vader_seconds / vector_seconds:.1f}x faster)")
+    print(f"identical scores   {exact} of {len(texts)}")
+    print(f"max compound diff  {max(differences, default=0.0):.6f}")
+    if max(differences, default=0.0) > args.tolerance:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
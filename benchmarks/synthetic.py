@@ -0,0 +1,85 @@
+import random
+from typing import Dict, Iterator, Optional
+from tests.templates import *
+
+# Synthetic ticket corpus for benchmarks, built from the sample tickets in tests/templates.py.
+# Every ticket starts from a sample (or a generated opening line for categories without one), then gets filler
+# sentences for length, optionally a multi-line log dump, and with duplicate_rate probability it is an exact
+# re-send of an earlier ticket body under a new id (like monitoring alerts or a customer mailing twice).
+
+CATEGORY_SAMPLES = {
+    "access": [SAMPLE_TICKETS[0]],
+    "billing": [SAMPLE_TICKETS[1]],
+    "technical": EDGE_CASE_TICKETS,
+    "ambiguous": AMBIGUOUS_TICKETS,
+    "feature": [],
+}
+
+DEFAULT_CATEGORY_MIX = {"access": 0.3, "billing": 0.25, "technical": 0.3, "feature": 0.05, "ambiguous": 0.1}
+
+OPENING_LINES = {
+    "access": ["I can't login since the password reset.", "Getting a 403 on the admin dashboard.", "My permission to the reports was removed."],
+    "billing": ["The invoice amount looks wrong.", "We were charged twice this month, please check the billing.", "How does the pro-rating work for new seats?"],
+    "technical": ["The export job is stuck at 90%.", "The server returns a 500 error when saving.", "The app keeps crashing on startup."],
+    "feature": ["Could you add a dark mode feature?", "We would like a function to bulk edit users.", "Please add an export to CSV feature."],
+    "ambiguous": ["Nothing works.", "Please help.", "Something is off with my account today."],
+}
+
+FILLER_SENTENCES = [
+    "We noticed this after the latest update.",
+    "Our team has tried the usual steps already.",
+    "This is affecting several people in the office.",
+    "Let me know if you need more details from our side.",
+    "I have attached a screenshot to this email.",
+    "It worked fine last week.",
+    "Please treat this as urgent, we have a demo tomorrow.",
+    "Thanks for the quick help last time!",
+]
+
+ROLES = ["User", "Admin", "Billing Admin", "Finance Director", "CEO", "Engineer", "Support Agent", "VP Sales", "Manager"]
+
+
+def _log_dump(rng: random.Random, lines: int) -> str:
+    levels = ["INFO", "INFO", "INFO", "WARN", "ERROR"]
+    return "\n".join(
+        f"2024-03-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}Z "
+        f"{rng.choice(levels)} worker-{rng.randint(1, 16)} request_id={rng.getrandbits(48):x} "
+        f"{rng.choice(['processed job', 'retrying connection', 'cache miss', 'system call failed', 'timeout waiting for lock'])} "
+        f"in {rng.random() * 3:.3f}s"
+        for _ in range(lines)
+    )
+
+
+def generate_tickets(count: int, seed: int = 0, category_mix: Optional[Dict[str, float]] = None,
+                     min_sentences: int = 0, max_sentences: int = 12, duplicate_rate: float = 0.1,
+                     log_dump_rate: float = 0.1, log_lines: int = 200) -> Iterator[dict]:
+    # yields count ticket dicts in the same shape as tests/templates.py, the same seed always gives the same corpus
+    rng = random.Random(seed)
+    mix = category_mix or DEFAULT_CATEGORY_MIX
+    categories = list(mix)
+    weights = [mix[category] for category in categories]
+    previous_bodies = []
+
+    for i in range(count):
+        if previous_bodies and rng.random() < duplicate_rate:
+            content, customer_info, subject = rng.choice(previous_bodies)
+        else:
+            category = rng.choices(categories, weights)[0]
+            samples = CATEGORY_SAMPLES.get(category) or []
+            if samples and rng.random() < 0.5:
+                sample = rng.choice(samples)
+                subject = sample["subject"]
+                lines = [sample["content"].strip()]
+            else:
+                subject = f"{category.title()} question"
+                lines = [rng.choice(OPENING_LINES[category])]
+            lines += rng.choices(FILLER_SENTENCES, k=rng.randint(min_sentences, max_sentences))
+            if rng.random() < log_dump_rate:
+                lines.append("Here are the logs:\n" + _log_dump(rng, log_lines))
+            content = "\n".join(lines)
+            customer_info = {"role": rng.choice(ROLES), "name": f"Customer {rng.randint(1, 5000)}"}
+            previous_bodies.append((content, customer_info, subject))
+            if len(previous_bodies) > 1000:
+                previous_bodies.pop(rng.randrange(len(previous_bodies)))
+
+        yield {"id": f"TKT-SYN-{i}", "subject": subject, "content": content, "customer_info": dict(customer_info)}
@@ -1,6 +1,8 @@
+import sys
+from array import array
 from enum import Enum
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 class TicketCategory(Enum):
     TECHNICAL = "technical"
@@ -26,6 +28,87 @@ class TicketAnalysis:
     suggested_response_type: str
     follow_up_prediction: Optional[str] = None  # NEW FIELD
 
+
+class _LazyField:
+    # Reads the field from the instance __dict__ like a normal dataclass field once it has a value. Only the first read
+    # of a field that was left out comes here (a non data descriptor, like functools.cached_property), it is worked
+    # out then and stored, so later reads and assignments are plain attribute access.
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance._resolve(self.name)
+
+
+class LazyTicketAnalysis(TicketAnalysis):
+    # A TicketAnalysis whose expensive fields are worked out the first time they are read, see
+    # TicketAnalysisAgent.analyze_ticket(lazy=True). Code that reads every field gets the same values as from a
+    # TicketAnalysis: == compares with either class field by field, asdict and repr read (and so compute) every field
+    # and pickling / copying gives a plain TicketAnalysis, so the ticket text held for the missing fields is never sent on.
+    LAZY_FIELDS = ("key_points", "sentiment", "urgency_indicators", "follow_up_prediction")
+
+    key_points = _LazyField()
+    sentiment = _LazyField()
+    urgency_indicators = _LazyField()
+    follow_up_prediction = _LazyField()
+
+    def __init__(self, *args, **kwargs):
+        # same arguments as TicketAnalysis (so dataclasses.replace works), every field is known straight away
+        TicketAnalysis.__init__(self, *args, **kwargs)
+        self._pending = None
+
+    @classmethod
+    def deferred(cls, compute: Dict[str, Callable[["LazyTicketAnalysis"], Any]], **known) -> "LazyTicketAnalysis":
+        # known are the fields that are already worked out, compute has a function for each of the others
+        analysis = cls.__new__(cls)
+        analysis.__dict__.update(known)
+        analysis._pending = dict(compute)
+        return analysis
+
+    @property
+    def pending_fields(self) -> Tuple[str, ...]:
+        # the fields that have not been worked out yet
+        return tuple(self._pending or ())
+
+    def resolve(self) -> "LazyTicketAnalysis":
+        # works out every field that is still missing
+        for name in self.pending_fields:
+            getattr(self, name)
+        return self
+
+    def _resolve(self, name: str):
+        pending = self._pending
+        compute = pending.get(name) if pending else None
+        if compute is None:
+            # worked out by another thread meanwhile
+            return self.__dict__[name]
+        value = self.__dict__.setdefault(name, compute(self))
+        pending.pop(name, None)
+        if not pending:
+            self._pending = None  # drops the ticket text and keyword scan
+        return value
+
+    def __eq__(self, other):
+        if isinstance(other, TicketAnalysis):
+            return all(getattr(self, field.name) == getattr(other, field.name) for field in fields(TicketAnalysis))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return TicketAnalysis, tuple(getattr(self, field.name) for field in fields(TicketAnalysis))
+
+@dataclass
+class TicketTriage:
+    # the routing part of a TicketAnalysis, see TicketAnalysisAgent.triage_ticket
+    category: TicketCategory
+    priority: Priority
+    required_expertise: List[str]
+    business_impact: str
+    suggested_response_type: str
+
 @dataclass
 class ResponseSuggestion:
     response_text: str
@@ -37,4 +120,239 @@ class ResponseSuggestion:
 class TicketResolution:
     ticket_id: str
     analysis: TicketAnalysis
-    response: ResponseSuggestion
\ No newline at end of file
+    response: ResponseSuggestion
+    cluster_id: Optional[str] = None  # near duplicate cluster, see TicketProcessor(near_duplicates=...)
+    escalation: Optional[float] = None  # 0 to 1 from the customer's recent tickets, see TicketProcessor(customer_history=...)
+
+
+def resolution_to_dict(resolution: TicketResolution) -> dict:
+    # plain JSON friendly dict of a resolution, enums are written by name (e.g. "ACCESS", "URGENT")
+    analysis = asdict(resolution.analysis)
+    analysis["category"] = resolution.analysis.category.name
+    analysis["priority"] = resolution.analysis.priority.name
+    result = {
+        "ticket_id": resolution.ticket_id,
+        "analysis": analysis,
+        "response": asdict(resolution.response),
+    }
+    if resolution.cluster_id is not None:
+        result["cluster_id"] = resolution.cluster_id
+    if resolution.escalation is not None:
+        result["escalation"] = resolution.escalation
+    return result
+
+
+# Compact, read only versions of the result classes for holding many resolutions in memory (e.g. a day of tickets
+# for reporting). They are slotted and frozen, so there is no per instance __dict__, lists become tuples and the
+# strings that repeat for every ticket of a category (expertise, actions, impact, follow up) are interned and the
+# tuples shared, so thousands of resolutions point at the same few objects. Attribute access is the same as on the
+# normal classes, to_resolution() gives the normal (mutable) TicketResolution back.
+
+_shared_values = {}
+_SHARED_VALUES_LIMIT = 4096  # only a handful of distinct values are expected, stop sharing if that is not the case
+
+
+def _shared(value):
+    # interned string / tuple of interned strings, the same object for every equal value
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, (list, tuple)):
+        value = tuple(sys.intern(item) if isinstance(item, str) else item for item in value)
+        shared = _shared_values.get(value)
+        if shared is None:
+            if len(_shared_values) >= _SHARED_VALUES_LIMIT:
+                return value
+            shared = _shared_values[value] = value
+        return shared
+    return value
+
+
+@dataclass(frozen=True, slots=True)
+class CompactAnalysis:
+    category: TicketCategory
+    priority: Priority
+    key_points: Tuple[str, ...]
+    required_expertise: Tuple[str, ...]
+    sentiment: float
+    urgency_indicators: Any
+    business_impact: str
+    suggested_response_type: str
+    follow_up_prediction: Optional[str] = None
+
+    @classmethod
+    def from_analysis(cls, analysis: TicketAnalysis) -> "CompactAnalysis":
+        return cls(
+            category=analysis.category,
+            priority=analysis.priority,
+            key_points=tuple(analysis.key_points),
+            required_expertise=_shared(analysis.required_expertise),
+            sentiment=analysis.sentiment,
+            urgency_indicators=_shared(analysis.urgency_indicators),
+            business_impact=_shared(analysis.business_impact),
+            suggested_response_type=_shared(analysis.suggested_response_type),
+            follow_up_prediction=_shared(analysis.follow_up_prediction),
+        )
+
+    def to_analysis(self) -> TicketAnalysis:
+        urgency_indicators = list(self.urgency_indicators) if isinstance(self.urgency_indicators, tuple) else self.urgency_indicators
+        return TicketAnalysis(self.category, self.priority, list(self.key_points), list(self.required_expertise), self.sentiment,
+                              urgency_indicators, self.business_impact, self.suggested_response_type, self.follow_up_prediction)
+
+
+@dataclass(frozen=True, slots=True)
+class CompactResponse:
+    response_text: str
+    confidence_score: float
+    requires_approval: bool
+    suggested_actions: Tuple[str, ...]
+
+    @classmethod
+    def from_response(cls, response: ResponseSuggestion) -> "CompactResponse":
+        return cls(response.response_text, response.confidence_score, response.requires_approval, _shared(response.suggested_actions))
+
+    def to_response(self) -> ResponseSuggestion:
+        return ResponseSuggestion(self.response_text, self.confidence_score, self.requires_approval, list(self.suggested_actions))
+
+
+@dataclass(frozen=True, slots=True)
+class CompactResolution:
+    ticket_id: str
+    analysis: CompactAnalysis
+    response: CompactResponse
+    cluster_id: Optional[str] = None
+    escalation: Optional[float] = None
+
+    @classmethod
+    def from_resolution(cls, resolution: TicketResolution) -> "CompactResolution":
+        if isinstance(resolution, CompactResolution):
+            return resolution
+        return cls(resolution.ticket_id, CompactAnalysis.from_analysis(resolution.analysis), CompactResponse.from_response(resolution.response),
+                   resolution.cluster_id, resolution.escalation)
+
+    def to_resolution(self) -> TicketResolution:
+        return TicketResolution(self.ticket_id, self.analysis.to_analysis(), self.response.to_response(), self.cluster_id,
+                                self.escalation)
+
+
+class _ValuePool:
+    # dictionary encoding for a column with few distinct values: the values once, one small int per row
+    __slots__ = ("values", "index")
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value) -> int:
+        value = _shared(value)
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ResolutionTable:
+    # Column store for many resolutions. Category and priority are kept as one byte per row, sentiment and
+    # confidence as C doubles, the per category strings and tuples once in a value pool with an int code per row,
+    # and the key points of all rows in one flat list with an offsets array. Ticket ids, cluster ids and response texts
+    # are (nearly) unique per row, so they are plain lists. Rows are built on access:
+    #
+    #   table = ResolutionTable(resolutions)
+    #   table[0].analysis.category, len(table), table.category_counts()
+
+    CATEGORIES = list(TicketCategory)
+
+    # columns with only a few distinct values across all tickets
+    POOLED_COLUMNS = ("required_expertise", "urgency_indicators", "business_impact", "suggested_response_type",
+                      "follow_up_prediction", "suggested_actions", "escalation")
+
+    def __init__(self, resolutions: Iterable[TicketResolution] = ()):
+        self.ticket_ids: List[str] = []
+        self.categories = array("b")
+        self.priorities = array("b")
+        self.sentiments = array("d")
+        self.confidence_scores = array("d")
+        self.requires_approval = array("b")
+        self.key_points: List[str] = []
+        self.key_point_offsets = array("q", [0])  # key points of row i are key_points[offsets[i]:offsets[i + 1]]
+        self.response_texts: List[str] = []
+        self.cluster_ids: List[Optional[str]] = []
+        self._category_codes = {category: code for code, category in enumerate(self.CATEGORIES)}
+        self._pools = {name: _ValuePool() for name in self.POOLED_COLUMNS}
+        self._codes = {name: array("i") for name in self.POOLED_COLUMNS}
+        self.extend(resolutions)
+
+    def append(self, resolution: TicketResolution) -> None:
+        analysis, response = resolution.analysis, resolution.response
+        self.ticket_ids.append(resolution.ticket_id)
+        self.categories.append(self._category_codes[analysis.category])
+        self.priorities.append(analysis.priority.value)
+        self.sentiments.append(analysis.sentiment)
+        self.confidence_scores.append(response.confidence_score)
+        self.requires_approval.append(bool(response.requires_approval))
+        self.key_points.extend(analysis.key_points)
+        self.key_point_offsets.append(len(self.key_points))
+        self.response_texts.append(response.response_text)
+        self.cluster_ids.append(resolution.cluster_id)
+        for name in self.POOLED_COLUMNS:
+            source = resolution if name == "escalation" else response if name == "suggested_actions" else analysis
+            self._codes[name].append(self._pools[name].code(getattr(source, name)))
+
+    def extend(self, resolutions: Iterable[TicketResolution]) -> None:
+        for resolution in resolutions:
+            self.append(resolution)
+
+    def __len__(self) -> int:
+        return len(self.ticket_ids)
+
+    def column(self, name: str) -> list:
+        # the decoded values of one pooled column, e.g. table.column("business_impact")
+        values = self._pools[name].values
+        return [values[code] for code in self._codes[name]]
+
+    def codes(self, name: str) -> Tuple[array, list]:
+        # one pooled column still encoded: the code per row and the distinct values the codes point into
+        return self._codes[name], self._pools[name].values
+
+    def category(self, row: int) -> TicketCategory:
+        return self.CATEGORIES[self.categories[row]]
+
+    def priority(self, row: int) -> Priority:
+        return Priority(self.priorities[row])
+
+    def category_counts(self) -> dict:
+        counts = [0] * len(self.CATEGORIES)
+        for code in self.categories:
+            counts[code] += 1
+        return {category: counts[code] for code, category in enumerate(self.CATEGORIES)}
+
+    def priority_counts(self) -> dict:
+        counts = dict.fromkeys(Priority, 0)
+        for value in self.priorities:
+            counts[Priority(value)] += 1
+        return counts
+
+    def __getitem__(self, row: int) -> CompactResolution:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("ResolutionTable index out of range")
+        pooled = {name: self._pools[name].values[self._codes[name][row]] for name in self.POOLED_COLUMNS}
+        analysis = CompactAnalysis(
+            category=self.category(row),
+            priority=self.priority(row),
+            key_points=tuple(self.key_points[self.key_point_offsets[row]:self.key_point_offsets[row + 1]]),
+            required_expertise=pooled["required_expertise"],
+            sentiment=self.sentiments[row],
+            urgency_indicators=pooled["urgency_indicators"],
+            business_impact=pooled["business_impact"],
+            suggested_response_type=pooled["suggested_response_type"],
+            follow_up_prediction=pooled["follow_up_prediction"],
+        )
+        response = CompactResponse(self.response_texts[row], self.confidence_scores[row], bool(self.requires_approval[row]),
+                                   pooled["suggested_actions"])
+        return CompactResolution(self.ticket_ids[row], analysis, response, self.cluster_ids[row], pooled["escalation"])
+
+    def __iter__(self) -> Iterator[CompactResolution]:
+        for row in range(len(self)):
+            yield self[row]
@@ -1,8 +1,21 @@
 import unittest
 from data_classes import *
 from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.pipeline import read_tickets, run_pipeline
+from ai_agents.customer_history import CustomerHistory
+from ai_agents.export import open_writer
+from ai_agents.http_service import TicketService
+from ai_agents.large_tickets import LargeTicketLimits
+from ai_agents.near_duplicates import NearDuplicateIndex
+from ai_agents.ticket_store import TicketStore
+from ai_agents.metrics import metrics
+from ai_agents.work_queue import QueueWorker, WorkQueue
 from tests.templates import *
+import argparse
 import asyncio
+import json
+import sys
+import time
 
 def interactive_cli():
     ## creating an iterative ui where user can enter info like query , their job position , etc. and a sample ticket analysis 
@@ -11,7 +24,7 @@ def interactive_cli():
     # take in customer details one by one
     print("Welcome to the Ticket Processing CLI.")
     print("Enter 'exit' at any prompt to quit.")
-    ticket_processor = TicketProcessor()
+    ticket_processor = TicketProcessor(response_templates=RESPONSE_TEMPLATES)
     ticket_counter = 1
     while True:
         role = input("Enter customer role: ").strip()
@@ -78,8 +91,226 @@ def interactive_cli():
 
     print("Exiting CLI. Goodbye!")
 
+def pipeline_cli(args):
+    ## non interactive mode: read tickets as JSON lines from a file or stdin and write resolutions as JSON lines
+    parser = argparse.ArgumentParser(prog="main.py pipeline", description="Process a JSONL ticket export into JSONL resolutions.")
+    parser.add_argument("--input", "-i", default="-", help="JSONL file with one ticket per line, '-' for stdin (default)")
+    parser.add_argument("--output", "-o", default="-", help="file to write resolutions to, '-' for stdout (default)")
+    parser.add_argument("--batch-size", type=int, default=100, help="tickets processed together (default 100)")
+    parser.add_argument("--max-pending-batches", type=int, default=2, help="batches read ahead of the processor (default 2)")
+    parser.add_argument("--workers", type=int, default=0, help="analysis worker processes, 0 analyses in this process (default)")
+    parser.add_argument("--rules", help="JSON or YAML rules file replacing the built in keyword tables")
+    parser.add_argument("--watch-rules", type=float, metavar="SECONDS", help="reload the rules file when it changes, checked every SECONDS")
+    parser.add_argument("--vectorized-sentiment", action="store_true", help="score the sentiment of each batch at once with NumPy")
+    parser.add_argument("--large-ticket-chars", type=int, metavar="CHARS",
+                        help="analyse tickets longer than CHARS characters in bounded memory (capped key points and sentiment window)")
+    parser.add_argument("--near-duplicates", type=float, nargs="?", const=0.7, metavar="SIMILARITY",
+                        help="give near duplicate tickets (estimated similarity, default 0.7) the same cluster_id")
+    parser.add_argument("--reuse-near-duplicates", type=float, metavar="SIMILARITY",
+                        help="reuse the analysis of a near duplicate at least this similar, from a customer with the same role")
+    parser.add_argument("--export", metavar="PATH", help="also write the resolutions to a .csv, .parquet or .arrow file for analytics")
+    parser.add_argument("--export-chunk-rows", type=int, default=10000, help="rows buffered before an export chunk is written (default 10000)")
+    parser.add_argument("--store", metavar="DB", help="also keep every resolution in a SQLite ticket store for queries (main.py store)")
+    parser.add_argument("--customer-history", action="store_true",
+                        help="raise the priority of customers with several recent (or unhappy) tickets")
+    options = parser.parse_args(args)
+    if options.watch_rules and not options.rules:
+        parser.error("--watch-rules needs --rules")
+    try:
+        large_tickets = LargeTicketLimits(threshold=options.large_ticket_chars) if options.large_ticket_chars is not None else None
+    except ValueError as e:
+        parser.error(f"--large-ticket-chars: {e}")
+    near_duplicates = None
+    if options.near_duplicates is not None or options.reuse_near_duplicates is not None:
+        threshold = options.near_duplicates if options.near_duplicates is not None else min(0.7, options.reuse_near_duplicates)
+        try:
+            near_duplicates = NearDuplicateIndex(threshold=threshold, reuse_threshold=options.reuse_near_duplicates)
+        except ValueError as e:
+            parser.error(str(e))
+
+    export = None
+    if options.export:
+        try:
+            export = open_writer(options.export, chunk_rows=options.export_chunk_rows)
+        except (ValueError, ImportError) as e:
+            parser.error(f"--export: {e}")
+
+    input_stream = sys.stdin if options.input == "-" else open(options.input, encoding="utf-8")
+    output_stream = sys.stdout if options.output == "-" else open(options.output, "w", encoding="utf-8")
+    store = TicketStore(options.store) if options.store else None
+    processor = TicketProcessor(workers=options.workers, response_templates=RESPONSE_TEMPLATES, rules_path=options.rules,
+                                rules_reload_interval=options.watch_rules, vectorized_sentiment=options.vectorized_sentiment,
+                                large_tickets=large_tickets, near_duplicates=near_duplicates, store=store,
+                                customer_history=CustomerHistory() if options.customer_history else None)
+    try:
+        stats = asyncio.run(run_pipeline(processor, input_stream, output_stream, RESPONSE_TEMPLATES,
+                                         batch_size=options.batch_size, max_pending_batches=options.max_pending_batches,
+                                         export=export))
+    finally:
+        processor.close()
+        if export is not None:
+            export.close()
+        if store is not None:
+            store.close()
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+    print(f"Processed {stats['tickets']} tickets, skipped {stats['skipped_lines']} bad lines.", file=sys.stderr)
+
+
+def serve_cli(args):
+    ## HTTP service mode: POST tickets to /tickets, GET /health and /metrics
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Serve the ticket processor over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default 8080)")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0, help="how long tickets wait for others to join their batch (default 5)")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="most tickets analysed in one batch (default 64)")
+    parser.add_argument("--max-queue", type=int, default=1024, help="tickets waiting before requests get 429 (default 1024)")
+    parser.add_argument("--workers", type=int, default=0, help="analysis worker processes, 0 analyses in this process (default)")
+    parser.add_argument("--rules", help="JSON or YAML rules file replacing the built in keyword tables")
+    parser.add_argument("--watch-rules", type=float, metavar="SECONDS", help="reload the rules file when it changes, checked every SECONDS")
+    parser.add_argument("--store", metavar="DB", help="keep every resolution in a SQLite ticket store for queries (main.py store)")
+    parser.add_argument("--customer-history", action="store_true",
+                        help="raise the priority of customers with several recent (or unhappy) tickets")
+    options = parser.parse_args(args)
+    if options.watch_rules and not options.rules:
+        parser.error("--watch-rules needs --rules")
+
+    metrics.enable()  # there is a /metrics endpoint, so record them
+    store = TicketStore(options.store) if options.store else None
+    processor = TicketProcessor(workers=options.workers, response_templates=RESPONSE_TEMPLATES, rules_path=options.rules,
+                                rules_reload_interval=options.watch_rules, store=store,
+                                customer_history=CustomerHistory() if options.customer_history else None)
+    processor.warm_up()
+    service = TicketService(processor, RESPONSE_TEMPLATES, batch_window=options.batch_window_ms / 1000,
+                            max_batch_size=options.max_batch_size, max_queue=options.max_queue)
+    print(f"Serving on http://{options.host}:{options.port} (POST /tickets, GET /health, GET /metrics)", file=sys.stderr)
+    try:
+        asyncio.run(service.serve_forever(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        processor.close()
+        if store is not None:
+            store.close()
+
+
+def queue_cli(args):
+    ## worker queue mode: tickets go into a durable SQLite queue first, workers resolve them with retries and dead letters
+    parser = argparse.ArgumentParser(prog="main.py queue", description="Durable ticket queue with at-least-once workers.")
+    parser.add_argument("--db", default="ticket_queue.db", help="SQLite queue file (default ticket_queue.db)")
+    parser.add_argument("--max-attempts", type=int, default=5, help="tries before a ticket is dead-lettered (default 5)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="add tickets from a JSONL file or stdin")
+    enqueue.add_argument("--input", "-i", default="-", help="JSONL file with one ticket per line, '-' for stdin (default)")
+    work = commands.add_parser("work", help="resolve queued tickets")
+    work.add_argument("--concurrency", type=int, default=8, help="tickets worked on at the same time (default 8)")
+    work.add_argument("--batch-size", type=int, default=8, help="tickets leased and acknowledged together (default 8)")
+    work.add_argument("--workers", type=int, default=0, help="analysis worker processes, 0 analyses in this process, one thread "
+                                                              "per ticket so a stuck ticket still times out (default)")
+    work.add_argument("--lease-seconds", type=float, default=60.0, help="time before an unacknowledged ticket is handed out again (default 60)")
+    work.add_argument("--backoff", type=float, default=1.0, help="seconds before the first retry, doubled for every further try (default 1)")
+    work.add_argument("--until-empty", action="store_true", help="stop when every ticket is done or dead instead of waiting for more")
+    work.add_argument("--rules", help="JSON or YAML rules file replacing the built in keyword tables")
+    export = commands.add_parser("export", help="write the stored resolutions as JSONL")
+    export.add_argument("--output", "-o", default="-", help="file to write resolutions to, '-' for stdout (default)")
+    export.add_argument("--purge", action="store_true", help="remove the exported tickets from the queue")
+    commands.add_parser("dead", help="list dead-lettered tickets as JSONL")
+    commands.add_parser("retry-dead", help="put every dead-lettered ticket back in the queue")
+    commands.add_parser("status", help="count tickets per status")
+    options = parser.parse_args(args)
+
+    queue = WorkQueue(options.db, max_attempts=options.max_attempts)
+    try:
+        if options.command == "enqueue":
+            input_stream = sys.stdin if options.input == "-" else open(options.input, encoding="utf-8")
+            stats = {"skipped_lines": 0}
+            try:
+                added = queue.enqueue(read_tickets(input_stream, stats))
+            finally:
+                if input_stream is not sys.stdin:
+                    input_stream.close()
+            print(f"Queued {added} tickets, skipped {stats['skipped_lines']} bad lines.", file=sys.stderr)
+        elif options.command == "work":
+            processor = TicketProcessor(workers=options.workers, response_templates=RESPONSE_TEMPLATES, rules_path=options.rules)
+            processor.warm_up()
+            worker = QueueWorker(processor, queue, RESPONSE_TEMPLATES, concurrency=options.concurrency, batch_size=options.batch_size,
+                                 lease_seconds=options.lease_seconds, backoff_base=options.backoff)
+            try:
+                stats = asyncio.run(worker.run(until_empty=options.until_empty))
+            except KeyboardInterrupt:
+                stats = worker.stats  # unacknowledged tickets are handed out again once their lease runs out
+            finally:
+                processor.close()
+            print(f"Completed {stats['completed']}, retried {stats['retried']}, dead-lettered {stats['dead_lettered']}.", file=sys.stderr)
+        elif options.command == "export":
+            output_stream = sys.stdout if options.output == "-" else open(options.output, "w", encoding="utf-8")
+            try:
+                for resolution in queue.resolutions():
+                    output_stream.write(json.dumps(resolution) + "\n")
+            finally:
+                if output_stream is not sys.stdout:
+                    output_stream.close()
+            if options.purge:
+                queue.purge_done()
+        elif options.command == "dead":
+            for letter in queue.dead_letters():
+                print(json.dumps(letter))
+        elif options.command == "retry-dead":
+            print(f"Put {queue.retry_dead()} dead-lettered tickets back in the queue.", file=sys.stderr)
+        else:
+            print(json.dumps(queue.counts()))
+    finally:
+        queue.close()
+
+
+def store_cli(args):
+    ## query the ticket store written by pipeline / serve --store, matching tickets are printed as JSONL, newest first
+    parser = argparse.ArgumentParser(prog="main.py store", description="Query stored ticket resolutions.")
+    parser.add_argument("--db", default="tickets.db", help="SQLite ticket store (default tickets.db)")
+    parser.add_argument("--category", type=str.upper, choices=[category.name for category in TicketCategory])
+    parser.add_argument("--priority", type=str.upper, choices=[priority.name for priority in Priority])
+    parser.add_argument("--min-priority", type=str.upper, choices=[priority.name for priority in Priority])
+    parser.add_argument("--customer", help="customer name")
+    parser.add_argument("--role", help="customer role")
+    parser.add_argument("--since-minutes", type=float, metavar="MINUTES", help="only tickets stored in the last MINUTES")
+    parser.add_argument("--limit", type=int, default=100, help="most tickets printed (default 100)")
+    parser.add_argument("--count", action="store_true", help="print the number of matching tickets instead")
+    options = parser.parse_args(args)
+
+    store = TicketStore(options.db)
+    try:
+        query = store.find(category=TicketCategory[options.category] if options.category else None,
+                           priority=Priority[options.priority] if options.priority else None,
+                           min_priority=Priority[options.min_priority] if options.min_priority else None,
+                           customer_name=options.customer, customer_role=options.role,
+                           since=time.time() - options.since_minutes * 60 if options.since_minutes is not None else None)
+        if options.count:
+            print(query.count())
+        else:
+            for stored in query.first(options.limit):
+                print(json.dumps({"stored_at": stored.created_at, "customer_name": stored.customer_name,
+                                  "customer_role": stored.customer_role, **stored.resolution}))
+    finally:
+        store.close()
+
+
 ## run main class to run everything
 if __name__ == "__main__":
+
+    if sys.argv[1:2] == ["pipeline"]:
+        pipeline_cli(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["serve"]:
+        serve_cli(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["queue"]:
+        queue_cli(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["store"]:
+        store_cli(sys.argv[2:])
+        sys.exit(0)
     
     print("\nRunning Unit Tests...\n")
     
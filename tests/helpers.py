@@ -0,0 +1,48 @@
+import asyncio
+from ai_agents.agent_orchestration import TicketProcessor
+
+
+## helpers shared by the test modules
+
+
+class FakeClock:
+    # a clock for the `clock=` options, it only moves when a test sets or advances now
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingProcessor(TicketProcessor):
+    # remembers the order tickets are processed in and the batch sizes, and can hold batches back until release is set.
+    # With a clock, the clock moves on by `step` seconds per ticket.
+    def __init__(self, clock: FakeClock = None, step: float = 0.0, **options):
+        super().__init__(**options)
+        self.order = []
+        self.batch_sizes = []
+        self.clock = clock
+        self.step = step
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def process_ticket(self, ticket, response_templates, raise_errors=False):
+        self.order.append(ticket["id"])
+        if self.clock is not None:
+            self.clock.now += self.step
+        await asyncio.sleep(0)
+        return await super().process_ticket(ticket, response_templates, raise_errors)
+
+    async def process_triaged(self, triaged, ticket, response_templates):
+        if self.workers:  # goes on to process_ticket
+            return await super().process_triaged(triaged, ticket, response_templates)
+        self.order.append(ticket["id"])
+        if self.clock is not None:
+            self.clock.now += self.step
+        await asyncio.sleep(0)
+        return await super().process_triaged(triaged, ticket, response_templates)
+
+    async def process_batch(self, tickets, response_templates):
+        self.batch_sizes.append(len(tickets))
+        await self.release.wait()
+        return await super().process_batch(tickets, response_templates)
@@ -0,0 +1,86 @@
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.customer_history import CustomerHistory, customer_key, escalate_priority
+from data_classes import *
+from tests.templates import *
+from tests.helpers import FakeClock
+
+
+## tests for the per customer history and the escalation it feeds into priority and confidence
+
+def feature_request(number: int, customer_info: dict) -> dict:
+    return {"id": f"TKT-{number}", "content": "Could you add a dark mode feature? Thanks!", "customer_info": customer_info}
+
+
+class TestCustomerHistory(unittest.IsolatedAsyncioTestCase):
+    def test_sliding_window_counts(self):
+        clock = FakeClock(36000.0)
+        history = CustomerHistory(window=3600, buckets=12, clock=clock)
+        escalations = []
+        for _ in range(5):
+            escalations.append(history.record({"name": "Sam"}, 0.8).escalation)
+            clock.now += 60
+        self.assertEqual(escalations, [0.0, 0.25, 0.5, 0.75, 1.0])
+
+        # tickets leave the window a bucket (300 seconds) at a time, a long break empties it
+        clock.now = 36000.0 + 3299
+        self.assertEqual(history.record({"name": "Sam"}, 0.8).recent_tickets, 6)
+        clock.now = 36000.0 + 3600  # the bucket of the first five tickets is out
+        self.assertEqual(history.record({"name": "Sam"}, 0.8).recent_tickets, 2)
+        clock.now += 4 * 3600
+        self.assertEqual(history.record({"name": "sam "}, 0.8).recent_tickets, 1)
+        self.assertIsNone(history.record({"role": "Admin"}, 0.8))
+        self.assertIsNone(history.record(None, 0.8))
+        self.assertEqual(customer_key({"id": 7, "name": "Sam"}), "id:7")
+
+    def test_unhappy_customers_and_eviction(self):
+        clock = FakeClock(36000.0)
+        history = CustomerHistory(max_customers=2, clock=clock)
+        # one unhappy ticket is not a pattern yet, the second one is
+        self.assertEqual(history.record({"email": "kim@example.com"}, 0.1).escalation, 0.0)
+        snapshot = history.record({"email": "kim@example.com"}, 0.1)
+        self.assertAlmostEqual(snapshot.average_sentiment, 0.1)
+        self.assertEqual(snapshot.escalation, round(0.25 + 0.5 * (0.35 - 0.1) / 0.35, 2))
+
+        # older tickets count for less: a day later the happy ticket weighs twice as much as the old ones together
+        clock.now += 86400
+        self.assertAlmostEqual(history.record({"email": "kim@example.com"}, 0.9).average_sentiment, (0.1 + 0.9 * 1) / 2)
+
+        history.record({"name": "A"}, 0.5)
+        history.record({"email": "kim@example.com"}, 0.5)
+        history.record({"name": "B"}, 0.5)  # A is the least recently seen
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.stats()["evictions"], 1)
+        self.assertEqual(history.record({"name": "A"}, 0.5).recent_tickets, 1)
+
+        self.assertEqual(escalate_priority(Priority.LOW, 0.49), Priority.LOW)
+        self.assertEqual(escalate_priority(Priority.LOW, 0.5), Priority.MEDIUM)
+        self.assertEqual(escalate_priority(Priority.HIGH, 1.0), Priority.URGENT)
+        with self.assertRaises(ValueError):
+            CustomerHistory(escalate_after=1)
+
+    async def test_processor_escalates_repeat_customers(self):
+        customer = {"name": "Sam Lee", "role": "User"}
+        plain = await TicketProcessor().process_ticket(feature_request(0, customer), RESPONSE_TEMPLATES)
+        self.assertEqual(plain.analysis.priority, Priority.LOW)
+        self.assertIsNone(plain.escalation)
+        self.assertNotIn("escalation", resolution_to_dict(plain))
+
+        processor = TicketProcessor(customer_history=CustomerHistory(clock=FakeClock(36000.0)))
+        resolutions = [await processor.process_ticket(feature_request(number, customer), RESPONSE_TEMPLATES) for number in range(3)]
+        resolutions += await processor.process_batch([feature_request(number, customer) for number in range(3, 5)], RESPONSE_TEMPLATES)
+        self.assertEqual([resolution.escalation for resolution in resolutions], [0.0, 0.25, 0.5, 0.75, 1.0])
+        self.assertEqual([resolution.analysis.priority for resolution in resolutions],
+                         [Priority.LOW, Priority.LOW, Priority.MEDIUM, Priority.MEDIUM, Priority.HIGH])
+        self.assertEqual((resolutions[0].analysis, resolutions[0].response), (plain.analysis, plain.response))
+        confidences = [resolution.response.confidence_score for resolution in resolutions]
+        self.assertEqual(confidences, sorted(confidences, reverse=True))
+        self.assertAlmostEqual(confidences[-1], plain.response.confidence_score * 0.75)
+        self.assertEqual(resolution_to_dict(resolutions[-1])["escalation"], 1.0)
+
+        # a customer that can not be told apart has no history
+        anonymous = await processor.process_ticket(feature_request(9, {"role": "User"}), RESPONSE_TEMPLATES)
+        self.assertIsNone(anonymous.escalation)
+
+        self.assertEqual(CompactResolution.from_resolution(resolutions[-1]).to_resolution(), resolutions[-1])
+        self.assertEqual(ResolutionTable(resolutions)[2].escalation, 0.5)
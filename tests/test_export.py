@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.export import ArrowResolutionWriter, CsvResolutionWriter, open_writer
+from ai_agents.near_duplicates import NearDuplicateIndex
+from ai_agents.pipeline import run_pipeline
+from data_classes import *
+from tests.templates import *
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+## tests for the columnar export of resolutions
+
+TICKETS = SAMPLE_TICKETS + EDGE_CASE_TICKETS + AMBIGUOUS_TICKETS
+
+
+def expected_rows(resolutions: List[TicketResolution]) -> List[dict]:
+    return [{
+        "ticket_id": resolution.ticket_id,
+        "category": resolution.analysis.category.value,
+        "priority": resolution.analysis.priority.name,
+        "sentiment": resolution.analysis.sentiment,
+        "confidence_score": resolution.response.confidence_score,
+        "requires_approval": resolution.response.requires_approval,
+        "business_impact": resolution.analysis.business_impact,
+        "suggested_response_type": resolution.analysis.suggested_response_type,
+        "cluster_id": resolution.cluster_id,
+        "key_points": list(resolution.analysis.key_points),
+    } for resolution in resolutions]
+
+
+class TestExport(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        processor = TicketProcessor(near_duplicates=NearDuplicateIndex())
+        self.resolutions = await processor.process_batch(TICKETS, RESPONSE_TEMPLATES)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_csv_chunks(self):
+        stream = io.StringIO()
+        writer = CsvResolutionWriter(stream, chunk_rows=2)
+        writer.write_many(self.resolutions[:3])
+        # a full chunk is written straight away, the third row waits for the next chunk
+        self.assertEqual((writer.rows_written, writer.chunks_written), (2, 1))
+        self.assertEqual(len(stream.getvalue().splitlines()), 3)
+        writer.write_many(self.resolutions[3:])
+        writer.close()
+        self.assertEqual(writer.rows_written, len(TICKETS))
+        self.assertEqual(writer.chunks_written, (len(TICKETS) + 1) // 2)
+        with self.assertRaises(ValueError):
+            writer.write(self.resolutions[0])
+
+        rows = list(csv.DictReader(io.StringIO(stream.getvalue())))
+        for row, expected in zip(rows, expected_rows(self.resolutions), strict=True):
+            self.assertEqual(float(row.pop("sentiment")), expected.pop("sentiment"))
+            self.assertEqual(float(row.pop("confidence_score")), expected.pop("confidence_score"))
+            self.assertEqual(row.pop("requires_approval"), "true" if expected.pop("requires_approval") else "false")
+            self.assertEqual(json.loads(row.pop("key_points")), expected.pop("key_points"))
+            self.assertEqual(row, expected)
+
+        with self.assertRaises(ValueError):
+            CsvResolutionWriter(io.StringIO(), chunk_rows=0)
+
+    def test_open_writer_formats(self):
+        with open_writer(os.path.join(self.directory.name, "out.csv")) as writer:
+            writer.write_many(self.resolutions)
+        self.assertIsInstance(writer, CsvResolutionWriter)
+        with self.assertRaises(ValueError):
+            open_writer(os.path.join(self.directory.name, "out.txt"))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow_and_parquet(self):
+        arrow_path = os.path.join(self.directory.name, "out.arrow")
+        parquet_path = os.path.join(self.directory.name, "out.parquet")
+        for path in (arrow_path, parquet_path):
+            with open_writer(path, chunk_rows=3) as writer:
+                writer.write_many(self.resolutions)
+            self.assertIsInstance(writer, ArrowResolutionWriter)
+
+        arrow_table = pyarrow.ipc.open_file(arrow_path).read_all()
+        parquet_file = pyarrow.parquet.ParquetFile(parquet_path)
+        self.assertEqual(parquet_file.num_row_groups, (len(TICKETS) + 2) // 3)
+        self.assertEqual(arrow_table.to_pylist(), expected_rows(self.resolutions))
+        self.assertEqual(parquet_file.read().to_pylist(), expected_rows(self.resolutions))
+        self.assertEqual(str(arrow_table.schema.field("priority").type), "dictionary<values=string, indices=int8, ordered=0>")
+        self.assertEqual(len(arrow_table.column("business_impact").chunks), (len(TICKETS) + 2) // 3)
+
+    async def test_pipeline_export(self):
+        input_stream = io.StringIO("".join(json.dumps(ticket) + "\n" for ticket in TICKETS))
+        export_stream = io.StringIO()
+        export = CsvResolutionWriter(export_stream, chunk_rows=4)
+        stats = await run_pipeline(TicketProcessor(), input_stream, io.StringIO(), RESPONSE_TEMPLATES, batch_size=3, export=export)
+        export.close()
+        self.assertEqual(stats["tickets"], len(TICKETS))
+        rows = list(csv.DictReader(io.StringIO(export_stream.getvalue())))
+        self.assertEqual([row["ticket_id"] for row in rows], [ticket["id"] for ticket in TICKETS])
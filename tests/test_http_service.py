@@ -0,0 +1,83 @@
+import asyncio
+import json
+import unittest
+import urllib.error
+import urllib.request
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.http_service import TicketService
+from data_classes import resolution_to_dict
+from tests.templates import *
+from tests.helpers import RecordingProcessor
+
+
+## tests for the HTTP service, requests are sent with urllib from a thread so the server keeps running on the event loop
+
+class TestHttpService(unittest.IsolatedAsyncioTestCase):
+    async def start(self, **options):
+        self.processor = RecordingProcessor()
+        self.service = TicketService(self.processor, RESPONSE_TEMPLATES, **options)
+        await self.service.start("127.0.0.1", 0)
+        self.addAsyncCleanup(self.service.close)
+
+    async def request(self, method: str, path: str, payload=None, body: bytes = None):
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(f"http://127.0.0.1:{self.service.port}{path}", data=body, method=method,
+                                         headers={"Content-Type": "application/json"})
+
+        def send():
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    return response.status, response.read().decode("utf-8"), dict(response.headers)
+            except urllib.error.HTTPError as e:
+                return e.code, e.read().decode("utf-8"), dict(e.headers)
+
+        return await asyncio.to_thread(send)
+
+    async def test_single_ticket_array_and_errors(self):
+        await self.start(batch_window=0.001)
+        expected = await TicketProcessor().process_batch(SAMPLE_TICKETS, RESPONSE_TEMPLATES)
+
+        status, body, _ = await self.request("POST", "/tickets", SAMPLE_TICKETS[0])
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), resolution_to_dict(expected[0]))
+
+        status, body, _ = await self.request("POST", "/tickets", SAMPLE_TICKETS)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [resolution_to_dict(resolution) for resolution in expected])
+
+        self.assertEqual((await self.request("POST", "/tickets", body=b"{not json"))[0], 400)
+        self.assertEqual((await self.request("POST", "/tickets", [1, 2]))[0], 400)
+        self.assertEqual((await self.request("GET", "/tickets"))[0], 405)
+        self.assertEqual((await self.request("GET", "/nothing"))[0], 404)
+
+        status, body, _ = await self.request("GET", "/health")
+        self.assertEqual((status, json.loads(body)["status"]), (200, "ok"))
+        status, body, headers = await self.request("GET", "/metrics")
+        self.assertEqual(status, 200)
+        self.assertIn("ticket_processing_tickets_processed_total", body)
+        self.assertTrue(headers["Content-Type"].startswith("text/plain"))
+
+    async def test_concurrent_requests_share_a_batch(self):
+        await self.start(batch_window=0.5, max_batch_size=5)
+        tickets = [dict(SAMPLE_TICKETS[i % 2], id=f"TKT-{i}") for i in range(5)]
+        results = await asyncio.gather(*(self.request("POST", "/tickets", ticket) for ticket in tickets))
+        self.assertEqual([json.loads(body)["ticket_id"] for _, body, _ in results], [f"TKT-{i}" for i in range(5)])
+        # the batch was full before the window ran out, so all five went through together
+        self.assertEqual(self.processor.batch_sizes, [5])
+
+    async def test_full_queue_answers_429(self):
+        await self.start(batch_window=0, max_queue=2)
+        self.processor.release.clear()
+        waiting = asyncio.ensure_future(self.request("POST", "/tickets", SAMPLE_TICKETS))
+        while self.service.batcher.depth < 2:
+            await asyncio.sleep(0.01)
+
+        status, _, headers = await self.request("POST", "/tickets", SAMPLE_TICKETS[0])
+        self.assertEqual(status, 429)
+        self.assertEqual(headers["Retry-After"], "1")
+        self.assertEqual((await self.request("POST", "/tickets", SAMPLE_TICKETS * 2))[0], 413)
+
+        self.processor.release.set()
+        self.assertEqual((await waiting)[0], 200)
+        self.assertEqual((await self.request("POST", "/tickets", SAMPLE_TICKETS[0]))[0], 200)
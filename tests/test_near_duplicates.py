@@ -0,0 +1,92 @@
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.near_duplicates import NearDuplicateIndex
+from data_classes import *
+from tests.templates import *
+from tests.helpers import FakeClock
+
+
+## tests for the near duplicate index and the cluster ids on resolutions
+
+OUTAGE = ("Our payment dashboard is down since 9am and customers cannot check out. We see error 502 on every request "
+          "to the checkout API. This is blocking all revenue for the shop, please escalate this to the on call engineer asap.")
+
+
+def outage_report(number: int) -> str:
+    # the same report as sent by different customers of the shop
+    return f"Hello support,\n{OUTAGE}\nTicket {number}"
+
+
+class TestNearDuplicateIndex(unittest.IsolatedAsyncioTestCase):
+    def test_near_duplicates_share_a_cluster(self):
+        index = NearDuplicateIndex()
+        first = index.assign(outage_report(1))
+        self.assertEqual(first.similarity, 0.0)
+        for number in range(2, 6):
+            match = index.assign(outage_report(number))
+            self.assertEqual(match.cluster_id, first.cluster_id)
+            self.assertGreaterEqual(match.similarity, index.threshold)
+
+        other = index.assign(SAMPLE_TICKETS[1]["content"])
+        self.assertNotEqual(other.cluster_id, first.cluster_id)
+        self.assertIsNone(index.assign("  ...  "))  # no words, not indexed
+        self.assertEqual(index.stats()["size"], 6)
+
+        signature = index.signature(OUTAGE)
+        self.assertEqual(len(signature), index.num_hashes)
+        self.assertEqual(index.similarity(signature, index.signature(OUTAGE)), 1.0)
+
+    def test_window_and_max_size(self):
+        clock = FakeClock(1000.0)
+        index = NearDuplicateIndex(window=60, max_size=3, clock=clock)
+        first = index.assign(outage_report(1))
+        clock.now += 61
+        # the first report is out of the window, so this one starts a new cluster
+        second = index.assign(outage_report(2))
+        self.assertNotEqual(second.cluster_id, first.cluster_id)
+        self.assertEqual(len(index), 1)
+
+        contents = [ticket["content"] for ticket in EDGE_CASE_TICKETS + AMBIGUOUS_TICKETS] + [SAMPLE_TICKETS[1]["content"]]
+        for content in contents:
+            index.assign(content)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.stats()["evictions"], 1 + len(contents) - 2)  # the old report, then the oldest ones over max_size
+        self.assertNotEqual(index.assign(outage_report(3)).cluster_id, second.cluster_id)
+
+        with self.assertRaises(ValueError):
+            NearDuplicateIndex(threshold=0.9, reuse_threshold=0.5)
+
+    async def test_processor_cluster_ids_and_reuse(self):
+        tickets = [{"id": f"TKT-{number}", "content": outage_report(number), "customer_info": {"role": "Shop Owner", "name": "Sam"}}
+                   for number in range(4)]
+        tickets.append(SAMPLE_TICKETS[1])
+
+        plain = TicketProcessor()
+        expected = await plain.process_batch(tickets, RESPONSE_TEMPLATES)
+        self.assertTrue(all(resolution.cluster_id is None for resolution in expected))
+        self.assertNotIn("cluster_id", resolution_to_dict(expected[0]))
+
+        index = NearDuplicateIndex(reuse_threshold=0.8)
+        processor = TicketProcessor(near_duplicates=index)
+        resolutions = await processor.process_batch(tickets[:1], RESPONSE_TEMPLATES)
+        resolutions += await processor.process_batch(tickets[1:], RESPONSE_TEMPLATES)
+        clusters = [resolution.cluster_id for resolution in resolutions]
+        self.assertEqual(len(set(clusters[:4])), 1)
+        self.assertNotEqual(clusters[4], clusters[0])
+        self.assertEqual(resolution_to_dict(resolutions[1])["cluster_id"], clusters[0])
+
+        # the first report was analysed, the others in the later batch reused its analysis
+        self.assertEqual(index.stats()["reuses"], 3)
+        self.assertEqual([resolution.analysis for resolution in resolutions], [resolution.analysis for resolution in expected])
+
+        # single tickets too, and a customer with another role is analysed again (the role changes the priority)
+        ceo_ticket = {"id": "TKT-CEO", "content": outage_report(9), "customer_info": {"role": "CEO"}}
+        resolution = await processor.process_ticket(ceo_ticket, RESPONSE_TEMPLATES)
+        self.assertEqual(resolution.cluster_id, clusters[0])
+        self.assertEqual(index.stats()["reuses"], 3)
+        self.assertEqual(resolution.analysis, (await plain.process_ticket(ceo_ticket, RESPONSE_TEMPLATES)).analysis)
+
+        self.assertEqual(CompactResolution.from_resolution(resolution).to_resolution(), resolution)
+        table = ResolutionTable(resolutions + [resolution])
+        self.assertEqual(table.cluster_ids, clusters + [clusters[0]])  # a plain column, cluster ids are nearly unique
+        self.assertEqual(table[len(resolutions)].cluster_id, clusters[0])
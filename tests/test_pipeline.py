@@ -0,0 +1,49 @@
+import io
+import json
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.pipeline import run_pipeline
+from tests.templates import *
+
+
+## tests for the non interactive JSONL pipeline
+
+class TestTicketPipeline(unittest.IsolatedAsyncioTestCase):
+    async def test_jsonl_in_resolutions_out(self):
+        # every ticket line gives one resolution line, blank lines are ignored and bad lines are skipped
+        lines = [json.dumps(ticket) for ticket in SAMPLE_TICKETS + EDGE_CASE_TICKETS] + ["", "not json", "[1, 2]"] + [json.dumps(AMBIGUOUS_TICKETS[0])]
+        output = io.StringIO()
+        stats = await run_pipeline(TicketProcessor(), io.StringIO("\n".join(lines)), output, RESPONSE_TEMPLATES, batch_size=2)
+
+        self.assertEqual(stats, {"tickets": 4, "skipped_lines": 2})
+        resolutions = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([r["ticket_id"] for r in resolutions], ["TKT-001", "TKT-002", "TKT-003", "TKT-004"])
+        self.assertEqual(resolutions[0]["analysis"]["category"], "ACCESS")
+        self.assertEqual(resolutions[0]["analysis"]["priority"], "URGENT")
+        self.assertIn("John Smith", resolutions[0]["response"]["response_text"])
+
+    async def test_reader_does_not_run_ahead_of_processor(self):
+        # the input is only read a bounded number of batches ahead of what has been processed
+        lines_read = 0
+
+        def ticket_lines():
+            nonlocal lines_read
+            for i in range(500):
+                lines_read += 1
+                yield json.dumps({"id": f"TKT-{i}", "content": "I cannot login", "customer_info": {"role": "User"}}) + "\n"
+
+        processor = TicketProcessor()
+        process_batch = processor.process_batch
+        processed = 0
+        most_read_ahead = 0
+
+        async def checking_process_batch(tickets, response_templates):
+            nonlocal processed, most_read_ahead
+            most_read_ahead = max(most_read_ahead, lines_read - processed)
+            processed += len(tickets)
+            return await process_batch(tickets, response_templates)
+
+        processor.process_batch = checking_process_batch
+        stats = await run_pipeline(processor, ticket_lines(), io.StringIO(), RESPONSE_TEMPLATES, batch_size=10, max_pending_batches=2)
+        self.assertEqual(stats["tickets"], 500)
+        self.assertLessEqual(most_read_ahead, 40)
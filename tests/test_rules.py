@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.resolution_cache import ResolutionCache
+from ai_agents.rules import compile_rules, load_rules_file
+from ai_agents.ticket_analysis_agent import TicketAnalysisAgent
+from data_classes import *
+
+
+## tests for rules files and reloading them
+
+REFUND_TICKET = "I would like a refund for last month, please."
+
+
+class TestRules(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "rules.json")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_rules(self, rules: dict):
+        with open(self.path, "w", encoding="utf-8") as rules_file:
+            json.dump(rules, rules_file)
+        # make sure the reloader sees a change even when the file is written twice within the clock resolution
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def billing_rules(self, keywords: list) -> dict:
+        return {"categories": {"billing": {"keywords": keywords, "expertise": ["Refunds team."], "response_type": "billing_inquiry"}},
+                "urgency_keywords": ["asap"]}
+
+    async def test_rules_file_replaces_defaults(self):
+        self.write_rules(self.billing_rules(["refund"]))
+        agent = TicketAnalysisAgent(rules_path=self.path)
+        analysis = await agent.analyze_ticket(REFUND_TICKET, {"role": "User"})
+        self.assertEqual(analysis.category, TicketCategory.BILLING)
+        self.assertEqual(analysis.required_expertise, ["Refunds team."])
+        self.assertEqual(analysis.follow_up_prediction, "")
+        # keys left out of the file keep the built in tables
+        self.assertEqual(agent.rules.impact_words, tuple(agent.impact_words))
+
+        default = TicketAnalysisAgent()
+        self.assertEqual(default.rules.fingerprint, compile_rules(default.default_rules()).fingerprint)
+        self.assertNotEqual(default.rules.fingerprint, agent.rules.fingerprint)
+
+    async def test_invalid_rules_are_rejected(self):
+        for rules in ({"categories": {"shipping": {"keywords": ["parcel"]}}}, {"urgency_keywords": "asap"},
+                      {"categories": {"billing": {"keywords": [""]}}}, {"unknown_table": []}):
+            with self.assertRaises(ValueError):
+                compile_rules(rules)
+
+    async def test_yaml_rules_file(self):
+        try:
+            import yaml
+        except ImportError:
+            self.skipTest("PyYAML is not installed")
+        path = os.path.join(self.folder.name, "rules.yaml")
+        with open(path, "w", encoding="utf-8") as rules_file:
+            yaml.safe_dump(self.billing_rules(["refund"]), rules_file)
+        self.assertEqual(load_rules_file(path), self.billing_rules(["refund"]))
+
+    async def test_changed_rules_file_is_swapped_in(self):
+        self.write_rules(self.billing_rules(["invoice"]))
+        cache = ResolutionCache()
+        processor = TicketProcessor(resolution_cache=cache, rules_path=self.path)
+        agent = processor.analysis_agent
+        ticket = {"id": "TKT-100", "content": REFUND_TICKET, "customer_info": {"role": "User", "name": "Sam"}}
+        before = await processor.process_ticket(ticket, {})
+        self.assertEqual(before.analysis.category, TicketCategory.TECHNICAL)
+        old_rules = agent.rules
+
+        reloader = agent.watch_rules(interval=3600)
+        try:
+            self.write_rules(self.billing_rules(["invoice", "refund"]))
+            self.assertTrue(reloader.check())
+            self.assertIsNot(agent.rules, old_rules)
+            # the cached analysis was made with the old rules, so it is not used
+            after = await processor.process_ticket(ticket, {})
+            self.assertEqual(after.analysis.category, TicketCategory.BILLING)
+            self.assertEqual(cache.stats()["hits"], 0)
+
+            # a broken file keeps the rules that are in use
+            rules = agent.rules
+            with open(self.path, "w", encoding="utf-8") as rules_file:
+                rules_file.write("{not json")
+            os.utime(self.path, ns=(0, 1))
+            self.assertFalse(reloader.check())
+            self.assertIs(agent.rules, rules)
+            self.assertIsNotNone(reloader.last_error)
+        finally:
+            processor.close()
+
+    async def test_thread_state_follows_reloaded_rules(self):
+        self.write_rules(self.billing_rules(["invoice"]))
+        agent = TicketAnalysisAgent(rules_path=self.path)
+        state = agent.thread_state({"role": "User"})
+        await agent.analyze_appended(state, REFUND_TICKET + "\n")
+
+        self.write_rules(self.billing_rules(["refund"]))
+        agent.reload_rules()
+        thread = REFUND_TICKET + "\nStill waiting for the refund ASAP"
+        analysis = await agent.analyze_appended(state, "Still waiting for the refund ASAP")
+        self.assertEqual(analysis, await agent.analyze_ticket(thread, {"role": "User"}))
+        self.assertEqual(analysis.key_points, [REFUND_TICKET, "Still waiting for the refund ASAP"])
@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.scheduler import PriorityScheduler
+from data_classes import *
+from tests.templates import *
+from tests.helpers import FakeClock, RecordingProcessor
+from ai_agents.metrics import metrics
+
+
+## tests for the priority scheduler
+
+def urgent_ticket(number: int) -> dict:
+    return {"id": f"U{number}", "content": "The billing dashboard is down, fix it asap!", "customer_info": {"role": "CEO"}}
+
+
+def low_ticket(number: int) -> dict:
+    return {"id": f"L{number}", "content": "Could you add a dark mode feature?", "customer_info": {"role": "User"}}
+
+
+class TestPriorityScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_weighted_fair_order(self):
+        processor = RecordingProcessor()
+        scheduler = PriorityScheduler(processor, RESPONSE_TEMPLATES, concurrency=1, urgent_workers=0)
+        # queued before the worker starts, so the whole burst is waiting when scheduling begins
+        futures = [scheduler.submit(low_ticket(number)) for number in range(10)]
+        futures += [scheduler.submit(urgent_ticket(number)) for number in range(16)]
+        self.assertEqual(scheduler.stats()["LOW"]["depth"], 10)
+        self.assertEqual(scheduler.stats()["URGENT"]["depth"], 16)
+
+        async with scheduler:
+            resolutions = await asyncio.gather(*futures)
+
+        # 8 URGENT to 1 LOW while both are waiting, LOW tickets are not starved until the URGENT ones are done
+        first = processor.order[:18]
+        self.assertEqual(sum(ticket_id.startswith("U") for ticket_id in first), 16)
+        self.assertEqual(processor.order[18:], [f"L{number}" for number in range(2, 10)])
+        self.assertEqual([resolution.ticket_id for resolution in resolutions], [f"L{number}" for number in range(10)] +
+                         [f"U{number}" for number in range(16)])
+        self.assertEqual(resolutions[-1].analysis.priority, Priority.URGENT)
+
+        stats = scheduler.stats()
+        self.assertEqual((stats["URGENT"]["completed"], stats["LOW"]["completed"], stats["LOW"]["depth"]), (16, 10, 0))
+
+    async def test_starvation_protection_and_urgent_slo(self):
+        clock = FakeClock()
+        processor = RecordingProcessor(clock, step=0.3)
+        scheduler = PriorityScheduler(processor, RESPONSE_TEMPLATES, concurrency=1, urgent_workers=0, max_wait=5.0,
+                                      urgent_slo=1.0, clock=clock)
+        futures = [scheduler.submit(low_ticket(0))]
+        clock.now += 6.0
+        futures += [scheduler.submit(urgent_ticket(number)) for number in range(4)]
+        async with scheduler:
+            await asyncio.gather(*futures)
+
+        # the LOW ticket waited past max_wait, so it went first even with URGENT tickets waiting
+        self.assertEqual(processor.order[0], "L0")
+        stats = scheduler.stats()
+        self.assertEqual(stats["LOW"]["starvation_promotions"], 1)
+        self.assertAlmostEqual(stats["LOW"]["wait_max_ms"], 6000.0)
+        # URGENT tickets finished 0.6, 0.9, 1.2 and 1.5 seconds after they came in
+        self.assertEqual(stats["URGENT"]["slo_misses"], 2)
+        self.assertAlmostEqual(stats["URGENT"]["wait_max_ms"], 1200.0)
+
+    async def test_one_keyword_scan_and_fair_credit(self):
+        # the triage made when a ticket is submitted is reused for processing, the keyword scan runs once per ticket
+        metrics.reset()
+        metrics.enable()
+        try:
+            async with PriorityScheduler(TicketProcessor(), RESPONSE_TEMPLATES) as scheduler:
+                resolutions = await scheduler.process_many(SAMPLE_TICKETS + EDGE_CASE_TICKETS)
+            stages = metrics.snapshot()["stages"]
+        finally:
+            metrics.disable()
+            metrics.reset()
+        self.assertEqual(stages["category_matching"]["count"], len(resolutions))
+        self.assertEqual(stages["process_ticket"]["count"], len(resolutions))
+        self.assertEqual(stages["generate_response"]["count"], len(resolutions))
+
+        # a ticket taken by starvation protection pays for its turn, and an empty queue does not keep credit or debt
+        clock = FakeClock()
+        scheduler = PriorityScheduler(TicketProcessor(), RESPONSE_TEMPLATES, max_wait=5.0, clock=clock)
+        scheduler.submit(low_ticket(0))
+        clock.now += 6.0
+        for number in range(3):
+            scheduler.submit(urgent_ticket(number))
+        self.assertEqual(scheduler._take(urgent_only=False).ticket["id"], "L0")
+        self.assertEqual((scheduler._credit[Priority.URGENT], scheduler._credit[Priority.LOW]), (8, 1 - 9))
+        self.assertEqual(scheduler._take(urgent_only=False).ticket["id"], "U0")
+        self.assertEqual(scheduler._credit[Priority.LOW], 0)
+        # the URGENT SLO path is charged as well
+        scheduler.submit(low_ticket(1))
+        clock.now += 0.5
+        self.assertEqual(scheduler._take(urgent_only=False).ticket["id"], "U1")
+        self.assertEqual((scheduler._credit[Priority.URGENT], scheduler._credit[Priority.LOW]), (8 + 8 - 9, 1))
+        await scheduler.close()
+
+    async def test_bad_tickets_and_full_queue(self):
+        scheduler = PriorityScheduler(TicketProcessor(), RESPONSE_TEMPLATES, max_queue=2)
+        async with scheduler:
+            bad = scheduler.submit({"id": "BAD", "content": None})
+            good = scheduler.submit(SAMPLE_TICKETS[0])
+            with self.assertRaises(asyncio.QueueFull):
+                scheduler.submit(SAMPLE_TICKETS[1])
+            self.assertIn("error", (await bad).response.response_text.lower())
+            self.assertEqual(await good, await TicketProcessor().process_ticket(SAMPLE_TICKETS[0], RESPONSE_TEMPLATES))
+            self.assertEqual(await scheduler.process(SAMPLE_TICKETS[1]), await TicketProcessor().process_ticket(SAMPLE_TICKETS[1], RESPONSE_TEMPLATES))
+
+        with self.assertRaises(ValueError):
+            PriorityScheduler(TicketProcessor(), RESPONSE_TEMPLATES, weights={Priority.URGENT: 1})
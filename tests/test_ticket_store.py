@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.ticket_store import TicketStore
+from data_classes import *
+from tests.templates import *
+from tests.helpers import FakeClock
+
+
+## tests for the persistent ticket store and its queries
+
+def customer_ticket(number: int, name: str, role: str = "User") -> dict:
+    return {"id": f"TKT-{number}", "content": "I can't login, the dashboard says 403 forbidden, fix it asap!",
+            "customer_info": {"name": name, "role": role}}
+
+
+class TestTicketStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "tickets.db")
+        self.clock = FakeClock(1000.0)
+        self.store = TicketStore(self.path, clock=self.clock)
+
+    def tearDown(self):
+        self.store.close()
+        self.folder.cleanup()
+
+    async def test_processed_tickets_are_stored_and_found(self):
+        processor = TicketProcessor(store=self.store)
+        tickets = SAMPLE_TICKETS + EDGE_CASE_TICKETS + AMBIGUOUS_TICKETS
+        resolutions = await processor.process_batch(tickets, RESPONSE_TEMPLATES)
+        self.clock.now += 7200
+        later = [customer_ticket(number, "John Smith", "CEO") for number in range(3)]
+        for ticket in later:
+            self.clock.now += 1
+            await processor.process_ticket(ticket, RESPONSE_TEMPLATES)
+        self.assertTrue(self.store.flush(timeout=10))
+        self.assertEqual(len(self.store), len(tickets) + 3)
+
+        stored = self.store.get(SAMPLE_TICKETS[0]["id"])
+        self.assertEqual(stored.resolution, resolution_to_dict(resolutions[0]))
+        self.assertEqual((stored.customer_name, stored.customer_role), ("John Smith", "Admin"))
+        self.assertEqual((stored.category, stored.priority), (resolutions[0].analysis.category, resolutions[0].analysis.priority))
+        self.assertIsNone(self.store.get("TKT-NONE"))
+
+        # the last hour: only the later tickets, newest first
+        recent = list(self.store.recent(3600, category=TicketCategory.ACCESS, priority=Priority.URGENT))
+        self.assertEqual([ticket.ticket_id for ticket in recent], ["TKT-2", "TKT-1", "TKT-0"])
+        self.assertEqual(self.store.recent(3600, min_priority=Priority.HIGH).count(), 3)
+        self.assertEqual(self.store.find(until=self.clock.now - 3600).count(), len(tickets))
+
+        history = self.store.customer_history("John Smith")
+        self.assertEqual([ticket.ticket_id for ticket in history], ["TKT-2", "TKT-1", "TKT-0", SAMPLE_TICKETS[0]["id"]])
+        self.assertEqual(self.store.find(customer_role="CEO").count(), 3)
+
+    def test_paging_and_group_commit(self):
+        resolution = TicketResolution("TKT-0", TicketAnalysis(TicketCategory.BILLING, Priority.LOW, [], [], 0.0, [], "Low", "billing"),
+                                      ResponseSuggestion("Hello", 0.5, False, []))
+        store = TicketStore(os.path.join(self.folder.name, "paged.db"), batch_size=50, max_pending=20, clock=self.clock)
+        try:
+            for number in range(205):
+                self.clock.now += 0.5 if number % 2 else 0.0  # rows with the same time still page correctly
+                store.add(customer_ticket(number, f"Customer {number % 5}"), resolution)
+            self.assertTrue(store.flush(timeout=10))
+            stats = store.stats()
+            self.assertEqual((stats["written"], stats["pending"], stats["failed"]), (205, 0, 0))
+            self.assertLessEqual(stats["commits"], 205)
+
+            query = store.find(customer_name="Customer 1", page_size=7)
+            pages = list(query.pages())
+            self.assertEqual([len(page) for page in pages], [7] * 5 + [6])
+            rows = [ticket.row_id for page in pages for ticket in page]
+            self.assertEqual(rows, sorted(rows, reverse=True))
+            self.assertEqual(len(set(rows)), 41)
+            self.assertEqual(len(query.first(10)), 10)
+        finally:
+            store.close()
+
+        # everything was committed before close() returned, a new store on the same file sees it
+        with self.assertRaises(ValueError):
+            store.add(customer_ticket(0, "Late"), resolution)
+        reopened = TicketStore(os.path.join(self.folder.name, "paged.db"))
+        try:
+            self.assertEqual(len(reopened), 205)
+        finally:
+            reopened.close()
+
+        with self.assertRaises(ValueError):
+            TicketStore(self.path, batch_size=0)
+
+    async def test_full_store_does_not_block_the_event_loop(self):
+        path = os.path.join(self.folder.name, "slow.db")
+        store = TicketStore(path, max_pending=2, clock=self.clock)
+        processor = TicketProcessor(store=store)
+        processor.warm_up()
+        # another connection holds the write lock, like a disk that does not keep up
+        blocker = sqlite3.connect(path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        try:
+            batch = asyncio.ensure_future(processor.process_batch([customer_ticket(n, "Sam") for n in range(6)], RESPONSE_TEMPLATES))
+            await asyncio.sleep(0.1)
+            self.assertFalse(batch.done())  # waiting for room in the store, off the event loop
+            before = ticks
+            await asyncio.sleep(0.2)
+            self.assertGreater(ticks - before, 10)
+            late = await TicketProcessor().process_ticket(customer_ticket(7, "Sam"), RESPONSE_TEMPLATES)
+            self.assertFalse(store.try_add(customer_ticket(7, "Sam"), late))  # full, nothing queued
+            # the second stage of a triaged ticket is read on the event loop too, it is stored once there is room
+            triaged = await processor.triage_ticket(customer_ticket(8, "Sam"), RESPONSE_TEMPLATES)
+            self.assertEqual(triaged.resolution.ticket_id, "TKT-8")
+
+            blocker.execute("COMMIT")
+            await batch
+            self.assertTrue(await asyncio.to_thread(store.flush, 10))
+            self.assertEqual(len(store), 7)
+            self.assertIsNotNone(store.get("TKT-8"))
+        finally:
+            ticker.cancel()
+            blocker.close()
+            store.close()
+
+    async def test_triaged_ticket_on_a_full_store_is_queued_in_order(self):
+        path = os.path.join(self.folder.name, "overflow.db")
+        store = TicketStore(path, max_pending=2, clock=self.clock)
+        processor = TicketProcessor(store=store)
+        blocker = sqlite3.connect(path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            # two rows taken by the writer, which waits for the lock, and two more waiting: the store is full
+            for number in range(4):
+                await processor.process_ticket(customer_ticket(number, "Sam"), RESPONSE_TEMPLATES)
+                for _ in range(200):
+                    if number != 1 or store.stats()["pending"] == 0:
+                        break
+                    await asyncio.sleep(0.01)
+            self.assertEqual(store.stats()["pending"], 2)
+            self.assertFalse(store.try_add(customer_ticket(9, "Sam"), await TicketProcessor().process_ticket(
+                customer_ticket(9, "Sam"), RESPONSE_TEMPLATES)))
+
+            # read on the event loop: the rows are counted straight away, so flush() waits for them
+            triaged = [await processor.triage_ticket(customer_ticket(number, "Sam"), RESPONSE_TEMPLATES) for number in (4, 5)]
+            self.assertEqual([ticket.resolution.ticket_id for ticket in triaged], ["TKT-4", "TKT-5"])
+            self.assertEqual((store.stats()["added"], store.stats()["pending"]), (6, 4))
+            blocker.execute("COMMIT")
+            self.assertTrue(await asyncio.to_thread(store.flush, 10))
+            history = store.customer_history("Sam")
+            self.assertEqual(history.count(), 6)
+            self.assertEqual([ticket.ticket_id for ticket in history][::-1], [f"TKT-{number}" for number in range(6)])
+        finally:
+            blocker.close()
+            store.close()
+
+    async def test_a_closed_store_does_not_lose_the_resolution(self):
+        processor = TicketProcessor(store=self.store)
+        self.store.close()
+        ticket = customer_ticket(0, "Sam")
+        expected = await TicketProcessor().process_ticket(ticket, RESPONSE_TEMPLATES)
+        self.assertEqual(await processor.process_ticket(ticket, RESPONSE_TEMPLATES), expected)
+        self.assertEqual(await processor.process_batch([ticket, ticket], RESPONSE_TEMPLATES), [expected, expected])
+        self.assertEqual((await processor.triage_ticket(ticket, RESPONSE_TEMPLATES)).resolution, expected)
+        # the work queue must not acknowledge a ticket that was not stored
+        with self.assertRaises(ValueError):
+            await processor.process_ticket(ticket, RESPONSE_TEMPLATES, raise_errors=True)
@@ -0,0 +1,50 @@
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.sentiment import get_analyzer
+from benchmarks.synthetic import generate_tickets
+from tests.templates import *
+
+try:
+    from ai_agents.vector_sentiment import VectorSentiment, np
+except ImportError:
+    np = None
+
+
+## tests for the NumPy sentiment engine, it has to give the same scores as nltk's VADER
+
+TRICKY_TEXTS = [
+    "",
+    "a ! ?",
+    "The product is not good, but the support team was GREAT!!!",
+    "It was kind of ok. It was sort of bad. I am hardly happy and never so disappointed",
+    "yeah right, that is the bomb... bad ass feature, cut the mustard",
+    "at least it works, very least it crashed, least good",
+    "I LOVE it but I HATE the login :( ?? ,good good, 'great' !great great!",
+    "Extremely VERY terrible, isn't nice, without doubt helpful",
+]
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestVectorSentiment(unittest.IsolatedAsyncioTestCase):
+    def test_same_scores_as_vader(self):
+        analyzer = get_analyzer()
+        texts = TRICKY_TEXTS + [ticket["content"] for ticket in SAMPLE_TICKETS + EDGE_CASE_TICKETS + AMBIGUOUS_TICKETS]
+        texts += [ticket["content"] for ticket in generate_tickets(300, seed=5)]
+        engine = VectorSentiment()
+        self.assertEqual(engine.polarity_scores_batch(texts), [analyzer.polarity_scores(text) for text in texts])
+        # the second batch uses the vocabulary of the first one
+        self.assertEqual(engine.polarity_scores_batch(texts[::-1]), [analyzer.polarity_scores(text) for text in texts[::-1]])
+        self.assertEqual(engine.polarity_scores_batch([]), [])
+
+    def test_vocabulary_is_rebuilt_when_too_large(self):
+        analyzer = get_analyzer()
+        engine = VectorSentiment(max_vocabulary=50)
+        for ticket in generate_tickets(20, seed=2):
+            self.assertEqual(engine.polarity_scores(ticket["content"]), analyzer.polarity_scores(ticket["content"]))
+            self.assertLess(len(engine._words), 50 + len(ticket["content"].split()) + 1)
+
+    async def test_batch_mode_gives_the_same_resolutions(self):
+        tickets = SAMPLE_TICKETS + EDGE_CASE_TICKETS + AMBIGUOUS_TICKETS + [{"id": "TKT-BAD", "content": 42}]
+        expected = await TicketProcessor().process_batch(tickets, RESPONSE_TEMPLATES)
+        resolutions = await TicketProcessor(vectorized_sentiment=True).process_batch(tickets, RESPONSE_TEMPLATES)
+        self.assertEqual(resolutions, expected)
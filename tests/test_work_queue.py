@@ -0,0 +1,124 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from ai_agents.agent_orchestration import TicketProcessor
+from ai_agents.work_queue import DEAD, PENDING, QueueWorker, WorkQueue
+from data_classes import *
+from tests.templates import *
+
+
+## tests for the durable work queue and its workers
+
+class FlakyProcessor(TicketProcessor):
+    # fails the first failures tries of every ticket, tickets without content always fail
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+        self.tries = {}
+
+    async def process_ticket(self, ticket, response_templates, raise_errors=False):
+        self.tries[ticket["id"]] = self.tries.get(ticket["id"], 0) + 1
+        if self.tries[ticket["id"]] <= self.failures:
+            raise ConnectionError("worker lost")
+        return await super().process_ticket(ticket, response_templates, raise_errors)
+
+
+class TestWorkQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(os.path.join(self.folder.name, "queue.db"), max_attempts=3)
+
+    def tearDown(self):
+        self.queue.close()
+        self.folder.cleanup()
+
+    async def test_tickets_are_resolved_and_stored(self):
+        self.assertEqual(self.queue.enqueue(SAMPLE_TICKETS + EDGE_CASE_TICKETS), 3)
+        stats = await QueueWorker(TicketProcessor(), self.queue, RESPONSE_TEMPLATES, concurrency=2).run(until_empty=True)
+        self.assertEqual(stats["completed"], 3)
+        self.assertEqual(self.queue.counts(), {"pending": 0, "leased": 0, "done": 3, "dead": 0})
+
+        expected = await TicketProcessor().process_batch(SAMPLE_TICKETS + EDGE_CASE_TICKETS, RESPONSE_TEMPLATES)
+        self.assertEqual(list(self.queue.resolutions()), [resolution_to_dict(resolution) for resolution in expected])
+
+        # the queue is a file, a new WorkQueue on it sees the same tickets
+        reopened = WorkQueue(self.queue.path)
+        self.assertEqual(reopened.counts()["done"], 3)
+        self.assertEqual(reopened.purge_done(), 3)
+        reopened.close()
+
+    async def test_failures_are_retried_then_dead_lettered(self):
+        broken = {"id": "TKT-BROKEN", "content": 12345, "customer_info": {"role": "User"}}
+        self.queue.enqueue(SAMPLE_TICKETS + [broken])
+        worker = QueueWorker(FlakyProcessor(failures=1), self.queue, RESPONSE_TEMPLATES, backoff_base=0.0)
+        stats = await worker.run(until_empty=True)
+
+        # the good tickets failed once and went through on the retry, the broken one was retried twice and never gets the
+        # error resolution
+        self.assertEqual(stats, {"completed": 2, "retried": 4, "dead_lettered": 1, "lost_leases": 0})
+        dead = self.queue.dead_letters()
+        self.assertEqual([(letter["ticket"]["id"], letter["attempts"]) for letter in dead], [("TKT-BROKEN", 3)])
+        self.assertIn("AttributeError", dead[0]["error"])
+        self.assertNotIn("An error occurred", "".join(r["response"]["response_text"] for r in self.queue.resolutions()))
+
+        self.assertEqual(self.queue.retry_dead(), 1)
+        self.assertEqual(self.queue.counts()[PENDING], 1)
+
+    async def test_expired_lease_is_handed_out_again(self):
+        self.queue.enqueue(SAMPLE_TICKETS[:1], now=0)
+        first = self.queue.lease(lease_seconds=10, now=0)[0]
+        self.assertEqual(self.queue.lease(now=5), [])
+
+        # the first worker went quiet, after its lease ran out another worker gets the ticket
+        second = self.queue.lease(lease_seconds=10, now=11)[0]
+        self.assertEqual((second.job_id, second.attempt), (first.job_id, 2))
+        resolution = await TicketProcessor().process_ticket(second.ticket, RESPONSE_TEMPLATES)
+        self.assertFalse(self.queue.complete(first, resolution))
+        self.assertIsNone(self.queue.fail(first, "late", 0))
+        self.assertTrue(self.queue.complete(second, resolution))
+
+        # a ticket handed back untried does not use up an attempt
+        self.queue.enqueue(SAMPLE_TICKETS[:1], now=12)
+        item = self.queue.lease(now=12)[0]
+        self.assertTrue(self.queue.release(item, now=12))
+        item = self.queue.lease(now=13)[0]
+        self.assertEqual(item.attempt, 1)
+        self.assertTrue(self.queue.complete(item, resolution))
+
+        # a lease that runs out on the last attempt ends in the dead letters
+        self.queue.enqueue(SAMPLE_TICKETS[1:], now=20)
+        for now in (20, 40, 60):
+            self.assertEqual(len(self.queue.lease(lease_seconds=10, now=now)), 1)
+        self.assertEqual(self.queue.lease(now=80), [])
+        self.assertEqual(self.queue.counts()[DEAD], 1)
+        self.assertEqual(self.queue.dead_letters()[0]["error"], "lease ran out on attempt 3")
+
+    async def test_stuck_ticket_times_out_without_worker_processes(self):
+        # the analysis of one ticket blocks its thread, the event loop and the other tickets keep going
+        class BlockingProcessor(TicketProcessor):
+            async def process_ticket(self, ticket, response_templates, raise_errors=False):
+                if ticket["id"] == "TKT-STUCK":
+                    time.sleep(0.5)
+                return await super().process_ticket(ticket, response_templates, raise_errors)
+
+        self.queue.enqueue([{"id": "TKT-STUCK", "content": "Help", "customer_info": {}}] + SAMPLE_TICKETS)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        try:
+            worker = QueueWorker(BlockingProcessor(), self.queue, RESPONSE_TEMPLATES, concurrency=1, batch_size=1,
+                                 lease_seconds=5.0, ticket_timeout=0.1, backoff_base=0.0)
+            stats = await worker.run(until_empty=True)
+        finally:
+            ticker.cancel()
+        self.assertEqual((stats["completed"], stats["dead_lettered"]), (2, 1))
+        self.assertEqual(self.queue.dead_letters()[0]["error"], "timed out after 0.1s")
+        self.assertGreater(ticks, 15)